@@ -9,9 +9,9 @@ from core_data_modules.logging import Logger
 from core_data_modules.traced_data.io import TracedDataJsonIO
 from core_data_modules.util import IOUtils
 
-from configurations.code_schemes import CodeSchemes
+from configurations.code_schemes import CodeSchemes, CodeSchemeLookup
 from src import AnalysisUtils
-from src.lib import PipelineConfiguration
+from src.lib import PipelineConfiguration, LabelMatrix
 from src.lib.configuration_objects import CodingModes
 
 log = Logger(__name__)
@@ -181,19 +181,17 @@ if __name__ == "__main__":
                     continue
                 demographic_distributions[cc.analysis_file_key][code.string_value] = 0
 
-    for ind in individuals:
-        if ind["consent_withdrawn"] == Codes.TRUE:
-            continue
-
-        for plan in PipelineConfiguration.DEMOG_CODING_PLANS:
-            for cc in plan.coding_configurations:
-                if cc.analysis_file_key is None:
-                    continue
-
-                code = cc.code_scheme.get_code_with_code_id(ind[cc.coded_field]["CodeID"])
-                if code.control_code == Codes.STOP:
-                    continue
-                demographic_distributions[cc.analysis_file_key][code.string_value] += 1
+    demographic_ccs = [cc for plan in PipelineConfiguration.DEMOG_CODING_PLANS for cc in plan.coding_configurations
+                       if cc.analysis_file_key is not None]
+    # Individuals who withdrew consent have 'STOP' in place of their labels, so are excluded before building the matrix.
+    demographics_matrix = LabelMatrix([ind for ind in individuals if ind["consent_withdrawn"] != Codes.TRUE],
+                                      demographic_ccs)
+    for cc in demographic_ccs:
+        code_counts = demographics_matrix.code_counts(cc.coded_field)
+        for code, count in zip(demographics_matrix.scheme_index(cc.coded_field).codes, code_counts):
+            if code.control_code == Codes.STOP:
+                continue
+            demographic_distributions[cc.analysis_file_key][code.string_value] += count
 
     with open(f"{automated_analysis_output_dir}/demographic_distributions.csv", "w") as f:
         headers = ["Demographic", "Code", "Number of Individuals"]
@@ -236,16 +234,17 @@ if __name__ == "__main__":
                 if cc.analysis_file_key is None:
                     continue
 
+                lookup = CodeSchemeLookup.for_scheme(cc.code_scheme)
                 if cc.coding_mode == CodingModes.SINGLE:
-                    codes = [cc.code_scheme.get_code_with_code_id(td[cc.coded_field]["CodeID"])]
+                    code_flags = [lookup.flags(td[cc.coded_field]["CodeID"])]
                 else:
                     assert cc.coding_mode == CodingModes.MULTIPLE
-                    codes = [cc.code_scheme.get_code_with_code_id(label["CodeID"]) for label in td[cc.coded_field]]
+                    code_flags = [lookup.flags(label["CodeID"]) for label in td[cc.coded_field]]
 
-                for code in codes:
-                    if code.control_code == Codes.STOP:
+                for flags in code_flags:
+                    if flags.is_stop:
                         continue
-                    survey_counts[f"{cc.analysis_file_key}:{code.string_value}"] += 1
+                    survey_counts[f"{cc.analysis_file_key}:{flags.string_value}"] += 1
 
     def set_survey_percentages(survey_counts, total_survey_counts):
         if total_survey_counts["Total Participants"] == 0:
@@ -295,7 +294,7 @@ if __name__ == "__main__":
             for cc in episode_plan.coding_configurations:
                 assert cc.coding_mode == CodingModes.MULTIPLE, "Other CodingModes not (yet) supported"
                 for label in td[cc.coded_field]:
-                    code = cc.code_scheme.get_code_with_code_id(label["CodeID"])
+                    code = CodeSchemeLookup.for_scheme(cc.code_scheme).code_with_code_id(label["CodeID"])
                     if code.control_code == Codes.STOP:
                         continue
                     themes[f"{cc.analysis_file_key}{code.string_value}"]["Total Participants"] += 1
@@ -478,9 +477,9 @@ if __name__ == "__main__":
                     continue
 
                 code_string_values = set()
+                lookup = CodeSchemeLookup.for_scheme(cc.code_scheme)
                 for label in msg[cc.coded_field]:
-                    code = cc.code_scheme.get_code_with_code_id(label["CodeID"])
-                    code_string_values.add(code.string_value)
+                    code_string_values.add(lookup.flags(label["CodeID"]).string_value)
 
                 if "DNS" not in code_string_values:
                     for code_string_value in code_string_values:
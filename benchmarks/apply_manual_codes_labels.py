@@ -0,0 +1,107 @@
+import argparse
+import time
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.cleaners.cleaning_utils import CleaningUtils
+from core_data_modules.logging import Logger
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.util import TimeUtils
+
+from src import ApplyManualCodes
+from src.lib import PipelineConfiguration, MetadataFactory
+from src.lib.configuration_objects import CodingModes
+
+log = Logger(__name__)
+
+NOISE_PROBABILITY_PERCENT = 20
+
+
+def generate_data(user, messages_count):
+    """
+    Generates synthetic messages shaped like the Kakuma data: each message answers one radio show question, and some
+    are noise, so most of the coded fields of each message need a TRUE_MISSING or NOT_CODED label.
+    """
+    rqa_plans = PipelineConfiguration.RQA_CODING_PLANS
+
+    data = []
+    for i in range(messages_count):
+        plan = rqa_plans[i % len(rqa_plans)]
+        message_data = {
+            "uid": f"avf-phone-uuid-{i}",
+            plan.raw_field: "" if i % 10 == 0 else f"message {i}",
+            "noise": i % 100 < NOISE_PROBABILITY_PERCENT
+        }
+        data.append(TracedData(message_data, Metadata(user, "benchmark", TimeUtils.utc_now_as_iso_string())))
+
+    return data
+
+
+def impute_missing_and_noise_codes_per_message(user, data):
+    # The previous implementation of ApplyManualCodes._impute_missing_and_noise_codes, which builds a new label for
+    # every message and coded field.
+    metadata_factory = MetadataFactory(user)
+    for td in data:
+        missing_dict = dict()
+        for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
+            if plan.raw_field not in td:
+                for cc in plan.coding_configurations:
+                    na_label = CleaningUtils.make_label_from_cleaner_code(
+                        cc.code_scheme, cc.code_scheme.get_code_with_control_code(Codes.TRUE_MISSING),
+                        metadata_factory.call_location()
+                    ).to_dict()
+                    missing_dict[cc.coded_field] = na_label if cc.coding_mode == CodingModes.SINGLE else [na_label]
+            elif td[plan.raw_field] == "":
+                for cc in plan.coding_configurations:
+                    nc_label = CleaningUtils.make_label_from_cleaner_code(
+                        cc.code_scheme, cc.code_scheme.get_code_with_control_code(Codes.NOT_CODED),
+                        metadata_factory.call_location()
+                    ).to_dict()
+                    missing_dict[cc.coded_field] = nc_label if cc.coding_mode == CodingModes.SINGLE else [nc_label]
+        td.append_data(missing_dict, metadata_factory.metadata())
+
+    for td in data:
+        if td.get("noise", False):
+            nc_dict = dict()
+            for plan in PipelineConfiguration.RQA_CODING_PLANS:
+                for cc in plan.coding_configurations:
+                    if cc.coded_field not in td:
+                        nc_label = CleaningUtils.make_label_from_cleaner_code(
+                            cc.code_scheme, cc.code_scheme.get_code_with_control_code(Codes.NOT_CODED),
+                            metadata_factory.call_location()
+                        ).to_dict()
+                        nc_dict[cc.coded_field] = nc_label if cc.coding_mode == CodingModes.SINGLE else [nc_label]
+            td.append_data(nc_dict, metadata_factory.metadata())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the TRUE_MISSING and NOT_CODED labelling in "
+                                                 "ApplyManualCodes with label templates against the previous "
+                                                 "label-per-message implementation. "
+                                                 "Run from the repository root with "
+                                                 "`python -m benchmarks.apply_manual_codes_labels`")
+
+    parser.add_argument("--messages-counts", type=int, nargs="+", default=[10000, 100000],
+                        help="Numbers of synthetic messages to benchmark with")
+
+    args = parser.parse_args()
+
+    user = "benchmark"
+    PipelineConfiguration.RQA_CODING_PLANS = PipelineConfiguration.KAKUMA_RQA_CODING_PLANS
+    PipelineConfiguration.SURVEY_CODING_PLANS = PipelineConfiguration.KAKUMA_SURVEY_CODING_PLANS
+
+    for messages_count in args.messages_counts:
+        log.info(f"Benchmarking with {messages_count} messages...")
+
+        data = generate_data(user, messages_count)
+        start = time.perf_counter()
+        impute_missing_and_noise_codes_per_message(user, data)
+        per_message_seconds = time.perf_counter() - start
+
+        data = generate_data(user, messages_count)
+        start = time.perf_counter()
+        ApplyManualCodes._impute_missing_and_noise_codes(user, data)
+        templates_seconds = time.perf_counter() - start
+
+        log.info(f"{messages_count} messages: label per message {per_message_seconds:.2f}s, "
+                 f"label templates {templates_seconds:.2f}s "
+                 f"({per_message_seconds / templates_seconds:.1f}x)")
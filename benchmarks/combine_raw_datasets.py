@@ -0,0 +1,83 @@
+import argparse
+import time
+
+from core_data_modules.logging import Logger
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.util import TimeUtils
+
+from src import LoadData
+
+log = Logger(__name__)
+
+SURVEY_DATASETS_COUNT = 4
+MESSAGES_PER_CONTACT = 5
+
+
+def generate_datasets(user, messages_count):
+    """
+    Generates synthetic activation and coalesced survey datasets, shaped like the Kakuma data: a few messages per
+    contact, with each contact having completed some of the surveys.
+    """
+    contacts_count = max(1, messages_count // MESSAGES_PER_CONTACT)
+
+    messages = []
+    for i in range(messages_count):
+        messages.append(TracedData(
+            {"avf_phone_id": f"avf-phone-uuid-{i % contacts_count}", "text": f"message {i}"},
+            Metadata(user, "benchmark", TimeUtils.utc_now_as_iso_string())
+        ))
+
+    surveys_datasets = []
+    for survey in range(SURVEY_DATASETS_COUNT):
+        surveys_datasets.append([
+            TracedData(
+                {"avf_phone_id": f"avf-phone-uuid-{contact}", f"survey_{survey}_raw": f"answer {contact}"},
+                Metadata(user, "benchmark", TimeUtils.utc_now_as_iso_string())
+            )
+            for contact in range(contacts_count) if contact % (survey + 1) == 0
+        ])
+
+    return [messages], surveys_datasets
+
+
+def combine_with_update_iterable(user, messages_datasets, surveys_datasets):
+    # The previous implementation of LoadData.combine_raw_datasets, which makes one pass over all the messages for
+    # each survey dataset.
+    data = []
+    for messages_dataset in messages_datasets:
+        data.extend(messages_dataset)
+
+    for surveys_dataset in surveys_datasets:
+        TracedData.update_iterable(user, "avf_phone_id", data, surveys_dataset, "survey_responses")
+
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks LoadData.combine_raw_datasets against the previous "
+                                                 "one-pass-per-survey implementation. "
+                                                 "Run from the repository root with "
+                                                 "`python -m benchmarks.combine_raw_datasets`")
+
+    parser.add_argument("--messages-counts", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Numbers of synthetic activation messages to benchmark with")
+
+    args = parser.parse_args()
+
+    user = "benchmark"
+    for messages_count in args.messages_counts:
+        log.info(f"Benchmarking with {messages_count} messages...")
+
+        messages_datasets, surveys_datasets = generate_datasets(user, messages_count)
+        start = time.perf_counter()
+        combine_with_update_iterable(user, messages_datasets, surveys_datasets)
+        update_iterable_seconds = time.perf_counter() - start
+
+        messages_datasets, surveys_datasets = generate_datasets(user, messages_count)
+        start = time.perf_counter()
+        LoadData.combine_raw_datasets(user, messages_datasets, surveys_datasets)
+        index_join_seconds = time.perf_counter() - start
+
+        log.info(f"{messages_count} messages: update_iterable {update_iterable_seconds:.2f}s, "
+                 f"indexed join {index_join_seconds:.2f}s "
+                 f"({update_iterable_seconds / index_join_seconds:.1f}x)")
@@ -0,0 +1,91 @@
+import argparse
+import os
+import tempfile
+import time
+
+from core_data_modules.logging import Logger
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.traced_data.io import TracedDataCodaV2IO
+from core_data_modules.util import TimeUtils
+
+from src.lib import PipelineConfiguration, MessageIdCache
+
+log = Logger(__name__)
+
+MESSAGES_PER_UID = 3
+
+
+def generate_data(user, messages_count):
+    """
+    Generates synthetic messages shaped like the Kakuma data: each uid has a few messages to the radio shows, and
+    every message from a uid carries that uid's survey answers.
+    """
+    coded_rqa_plans = [plan for plan in PipelineConfiguration.RQA_CODING_PLANS if plan.coda_filename is not None]
+    coded_survey_plans = [plan for plan in PipelineConfiguration.SURVEY_CODING_PLANS if plan.coda_filename is not None]
+
+    data = []
+    for i in range(messages_count):
+        uid = i // MESSAGES_PER_UID
+        message_data = {"uid": f"avf-phone-uuid-{uid}"}
+        for plan in coded_survey_plans:
+            message_data[plan.raw_field] = f"survey answer {uid}"
+        message_data[coded_rqa_plans[i % len(coded_rqa_plans)].raw_field] = f"message {i}"
+        data.append(TracedData(message_data, Metadata(user, "benchmark", TimeUtils.utc_now_as_iso_string())))
+
+    return data
+
+
+def compute_message_ids(user, data, compute):
+    # Computes the message ids as generate_outputs.py does: once for the '_WS' id fields in WSCorrection, then again
+    # for the id fields in AutoCode.export_coda.
+    plans = [plan for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS
+             if plan.coda_filename is not None]
+    for plan in plans:
+        compute(user, data, plan.raw_field, f"{plan.id_field}_WS")
+    for plan in plans:
+        compute(user, data, plan.raw_field, plan.id_field)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the message id hashing in generate_outputs.py with "
+                                                 "TracedDataCodaV2IO.compute_message_ids against a MessageIdCache, "
+                                                 "both within a single run and loaded from a previous run. "
+                                                 "Run from the repository root with "
+                                                 "`python -m benchmarks.message_id_cache`")
+
+    parser.add_argument("--messages-counts", type=int, nargs="+", default=[10000, 100000],
+                        help="Numbers of synthetic messages to benchmark with")
+
+    args = parser.parse_args()
+
+    user = "benchmark"
+    PipelineConfiguration.RQA_CODING_PLANS = PipelineConfiguration.KAKUMA_RQA_CODING_PLANS
+    PipelineConfiguration.SURVEY_CODING_PLANS = PipelineConfiguration.KAKUMA_SURVEY_CODING_PLANS
+
+    for messages_count in args.messages_counts:
+        log.info(f"Benchmarking with {messages_count} messages...")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, "message_ids.cache")
+
+            data = generate_data(user, messages_count)
+            start = time.perf_counter()
+            compute_message_ids(user, data, TracedDataCodaV2IO.compute_message_ids)
+            uncached_seconds = time.perf_counter() - start
+
+            data = generate_data(user, messages_count)
+            start = time.perf_counter()
+            message_ids = MessageIdCache(cache_path)
+            compute_message_ids(user, data, message_ids.compute_message_ids)
+            message_ids.save()
+            cold_seconds = time.perf_counter() - start
+
+            data = generate_data(user, messages_count)
+            start = time.perf_counter()
+            message_ids = MessageIdCache(cache_path)
+            compute_message_ids(user, data, message_ids.compute_message_ids)
+            message_ids.save()
+            warm_seconds = time.perf_counter() - start
+
+        log.info(f"{messages_count} messages: compute_message_ids {uncached_seconds:.2f}s, "
+                 f"cache within run {cold_seconds:.2f}s ({uncached_seconds / cold_seconds:.1f}x), "
+                 f"cache from previous run {warm_seconds:.2f}s ({uncached_seconds / warm_seconds:.1f}x)")
@@ -0,0 +1,108 @@
+import argparse
+import random
+import time
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.logging import Logger
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.util import TimeUtils
+
+from configurations.code_schemes import CodeSchemes
+from src import WSCorrection
+from src.lib import PipelineConfiguration, MetadataFactory, TimestampStore
+from src.ws_correction import _WSRoutingTable
+
+log = Logger(__name__)
+
+MAX_MESSAGES_PER_UID = 3
+WS_MOVE_PROBABILITY = 0.1
+
+
+def generate_groups(user, uids_count, seed=0):
+    """
+    Generates synthetic groups of messages with their 'WS - Correct Dataset' labels already imported, one group per
+    uid, shaped like the Kakuma data after WSCorrection has imported the Coda files.
+    """
+    rng = random.Random(seed)
+    ws_scheme = CodeSchemes.WS_CORRECT_DATASET_SCHEME
+    not_reviewed_code_id = ws_scheme.get_code_with_control_code(Codes.NOT_REVIEWED).code_id
+    plans_with_ws_codes = [
+        plan for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS
+        if plan.ws_code is not None
+    ]
+    coded_rqa_plans = [plan for plan in PipelineConfiguration.RQA_CODING_PLANS if plan.coda_filename is not None]
+    coded_survey_plans = [plan for plan in PipelineConfiguration.SURVEY_CODING_PLANS if plan.coda_filename is not None]
+
+    def ws_label():
+        if rng.random() < WS_MOVE_PROBABILITY:
+            return {"CodeID": rng.choice(plans_with_ws_codes).ws_code.code_id}
+        return {"CodeID": not_reviewed_code_id}
+
+    groups = []
+    for uid in range(uids_count):
+        survey_data = {"uid": f"avf-phone-uuid-{uid}"}
+        for plan in coded_survey_plans:
+            survey_data[plan.raw_field] = f"survey answer {uid}"
+            survey_data[plan.time_field] = "2020-06-01T12:00:00+03:00"
+            survey_data[f"{plan.raw_field}_WS_correct_dataset"] = ws_label()
+
+        group = []
+        for message in range(rng.randint(1, MAX_MESSAGES_PER_UID)):
+            plan = rng.choice(coded_rqa_plans)
+            message_data = dict(survey_data)
+            message_data[plan.raw_field] = f"message {uid}.{message}"
+            message_data[plan.time_field] = f"2020-06-0{message + 1}T12:00:00+03:00"
+            message_data[f"{plan.raw_field}_WS_correct_dataset"] = ws_label()
+            group.append(TracedData(message_data, Metadata(user, "benchmark", TimeUtils.utc_now_as_iso_string())))
+        groups.append(group)
+
+    return groups
+
+
+def correct_groups(groups, compile_per_group, metadata_factory):
+    # With compile_per_group, the routing table is rebuilt for every group, as the sets, maps and plan scans were
+    # before the routing table was compiled once per run.
+    timestamps = TimestampStore()
+    unknown_target_code_counts = dict()
+    routing = None
+    for group in groups:
+        if routing is None or compile_per_group:
+            routing = _WSRoutingTable.compile(
+                CodeSchemes.WS_CORRECT_DATASET_SCHEME,
+                PipelineConfiguration.RQA_CODING_PLANS, PipelineConfiguration.SURVEY_CODING_PLANS
+            )
+        WSCorrection.correct_group(group, routing, timestamps, metadata_factory, unknown_target_code_counts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the per-group cost of WSCorrection with a routing table "
+                                                 "compiled once per run against one rebuilt for every group. "
+                                                 "Run from the repository root with "
+                                                 "`python -m benchmarks.ws_correction_routing`")
+
+    parser.add_argument("--uids-count", type=int, default=100000,
+                        help="Number of synthetic uids to benchmark with")
+
+    args = parser.parse_args()
+
+    user = "benchmark"
+    PipelineConfiguration.RQA_CODING_PLANS = PipelineConfiguration.KAKUMA_RQA_CODING_PLANS
+    PipelineConfiguration.SURVEY_CODING_PLANS = PipelineConfiguration.KAKUMA_SURVEY_CODING_PLANS
+    CodeSchemes.WS_CORRECT_DATASET_SCHEME = CodeSchemes.KAKUMA_WS_CORRECT_DATASET_SCHEME
+    metadata_factory = MetadataFactory(user)
+
+    log.info(f"Benchmarking with {args.uids_count} uids...")
+
+    groups = generate_groups(user, args.uids_count)
+    start = time.perf_counter()
+    correct_groups(groups, True, metadata_factory)
+    per_group_seconds = time.perf_counter() - start
+
+    groups = generate_groups(user, args.uids_count)
+    start = time.perf_counter()
+    correct_groups(groups, False, metadata_factory)
+    per_run_seconds = time.perf_counter() - start
+
+    log.info(f"{args.uids_count} uids: routing rebuilt per group {per_group_seconds * 1e6 / args.uids_count:.1f}us "
+             f"per group, compiled once {per_run_seconds * 1e6 / args.uids_count:.1f}us per group "
+             f"({per_group_seconds / per_run_seconds:.1f}x)")
@@ -1,18 +1,119 @@
-import time
-
 from core_data_modules.cleaners import Codes
-from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.data_models.code_scheme import CodeTypes
-from core_data_modules.traced_data import Metadata
+
+from configurations.code_schemes import CodeSchemeLookup
+
+# TODO: If these age categories are standard across projects, move this to Core as a new cleaner.
+AGE_CATEGORIES = {
+    (10, 14): "10 to 14",
+    (15, 17): "15 to 17",
+    (18, 35): "18 to 35",
+    (36, 54): "36 to 54",
+    (55, 99): "55 to 99"
+}
 
 
 def make_location_code(scheme, clean_value):
     if clean_value == Codes.NOT_CODED:
-        return scheme.get_code_with_control_code(Codes.NOT_CODED)
+        return CodeSchemeLookup.for_scheme(scheme).code_with_control_code(Codes.NOT_CODED)
     else:
-        return scheme.get_code_with_match_value(clean_value)
+        return CodeSchemeLookup.for_scheme(scheme).code_with_match_value(clean_value)
+
+
+def impute_code_columns(data, input_configurations, output_configurations, impute_columns, label_templates):
+    """
+    Runs a batch code imputation function over a dataset.
+
+    The code id and numeric value of the label in each input field are read into one column per field, with an entry
+    for each message. `impute_columns` computes a column of imputed codes for each output field from these columns.
+    The labels for the imputed codes are then written to each message in a single append.
+
+    :param data: TracedData objects to impute codes for. Every object must have a label in every input field.
+    :type data: list of TracedData
+    :param input_configurations: Coding configurations of the SINGLE coded fields to read codes from.
+    :type input_configurations: list of src.lib.configuration_objects.CodingConfiguration
+    :param output_configurations: Coding configurations of the fields to write the imputed codes to.
+    :type output_configurations: list of src.lib.configuration_objects.CodingConfiguration
+    :param impute_columns: Function which takes the code id columns and the numeric value columns of the input fields,
+                           in the order of `input_configurations`, and returns a column of imputed codes for each of
+                           the `output_configurations`, in that order.
+    :type impute_columns: function of (list of list of str, list of list of (int | None)) ->
+                                       list of list of core_data_modules.data_models.Code
+    :param label_templates: Label templates of the calling stage, for the labels of the imputed codes and the Metadata
+                            of the appends.
+    :type label_templates: src.lib.LabelTemplates
+    """
+    code_id_columns = []
+    numeric_value_columns = []
+    for cc in input_configurations:
+        lookup = CodeSchemeLookup.for_scheme(cc.code_scheme)
+        code_ids = [td[cc.coded_field]["CodeID"] for td in data]
+        code_id_columns.append(code_ids)
+        numeric_value_columns.append([lookup.code_with_code_id(code_id).numeric_value for code_id in code_ids])
+
+    imputed_columns = impute_columns(code_id_columns, numeric_value_columns)
+    assert len(imputed_columns) == len(output_configurations)
+
+    metadata_factory = label_templates.metadata_factory
+    for i, td in enumerate(data):
+        imputed_dict = dict()
+        for cc, imputed_codes in zip(output_configurations, imputed_columns):
+            imputed_dict[cc.coded_field] = label_templates.coded_value_with_code(cc, imputed_codes[i])
+        td.append_data(imputed_dict, metadata_factory.metadata())
+
+
+def impute_age_category_codes(age_scheme, age_category_scheme, age_code_ids, ages):
+    """
+    Imputes the age category code of each message from its age code.
+
+    Normal ages are mapped to their category through an array indexed by age, and control and meta codes to the code
+    with the same control or meta code in the age category scheme.
 
-def impute_age_category(user, data, age_configurations):
+    :param age_scheme: Code scheme of the age codes.
+    :type age_scheme: core_data_modules.data_models.CodeScheme
+    :param age_category_scheme: Code scheme of the age category codes.
+    :type age_category_scheme: core_data_modules.data_models.CodeScheme
+    :param age_code_ids: Id of the age code of each message.
+    :type age_code_ids: list of str
+    :param ages: Numeric value of the age code of each message.
+    :type ages: list of (int | None)
+    :return: Age category code of each message.
+    :rtype: list of core_data_modules.data_models.Code
+    """
+    age_lookup = CodeSchemeLookup.for_scheme(age_scheme)
+    age_category_lookup = CodeSchemeLookup.for_scheme(age_category_scheme)
+
+    category_codes_by_age = [None] * (max(age_range[1] for age_range in AGE_CATEGORIES) + 1)
+    for (min_age, max_age), category in AGE_CATEGORIES.items():
+        category_code = age_category_lookup.code_with_match_value(category)
+        for age in range(min_age, max_age + 1):
+            category_codes_by_age[age] = category_code
+
+    # Category codes of the control and meta codes in the age scheme, filled in as they are seen.
+    other_category_codes = dict()  # of age code id -> age category code
+
+    age_category_codes = []
+    for age_code_id, age in zip(age_code_ids, ages):
+        age_code = age_lookup.code_with_code_id(age_code_id)
+        if age_code.code_type == CodeTypes.NORMAL:
+            assert 0 <= age < len(category_codes_by_age) and category_codes_by_age[age] is not None, \
+                f"Age {age} is not in any of the age categories"
+            age_category_codes.append(category_codes_by_age[age])
+            continue
+
+        if age_code_id not in other_category_codes:
+            if age_code.code_type == CodeTypes.META:
+                other_category_codes[age_code_id] = age_category_lookup.code_with_meta_code(age_code.meta_code)
+            else:
+                assert age_code.code_type == CodeTypes.CONTROL
+                other_category_codes[age_code_id] = \
+                    age_category_lookup.code_with_control_code(age_code.control_code)
+        age_category_codes.append(other_category_codes[age_code_id])
+
+    return age_category_codes
+
+
+def impute_age_category(data, age_configurations, label_templates):
     # TODO: By accepting a list of age_configurations but then requiring that list to contain code schemes in a
     #       certain order, it looks like we're providing more flexibility than we actually do. We should change this
     #       to explicitly accept age and age_category configurations, which requires refactoring all of the
@@ -20,38 +121,11 @@ def impute_age_category(user, data, age_configurations):
     age_cc = age_configurations[0]
     age_category_cc = age_configurations[1]
 
-    age_categories = {
-        (10, 14): "10 to 14",
-        (15, 17): "15 to 17",
-        (18, 35): "18 to 35",
-        (36, 54): "36 to 54",
-        (55, 99): "55 to 99"
-    }
-
-    for td in data:
-        age_label = td[age_cc.coded_field]
-        age_code = age_cc.code_scheme.get_code_with_code_id(age_label["CodeID"])
-
-        if age_code.code_type == CodeTypes.NORMAL:
-            # TODO: If these age categories are standard across projects, move this to Core as a new cleaner.
-            age_category = None
-            for age_range, category in age_categories.items():
-                if age_range[0] <= age_code.numeric_value <= age_range[1]:
-                    age_category = category
-            assert age_category is not None
-
-            age_category_code = age_category_cc.code_scheme.get_code_with_match_value(age_category)
-        elif age_code.code_type == CodeTypes.META:
-            age_category_code = age_category_cc.code_scheme.get_code_with_meta_code(age_code.meta_code)
-        else:
-            assert age_code.code_type == CodeTypes.CONTROL
-            age_category_code = age_category_cc.code_scheme.get_code_with_control_code(age_code.control_code)
-
-        age_category_label = CleaningUtils.make_label_from_cleaner_code(
-            age_category_cc.code_scheme, age_category_code, Metadata.get_call_location()
-        )
-
-        td.append_data(
-            {age_category_cc.coded_field: age_category_label.to_dict()},
-            Metadata(user, Metadata.get_call_location(), time.time())
-        )
+    impute_code_columns(
+        data, [age_cc], [age_category_cc],
+        lambda code_id_columns, numeric_value_columns: [
+            impute_age_category_codes(age_cc.code_scheme, age_category_cc.code_scheme,
+                                      code_id_columns[0], numeric_value_columns[0])
+        ],
+        label_templates
+    )
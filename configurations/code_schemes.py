@@ -1,6 +1,10 @@
 import json
+from collections import namedtuple
+from types import MappingProxyType
 
+from core_data_modules.cleaners import Codes
 from core_data_modules.data_models import CodeScheme
+from core_data_modules.data_models.code_scheme import CodeTypes
 
 
 def _open_scheme(filename):
@@ -9,6 +13,132 @@ def _open_scheme(filename):
         return CodeScheme.from_firebase_map(firebase_map)
 
 
+# Precomputed properties of a code, for the checks the pipeline stages make on most labels.
+CodeFlags = namedtuple("CodeFlags", ["is_stop", "is_normal", "is_noise_other_channel", "string_value"])
+
+
+class CodeSchemeLookup(object):
+    _lookups = dict()  # of id(code scheme) -> (code scheme, CodeSchemeLookup), shared by every caller
+
+    def __init__(self, code_scheme):
+        """
+        Compiled, read-only index of the codes in a code scheme, giving dictionary lookups in place of the linear
+        searches in `CodeScheme.get_code_with_code_id`, `get_code_with_control_code`, `get_code_with_meta_code` and
+        `get_code_with_match_value`.
+
+        Use `CodeSchemeLookup.for_scheme` rather than constructing this directly, so that each scheme is only compiled
+        once and the compiled index is shared by every stage.
+
+        :param code_scheme: Code scheme to compile.
+        :type code_scheme: core_data_modules.data_models.CodeScheme
+        """
+        self.code_scheme = code_scheme
+
+        by_code_id = dict()
+        by_control_code = dict()
+        by_meta_code = dict()
+        by_match_value = dict()
+        positions = dict()
+        flags = dict()
+        for i, code in enumerate(code_scheme.codes):
+            # Where codes share a key, keep the first, as the linear searches in CodeScheme do.
+            by_code_id.setdefault(code.code_id, code)
+            positions.setdefault(code.code_id, i)
+            if code.control_code is not None:
+                by_control_code.setdefault(code.control_code, code)
+            if code.meta_code is not None:
+                by_meta_code.setdefault(code.meta_code, code)
+            for match_value in code.match_values or []:
+                by_match_value.setdefault(match_value, code)
+            flags.setdefault(code.code_id, CodeFlags(
+                is_stop=code.control_code == Codes.STOP,
+                is_normal=code.code_type == CodeTypes.NORMAL,
+                is_noise_other_channel=code.control_code == Codes.NOISE_OTHER_CHANNEL,
+                string_value=code.string_value
+            ))
+
+        self._by_code_id = MappingProxyType(by_code_id)
+        self._by_control_code = MappingProxyType(by_control_code)
+        self._by_meta_code = MappingProxyType(by_meta_code)
+        self._by_match_value = MappingProxyType(by_match_value)
+        self._positions = MappingProxyType(positions)
+        self._flags = MappingProxyType(flags)
+
+    @classmethod
+    def for_scheme(cls, code_scheme):
+        """
+        :param code_scheme: Code scheme to get the lookup of.
+        :type code_scheme: core_data_modules.data_models.CodeScheme
+        :return: The lookup of `code_scheme`, compiling it if this scheme has not been compiled before.
+        :rtype: CodeSchemeLookup
+        """
+        cached = cls._lookups.get(id(code_scheme))
+        if cached is None or cached[0] is not code_scheme:
+            cached = (code_scheme, cls(code_scheme))
+            cls._lookups[id(code_scheme)] = cached
+        return cached[1]
+
+    def _get(self, codes, key, description):
+        code = codes.get(key)
+        if code is None:
+            raise KeyError(f"Code with {description} '{key}' not found in scheme '{self.code_scheme.name}'")
+        return code
+
+    def code_with_code_id(self, code_id):
+        """
+        :param code_id: Id of the code to look up.
+        :type code_id: str
+        :return: The code with id `code_id`.
+        :rtype: core_data_modules.data_models.Code
+        """
+        return self._get(self._by_code_id, code_id, "code id")
+
+    def code_with_control_code(self, control_code):
+        """
+        :param control_code: Control code of the code to look up.
+        :type control_code: str
+        :return: The first code with control code `control_code`.
+        :rtype: core_data_modules.data_models.Code
+        """
+        return self._get(self._by_control_code, control_code, "control code")
+
+    def code_with_meta_code(self, meta_code):
+        """
+        :param meta_code: Meta code of the code to look up.
+        :type meta_code: str
+        :return: The first code with meta code `meta_code`.
+        :rtype: core_data_modules.data_models.Code
+        """
+        return self._get(self._by_meta_code, meta_code, "meta code")
+
+    def code_with_match_value(self, match_value):
+        """
+        :param match_value: Match value of the code to look up.
+        :type match_value: str
+        :return: The first code with `match_value` in its match values.
+        :rtype: core_data_modules.data_models.Code
+        """
+        return self._get(self._by_match_value, match_value, "match value")
+
+    def position_of(self, code_id):
+        """
+        :param code_id: Id of the code to look up.
+        :type code_id: str
+        :return: Position of the code with id `code_id` in this scheme's list of codes.
+        :rtype: int
+        """
+        return self._get(self._positions, code_id, "code id")
+
+    def flags(self, code_id):
+        """
+        :param code_id: Id of the code to look up.
+        :type code_id: str
+        :return: The precomputed flags of the code with id `code_id`.
+        :rtype: CodeFlags
+        """
+        return self._get(self._flags, code_id, "code id")
+
+
 class CodeSchemes(object):
     DADAAB_S01E01 = _open_scheme("dadaab_s01e01.json")
     DADAAB_S01E02 = _open_scheme("dadaab_s01e02.json")
@@ -15,6 +15,19 @@ while [[ $# -gt 0 ]]; do
             PROFILE_MEMORY=true
             MEMORY_PROFILE_OUTPUT_PATH="$2"
             shift 2;;
+        --worker-processes)
+            WORKER_PROCESSES_ARG="--worker-processes $2"
+            shift 2;;
+        --raw-data-cache-dir)
+            RAW_DATA_CACHE_DIR="$2"
+            RAW_DATA_CACHE_ARG="--raw-data-cache-dir /data/raw-data-cache"
+            shift 2;;
+        --raw-data-cache-max-size-mb)
+            RAW_DATA_CACHE_MAX_SIZE_ARG="--raw-data-cache-max-size-mb $2"
+            shift 2;;
+        --invalidate-raw-data-cache)
+            INVALIDATE_RAW_DATA_CACHE_ARG="--invalidate-raw-data-cache"
+            shift 1;;
         --)
             shift
             break;;
@@ -28,6 +41,9 @@ done
 if [[ $# -ne 11 ]]; then
     echo "Usage: ./docker-run-generate-outputs.sh
     [--profile-cpu <profile-output-path>] [--profile-memory <profile-output-path>]
+    [--worker-processes <worker-processes>]
+    [--raw-data-cache-dir <raw-data-cache-dir>] [--raw-data-cache-max-size-mb <raw-data-cache-max-size-mb>]
+    [--invalidate-raw-data-cache]
     <user> <pipeline-configuration-file-path>
     <raw-data-dir> <prev-coded-dir> <messages-json-output-path> <individuals-json-output-path>
     <icr-output-dir> <coded-output-dir> <messages-output-csv> <individuals-output-csv> <production-output-csv>"
@@ -58,7 +74,8 @@ fi
 if [[ "$PROFILE_MEMORY" = true ]]; then
     PROFILE_MEMORY_CMD="mprof run -o /data/memory.prof"
 fi
-CMD="pipenv run $PROFILE_MEMORY_CMD python -u $PROFILE_CPU_CMD generate_outputs.py \
+CMD="pipenv run $PROFILE_MEMORY_CMD python -u $PROFILE_CPU_CMD generate_outputs.py ${WORKER_PROCESSES_ARG} \
+    ${RAW_DATA_CACHE_ARG} ${RAW_DATA_CACHE_MAX_SIZE_ARG} ${INVALIDATE_RAW_DATA_CACHE_ARG} \
     \"$USER\" /data/pipeline_configuration.json /data/raw-data /data/prev-coded \
     /data/output-messages.jsonl /data/output-individuals.jsonl /data/output-icr /data/coded \
     /data/output-messages.csv /data/output-individuals.csv /data/output-production.csv \
@@ -81,6 +98,17 @@ else
     echo "WARNING: prev-coded-dir $PREV_CODED_DIR not found, ignoring"  # TODO: Stop allowing this to be optional.
 fi
 
+# Copy the previous export of the Coda files in too, so that files whose messages haven't changed are not rewritten.
+if [[ -d "$OUTPUT_CODED_DIR" ]]; then
+    echo "Copying $OUTPUT_CODED_DIR -> $container_short_id:/data/coded"
+    docker cp "$OUTPUT_CODED_DIR" "$container:/data/coded"
+fi
+
+if [[ -d "$RAW_DATA_CACHE_DIR" ]]; then
+    echo "Copying $RAW_DATA_CACHE_DIR -> $container_short_id:/data/raw-data-cache"
+    docker cp "$RAW_DATA_CACHE_DIR" "$container:/data/raw-data-cache"
+fi
+
 # Run the container
 echo "Starting container $container_short_id"
 docker start -a -i "$container"
@@ -114,6 +142,13 @@ echo "Copying $container_short_id:/data/output-individuals.csv -> $OUTPUT_INDIVI
 mkdir -p "$(dirname "$OUTPUT_INDIVIDUALS_CSV")"
 docker cp "$container:/data/output-individuals.csv" "$OUTPUT_INDIVIDUALS_CSV"
 
+if [[ -n "$RAW_DATA_CACHE_DIR" ]]; then
+    echo "Copying $container_short_id:/data/raw-data-cache/. -> $RAW_DATA_CACHE_DIR"
+    rm -rf "$RAW_DATA_CACHE_DIR"
+    mkdir -p "$RAW_DATA_CACHE_DIR"
+    docker cp "$container:/data/raw-data-cache/." "$RAW_DATA_CACHE_DIR"
+fi
+
 if [[ "$PROFILE_CPU" = true ]]; then
     echo "Copying $container_short_id:/data/cpu.prof -> $CPU_PROFILE_OUTPUT_PATH"
     mkdir -p "$(dirname "$CPU_PROFILE_OUTPUT_PATH")"
@@ -10,7 +10,7 @@ from id_infrastructure.firestore_uuid_table import FirestoreUuidTable
 from storage.google_cloud import google_cloud_utils
 
 from src.lib import PipelineConfiguration
-from configurations.code_schemes import CodeSchemes
+from configurations.code_schemes import CodeSchemes, CodeSchemeLookup
 
 Logger.set_project_name("WUSC-KEEP-II")
 log = Logger(__name__)
@@ -80,20 +80,17 @@ if __name__ == "__main__":
 
         all_uuids.add(msg['uid'])
 
-        if CodeSchemes.KAKUMA_HOUSEHOLD_LANGUAGE.get_code_with_code_id(
-                msg["household_language_coded"]["CodeID"]).string_value == "oromo":
+        household_language = CodeSchemeLookup.for_scheme(CodeSchemes.KAKUMA_HOUSEHOLD_LANGUAGE).flags(
+            msg["household_language_coded"]["CodeID"]).string_value
+        if household_language == "oromo":
             oromo_uuids.add(msg['uid'])
-        elif CodeSchemes.KAKUMA_HOUSEHOLD_LANGUAGE.get_code_with_code_id(
-                    msg["household_language_coded"]["CodeID"]).string_value == "sudanese":
+        elif household_language == "sudanese":
                 sudanese_juba_arabic_uuids.add(msg['uid'])
-        elif CodeSchemes.KAKUMA_HOUSEHOLD_LANGUAGE.get_code_with_code_id(
-                    msg["household_language_coded"]["CodeID"]).string_value == "turkana":
+        elif household_language == "turkana":
                 turkana_uuids.add(msg['uid'])
-        elif CodeSchemes.KAKUMA_HOUSEHOLD_LANGUAGE.get_code_with_code_id(
-                    msg["household_language_coded"]["CodeID"]).string_value == "somali":
+        elif household_language == "somali":
                 somali_uuids.add(msg['uid'])
-        elif CodeSchemes.KAKUMA_HOUSEHOLD_LANGUAGE.get_code_with_code_id(
-                    msg["household_language_coded"]["CodeID"]).string_value == "english":
+        elif household_language == "english":
                 english_uuids.add(msg['uid'])
         else:
             swahili_uuids.add(msg['uid'])
@@ -6,7 +6,8 @@ from core_data_modules.util import IOUtils
 
 from src import LoadData, TranslateRapidProKeys, AutoCode, ProductionFile, \
     ApplyManualCodes, AnalysisFile, WSCorrection
-from src.lib import PipelineConfiguration, MessageFilters
+from src.lib import PipelineConfiguration, MessageFilters, MetadataFactory, RawDataCache, TimestampStore, \
+    MessageIdCache, ValidationModes
 from configurations.code_schemes import CodeSchemes
 
 log = Logger(__name__)
@@ -14,6 +15,31 @@ log = Logger(__name__)
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Runs the post-fetch phase of the pipeline")
 
+    parser.add_argument("--worker-processes", type=int, default=1,
+                        help="Number of worker processes to use for the stages of this pipeline which can run in "
+                             "parallel. Defaults to 1, in which case every stage runs serially in this process")
+
+    parser.add_argument("--raw-data-cache-dir",
+                        help="Directory to cache the parsed raw datasets in between runs. Flows whose raw data files "
+                             "are unchanged since a previous run are loaded from this cache instead of being re-parsed. "
+                             "The Coda message ids of the message texts are also cached here. "
+                             "If not provided, neither is cached between runs")
+    parser.add_argument("--raw-data-cache-max-size-mb", type=int, default=4096,
+                        help="Maximum size of the raw data cache, in megabytes. The least recently used entries are "
+                             "deleted when this is exceeded. Defaults to 4096")
+    parser.add_argument("--invalidate-raw-data-cache", action="store_true",
+                        help="Delete everything in the raw data cache before loading the raw data")
+
+    parser.add_argument("--strict-metadata", action="store_true",
+                        help="Record the exact call location and time of every TracedData update in its Metadata, "
+                             "rather than one location and time per pipeline stage. Slower, but useful for audits")
+
+    parser.add_argument("--message-validation", choices=[ValidationModes.FULL, ValidationModes.SAMPLED,
+                                                         ValidationModes.OFF],
+                        default=ValidationModes.FULL,
+                        help="How many messages to check are well-formed while filtering them: 'full' checks every "
+                             "message, 'sampled' one in every 100, and 'off' none. Defaults to 'full'")
+
     parser.add_argument("user", help="User launching this program")
     parser.add_argument("pipeline_configuration_file_path", metavar="pipeline-configuration-file",
                         help="Path to the pipeline configuration json file")
@@ -44,6 +70,13 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    worker_processes = args.worker_processes
+    raw_data_cache_dir = args.raw_data_cache_dir
+    raw_data_cache_max_size_mb = args.raw_data_cache_max_size_mb
+    invalidate_raw_data_cache = args.invalidate_raw_data_cache
+    strict_metadata = args.strict_metadata
+    message_validation = args.message_validation
+
     user = args.user
     pipeline_configuration_file_path = args.pipeline_configuration_file_path
 
@@ -58,6 +91,8 @@ if __name__ == "__main__":
     csv_by_individual_output_path = args.csv_by_individual_output_path
     production_csv_output_path = args.production_csv_output_path
 
+    MetadataFactory.STRICT = strict_metadata
+
     # Load the pipeline configuration file
     log.info("Loading Pipeline Configuration File...")
     with open(pipeline_configuration_file_path) as f:
@@ -82,21 +117,38 @@ if __name__ == "__main__":
         PipelineConfiguration.FOLLOW_UP_CODING_PLANS = PipelineConfiguration.KAKUMA_FOLLOW_UP_SURVEY_CODING_PLANS
         CodeSchemes.WS_CORRECT_DATASET_SCHEME = CodeSchemes.KAKUMA_WS_CORRECT_DATASET_SCHEME
 
+    raw_data_cache = None
+    message_ids = MessageIdCache()
+    if raw_data_cache_dir is not None:
+        raw_data_cache = RawDataCache(raw_data_cache_dir, RawDataCache.hash_file(pipeline_configuration_file_path),
+                                      raw_data_cache_max_size_mb * 1024 * 1024)
+        if invalidate_raw_data_cache:
+            raw_data_cache.invalidate()
+        message_ids = MessageIdCache(raw_data_cache.message_ids_path)
+
     log.info("Loading the raw data...")
-    data = LoadData.load_raw_data(user, raw_data_dir, pipeline_configuration)
+    data = LoadData.load_raw_data(user, raw_data_dir, pipeline_configuration, worker_processes, raw_data_cache)
+
+    # Parsed message timestamps, shared by every stage which filters or orders messages by time.
+    timestamps = TimestampStore()
 
     log.info("Translating Rapid Pro Keys...")
-    data = TranslateRapidProKeys.translate_rapid_pro_keys(user, data, pipeline_configuration)
+    data = TranslateRapidProKeys.translate_rapid_pro_keys(user, data, pipeline_configuration, timestamps)
 
     if pipeline_configuration.move_ws_messages:
         log.info("Moving WS messages...")
-        data = WSCorrection.move_wrong_scheme_messages(user, data, prev_coded_dir_path)
+        data = WSCorrection.move_wrong_scheme_messages(user, data, prev_coded_dir_path, timestamps,
+                                                     worker_processes, message_ids)
     else:
         log.info("Not moving WS messages (because the 'MoveWSMessages' key in the pipeline configuration "
                  "json was set to 'false')")
 
     log.info("Auto Coding...")
-    data = AutoCode.auto_code(user, data, pipeline_configuration, icr_output_dir, coded_dir_path)
+    data = AutoCode.auto_code(user, data, pipeline_configuration, icr_output_dir, coded_dir_path, timestamps,
+                              worker_processes, message_ids, message_validation)
+    message_ids.save()
+    if raw_data_cache is not None:
+        raw_data_cache.evict()
 
     log.info("Filtering out Messages labelled as Noise_Other_Channel...")
     data = MessageFilters.filter_noise_other_channel(data)
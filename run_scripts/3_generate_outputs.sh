@@ -2,6 +2,10 @@
 
 set -e
 
+# The raw data cache directory is usually under DATA_ROOT, which may contain spaces, so collect these arguments in an
+# array rather than a string.
+RAW_DATA_CACHE_ARGS=()
+
 while [[ $# -gt 0 ]]; do
     case "$1" in
         --profile-cpu)
@@ -12,6 +16,18 @@ while [[ $# -gt 0 ]]; do
             MEMORY_PROFILE_OUTPUT_PATH="$2"
             MEMORY_PROFILE_ARG="--profile-memory $MEMORY_PROFILE_OUTPUT_PATH"
             shift 2;;
+        --worker-processes)
+            WORKER_PROCESSES_ARG="--worker-processes $2"
+            shift 2;;
+        --raw-data-cache-dir)
+            RAW_DATA_CACHE_ARGS+=(--raw-data-cache-dir "$2")
+            shift 2;;
+        --raw-data-cache-max-size-mb)
+            RAW_DATA_CACHE_ARGS+=(--raw-data-cache-max-size-mb "$2")
+            shift 2;;
+        --invalidate-raw-data-cache)
+            RAW_DATA_CACHE_ARGS+=(--invalidate-raw-data-cache)
+            shift 1;;
         --)
             shift
             break;;
@@ -21,7 +37,7 @@ while [[ $# -gt 0 ]]; do
 done
 
 if [[ $# -ne 3 ]]; then
-    echo "Usage: ./3_generate_outputs.sh [--profile-cpu <cpu-profile-output-path>] [--profile-memory <memory-profile-output-path>] <user> <pipeline-configuration-file-path> <data-root>"
+    echo "Usage: ./3_generate_outputs.sh [--profile-cpu <cpu-profile-output-path>] [--profile-memory <memory-profile-output-path>] [--worker-processes <worker-processes>] [--raw-data-cache-dir <raw-data-cache-dir>] [--raw-data-cache-max-size-mb <raw-data-cache-max-size-mb>] [--invalidate-raw-data-cache] <user> <pipeline-configuration-file-path> <data-root>"
     echo "Generates ICR files, Coda files, production CSV and analysis CSVs from the raw data files produced by run scripts 1 and 2"
     exit
 fi
@@ -34,7 +50,7 @@ mkdir -p "$DATA_ROOT/Coded Coda Files"
 mkdir -p "$DATA_ROOT/Outputs"
 
 cd ..
-./docker-run-generate-outputs.sh ${CPU_PROFILE_ARG} ${MEMORY_PROFILE_ARG} \
+./docker-run-generate-outputs.sh ${CPU_PROFILE_ARG} ${MEMORY_PROFILE_ARG} ${WORKER_PROCESSES_ARG} "${RAW_DATA_CACHE_ARGS[@]}" \
     "$USER" "$PIPELINE_CONFIGURATION_FILE_PATH" \
     "$DATA_ROOT/Raw Data" "$DATA_ROOT/Coded Coda Files/" \
     "$DATA_ROOT/Outputs/messages_traced_data.jsonl" "$DATA_ROOT/Outputs/individuals_traced_data.jsonl" \
@@ -12,6 +12,8 @@ AUTH=$1
 CODA_V2_ROOT=$2
 DATA_ROOT=$3
 
+source ./coda_add_helpers.sh
+
 ./checkout_coda_v2.sh "$CODA_V2_ROOT"
 cd "$CODA_V2_ROOT/data_tools"
 git checkout "9a9a8e708e3f20f37848a6b02f79bcee43e5be3b"  # (master which supports segmenting)
@@ -35,9 +37,7 @@ DATASETS=(
 
 for DATASET in ${DATASETS[@]}
 do
-    echo "Pushing messages data to ${PROJECT_NAME}_${DATASET}..."
-
-    pipenv run python add.py "$AUTH" "${PROJECT_NAME}_${DATASET}" messages "$DATA_ROOT/Outputs/Coda Files/$DATASET.json"
+    push_if_changed "$PROJECT_NAME" "$DATASET" "Pushing messages data"
 done
 
 PROJECT_NAME="WUSC-KEEP-II"
@@ -51,7 +51,5 @@ DATASETS=(
 
 for DATASET in ${DATASETS[@]}
 do
-    echo "Pushing messages data to ${PROJECT_NAME}_${DATASET}..."
-
-    pipenv run python add.py "$AUTH" "${PROJECT_NAME}_${DATASET}" messages "$DATA_ROOT/Outputs/Coda Files/$DATASET.json"
+    push_if_changed "$PROJECT_NAME" "$DATASET" "Pushing messages data"
 done
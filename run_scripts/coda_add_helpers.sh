@@ -0,0 +1,29 @@
+#!/usr/bin/env bash
+
+# Functions shared by the 4_*_coda_add.sh scripts. Source this file, then set AUTH and DATA_ROOT before calling them.
+
+# Pushes '$DATA_ROOT/Outputs/Coda Files/<dataset>.json' to the Coda dataset '<project>_<dataset>', using the
+# add.py script in the current directory, unless the file hasn't changed since it was last pushed successfully.
+# The hashes of the files which have been pushed are kept in '$DATA_ROOT/Outputs/Coda Files/.pushed_hashes'.
+#
+# Usage: push_if_changed <project> <dataset> <description>
+push_if_changed() {
+    local PROJECT=$1
+    local DATASET=$2
+    local DESCRIPTION=$3
+    local FILE="$DATA_ROOT/Outputs/Coda Files/$DATASET.json"
+    local PUSHED_HASHES_DIR="$DATA_ROOT/Outputs/Coda Files/.pushed_hashes"
+    local HASH_FILE="$PUSHED_HASHES_DIR/$DATASET.sha256"
+
+    local HASH
+    HASH="$(sha256sum "$FILE" | cut -d " " -f 1)"
+    if [[ -f "$HASH_FILE" && "$(cat "$HASH_FILE")" == "$HASH" ]]; then
+        echo "Skipping ${PROJECT}_${DATASET}, because it hasn't changed since it was last pushed"
+        return
+    fi
+
+    echo "$DESCRIPTION to ${PROJECT}_${DATASET}..."
+    pipenv run python add.py "$AUTH" "${PROJECT}_${DATASET}" messages "$FILE"
+    mkdir -p "$PUSHED_HASHES_DIR"
+    echo "$HASH" > "$HASH_FILE"
+}
@@ -1,20 +1,21 @@
 from collections import OrderedDict
 
 from core_data_modules.cleaners import Codes
-from core_data_modules.traced_data import Metadata
 from core_data_modules.traced_data.io import TracedDataCSVIO
 from core_data_modules.traced_data.util import FoldTracedData
 from core_data_modules.traced_data.util.fold_traced_data import FoldStrategies
 from core_data_modules.util import TimeUtils
 
-from src.lib import PipelineConfiguration, ConsentUtils
+from src.lib import PipelineConfiguration, ConsentUtils, MetadataFactory
 from src.lib.configuration_objects import CodingModes
+from configurations.code_schemes import CodeSchemeLookup
 
 
 class AnalysisFile(object):
     @staticmethod
     def export_to_csv(user, data, csv_path, export_keys, consent_withdrawn_key):
         # Convert codes to their string/matrix values
+        metadata_factory = MetadataFactory(user, TimeUtils.utc_now_as_iso_string)
         for td in data:
             analysis_dict = dict()
             for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
@@ -24,22 +25,22 @@ class AnalysisFile(object):
 
                     if cc.coding_mode == CodingModes.SINGLE:
                         analysis_dict[cc.analysis_file_key] = \
-                            cc.code_scheme.get_code_with_code_id(td[cc.coded_field]["CodeID"]).string_value
+                            CodeSchemeLookup.for_scheme(cc.code_scheme).flags(td[cc.coded_field]["CodeID"]).string_value
                     else:
                         assert cc.coding_mode == CodingModes.MULTIPLE
                         show_matrix_keys = []
                         for code in cc.code_scheme.codes:
                             show_matrix_keys.append(f"{cc.analysis_file_key}{code.string_value}")
 
+                        lookup = CodeSchemeLookup.for_scheme(cc.code_scheme)
                         for label in td[cc.coded_field]:
-                            code_string_value = cc.code_scheme.get_code_with_code_id(label["CodeID"]).string_value
+                            code_string_value = lookup.flags(label["CodeID"]).string_value
                             analysis_dict[f"{cc.analysis_file_key}{code_string_value}"] = Codes.MATRIX_1
 
                         for key in show_matrix_keys:
                             if key not in analysis_dict:
                                 analysis_dict[key] = Codes.MATRIX_0
-            td.append_data(analysis_dict,
-                           Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+            td.append_data(analysis_dict, metadata_factory.metadata())
 
         # Hide data from participants who opted out
         ConsentUtils.set_stopped(user, data, consent_withdrawn_key, additional_keys=export_keys)
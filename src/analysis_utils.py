@@ -2,6 +2,7 @@ from core_data_modules.cleaners import Codes
 from core_data_modules.data_models.code_scheme import CodeTypes
 
 from src.lib.configuration_objects import CodingModes
+from src.lib.label_matrix import CodeSchemeIndex, LabelMatrix
 
 
 class AnalysisUtils(object):
@@ -25,7 +26,8 @@ class AnalysisUtils(object):
             assert cc.coding_mode == CodingModes.MULTIPLE
             labels = td[cc.coded_field]
 
-        return [cc.code_scheme.get_code_with_code_id(label["CodeID"]) for label in labels]
+        scheme_index = CodeSchemeIndex.for_scheme(cc.code_scheme)
+        return [scheme_index.codes[scheme_index.index_of(label["CodeID"])] for label in labels]
 
     @classmethod
     def responded(cls, td, coding_plan):
@@ -152,6 +154,49 @@ class AnalysisUtils(object):
                     return True
         return False
     
+    @staticmethod
+    def _label_matrix(data, coding_plans, consent_withdrawn_key=None):
+        # Objects which withdrew consent may have had their labels replaced with 'STOP' by `ConsentUtils.set_stopped`,
+        # so are dropped before any labels are decoded, as the per-object checks return before reading their labels.
+        if consent_withdrawn_key is not None:
+            data = [td for td in data if not AnalysisUtils.withdrew_consent(td, consent_withdrawn_key)]
+        return LabelMatrix(list(data), [cc for plan in coding_plans for cc in plan.coding_configurations])
+
+    @staticmethod
+    def _responded_rows(matrix, coding_plan):
+        # As in `AnalysisUtils.responded`, only the first coding configuration determines whether there was a response.
+        coded_field = coding_plan.coding_configurations[0].coded_field
+        missing_mask = matrix.scheme_index(coded_field).control_code_mask(Codes.TRUE_MISSING, Codes.SKIPPED)
+        assert all(matrix.labelled_rows(coded_field))
+        if matrix.coding_mode(coded_field) == CodingModes.MULTIPLE:
+            for bitset in matrix.column(coded_field):
+                if bitset & (bitset - 1) != 0:
+                    # If there is an NA or NS code, there shouldn't be any other codes present.
+                    assert bitset & missing_mask == 0
+        return matrix.rows_with_code_in_mask(coded_field, ~missing_mask)
+
+    @classmethod
+    def _labelled_rows(cls, matrix, coding_plan):
+        rows = cls._responded_rows(matrix, coding_plan)
+        for cc in coding_plan.coding_configurations:
+            not_reviewed_mask = matrix.scheme_index(cc.coded_field).control_code_mask(Codes.NOT_REVIEWED)
+            rows = [labelled and has_label and not not_reviewed
+                    for labelled, has_label, not_reviewed in zip(
+                        rows, matrix.labelled_rows(cc.coded_field),
+                        matrix.rows_with_code_in_mask(cc.coded_field, not_reviewed_mask))]
+        return rows
+
+    @staticmethod
+    def _relevant_rows(matrix, coding_plan):
+        return matrix.rows_with_code_type(
+            [cc.coded_field for cc in coding_plan.coding_configurations], CodeTypes.NORMAL)
+
+    @staticmethod
+    def _select_rows(matrix, rows_per_plan, require_all=False):
+        if require_all:
+            return [td for td, *plan_rows in zip(matrix.data, *rows_per_plan) if all(plan_rows)]
+        return [td for td, *plan_rows in zip(matrix.data, *rows_per_plan) if any(plan_rows)]
+
     @classmethod
     def filter_responded(cls, data, coding_plans):
         """
@@ -167,13 +212,8 @@ class AnalysisUtils(object):
         :return: data, filtered for only the objects that responded to at least one of the coding plans.
         :rtype: list of TracedData
         """
-        responded = []
-        for td in data:
-            for plan in coding_plans:
-                if cls.responded(td, plan):
-                    responded.append(td)
-                    break
-        return responded
+        matrix = cls._label_matrix(data, coding_plans)
+        return cls._select_rows(matrix, [cls._responded_rows(matrix, plan) for plan in coding_plans])
 
     @classmethod
     def filter_opt_ins(cls, data, consent_withdrawn_key, coding_plans):
@@ -192,13 +232,8 @@ class AnalysisUtils(object):
         :return: data, filtered for only the objects that opted-in and responded to at least one of the coding plans.
         :rtype: list of TracedData
         """
-        opt_ins = []
-        for td in data:
-            for plan in coding_plans:
-                if cls.opt_in(td, consent_withdrawn_key, plan):
-                    opt_ins.append(td)
-                    break
-        return opt_ins
+        matrix = cls._label_matrix(data, coding_plans, consent_withdrawn_key)
+        return cls._select_rows(matrix, [cls._responded_rows(matrix, plan) for plan in coding_plans])
 
     @classmethod
     def filter_partially_labelled(cls, data, consent_withdrawn_key, coding_plans):
@@ -218,13 +253,8 @@ class AnalysisUtils(object):
                  plans.
         :rtype: list of TracedData
         """
-        labelled = []
-        for td in data:
-            for plan in coding_plans:
-                if cls.labelled(td, consent_withdrawn_key, plan):
-                    labelled.append(td)
-                    break
-        return labelled
+        matrix = cls._label_matrix(data, coding_plans, consent_withdrawn_key)
+        return cls._select_rows(matrix, [cls._labelled_rows(matrix, plan) for plan in coding_plans])
 
     @classmethod
     def filter_fully_labelled(cls, data, consent_withdrawn_key, coding_plans):
@@ -243,17 +273,8 @@ class AnalysisUtils(object):
         :return: data, filtered for only the objects that opted-in and are labelled under all of the coding plans.
         :rtype: list of TracedData
         """
-        labelled = []
-        for td in data:
-            td_is_labelled = True
-            for plan in coding_plans:
-                if not cls.labelled(td, consent_withdrawn_key, plan):
-                    td_is_labelled = False
-
-            if td_is_labelled:
-                labelled.append(td)
-
-        return labelled
+        matrix = cls._label_matrix(data, coding_plans, consent_withdrawn_key)
+        return cls._select_rows(matrix, [cls._labelled_rows(matrix, plan) for plan in coding_plans], require_all=True)
 
     @classmethod
     def filter_relevant(cls, data, consent_withdrawn_key, coding_plans):
@@ -272,10 +293,5 @@ class AnalysisUtils(object):
         :return: data, filtered for only the objects that are relevant to at least one of the coding plans.
         :rtype: list of TracedData
         """
-        relevant = []
-        for td in data:
-            for plan in coding_plans:
-                if cls.relevant(td, consent_withdrawn_key, plan):
-                    relevant.append(td)
-                    break
-        return relevant
+        matrix = cls._label_matrix(data, coding_plans, consent_withdrawn_key)
+        return cls._select_rows(matrix, [cls._relevant_rows(matrix, plan) for plan in coding_plans])
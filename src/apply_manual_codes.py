@@ -1,13 +1,10 @@
-import time
 from os import path
 
 from core_data_modules.cleaners import Codes
-from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.logging import Logger
-from core_data_modules.traced_data import Metadata
-from core_data_modules.traced_data.io import TracedDataCodaV2IO
 
-from src.lib import PipelineConfiguration
+from src.lib import PipelineConfiguration, MetadataFactory, CodaDatasetCache, LabelTemplates, \
+    TracedDataBatch, CodingConsistency
 from src.lib.configuration_objects import CodingModes
 from configurations.code_schemes import CodeSchemes
 
@@ -17,118 +14,41 @@ log = Logger(__name__)
 class ApplyManualCodes(object):
     @staticmethod
     def _impute_coding_error_codes(user, data):
-        for td in data:
-            coding_error_dict = dict()
-            for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
-                rqa_codes = []
-                for cc in plan.coding_configurations:
-                    if cc.coding_mode == CodingModes.SINGLE:
-                        if cc.coded_field in td:
-                            label = td[cc.coded_field]
-                            rqa_codes.append(cc.code_scheme.get_code_with_code_id(label["CodeID"]))
-                    else:
-                        assert cc.coding_mode == CodingModes.MULTIPLE
-                        for label in td.get(cc.coded_field, []):
-                            rqa_codes.append(cc.code_scheme.get_code_with_code_id(label["CodeID"]))
-
-                has_ws_code_in_code_scheme = False
-                for code in rqa_codes:
-                    if code.control_code == Codes.WRONG_SCHEME:
-                        has_ws_code_in_code_scheme = True
-
-                has_ws_code_in_ws_scheme = False
-                if f"{plan.raw_field}_correct_dataset" in td:
-                    ws_code = CodeSchemes.WS_CORRECT_DATASET_SCHEME.get_code_with_code_id(
-                        td[f"{plan.raw_field}_correct_dataset"]["CodeID"])
-                    has_ws_code_in_ws_scheme = ws_code.code_type == "Normal" or ws_code.control_code == Codes.NOT_CODED
-
-                if has_ws_code_in_code_scheme != has_ws_code_in_ws_scheme:
-                    log.warning(f"Coding Error: {plan.raw_field}: {td[plan.raw_field]}")
-                    coding_error_dict[f"{plan.raw_field}_correct_dataset"] = \
-                        CleaningUtils.make_label_from_cleaner_code(
-                            CodeSchemes.WS_CORRECT_DATASET_SCHEME,
-                            CodeSchemes.WS_CORRECT_DATASET_SCHEME.get_code_with_control_code(Codes.CODING_ERROR),
-                            Metadata.get_call_location(),
-                        ).to_dict()
-
-                    for cc in plan.coding_configurations:
-                        if cc.coding_mode == CodingModes.SINGLE:
-                            coding_error_dict[cc.coded_field] = \
-                                CleaningUtils.make_label_from_cleaner_code(
-                                    cc.code_scheme,
-                                    cc.code_scheme.get_code_with_control_code(Codes.CODING_ERROR),
-                                    Metadata.get_call_location()
-                                ).to_dict()
-                        else:
-                            assert cc.coding_mode == CodingModes.MULTIPLE
-                            coding_error_dict[cc.coded_field] = [
-                                CleaningUtils.make_label_from_cleaner_code(
-                                    cc.code_scheme,
-                                    cc.code_scheme.get_code_with_control_code(Codes.CODING_ERROR),
-                                    Metadata.get_call_location()
-                                ).to_dict()
-                            ]
-
-            td.append_data(coding_error_dict, Metadata(user, Metadata.get_call_location(), time.time()))
-
-    @classmethod
-    def apply_manual_codes(cls, user, data, coda_input_dir):
-        # Merge manually coded data into the cleaned dataset
-        for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
-            if plan.coda_filename is None:
-                continue
+        metadata_factory = MetadataFactory(user)
+        label_templates = LabelTemplates(metadata_factory)
+        coding_errors = CodingConsistency.find_coding_errors(
+            data, PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS,
+            coded_field_suffix="", correct_dataset_suffix="_correct_dataset"
+        )
+
+        coding_error_dicts = [dict() for _ in data]
+        for plan, rows in coding_errors:
+            for i in rows:
+                coding_error_dicts[i][f"{plan.raw_field}_correct_dataset"] = \
+                    label_templates.label(CodeSchemes.WS_CORRECT_DATASET_SCHEME, Codes.CODING_ERROR)
 
-            coda_input_path = path.join(coda_input_dir, plan.coda_filename)
+                for cc in plan.coding_configurations:
+                    coding_error_dicts[i][cc.coded_field] = label_templates.coded_value(cc, Codes.CODING_ERROR)
 
-            for cc in plan.coding_configurations:
-                f = None
-                try:
-                    if path.exists(coda_input_path):
-                        f = open(coda_input_path, "r")
-
-                    if cc.coding_mode == CodingModes.SINGLE:
-                        TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                            user, data, plan.id_field, {cc.coded_field: cc.code_scheme}, f)
-                    else:
-                        TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable_multi_coded(
-                            user, data, plan.id_field, {cc.coded_field: cc.code_scheme}, f)
-                finally:
-                    if f is not None:
-                        f.close()
-
-            f = None
-            try:
-                if path.exists(coda_input_path):
-                    f = open(coda_input_path, "r")
-
-                TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                    user, data, plan.id_field,
-                    {f"{plan.raw_field}_correct_dataset": CodeSchemes.WS_CORRECT_DATASET_SCHEME}, f
-                )
-            finally:
-                if f is not None:
-                    f.close()
+        for td, coding_error_dict in zip(data, coding_error_dicts):
+            td.append_data(coding_error_dict, metadata_factory.metadata())
 
+    @staticmethod
+    def _impute_missing_and_noise_codes(user, data):
         # Label data for which there is no response as TRUE_MISSING.
         # Label data for which the response is the empty string as NOT_CODED.
+        metadata_factory = MetadataFactory(user)
+        label_templates = LabelTemplates(metadata_factory)
         for td in data:
             missing_dict = dict()
             for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
                 if plan.raw_field not in td:
                     for cc in plan.coding_configurations:
-                        na_label = CleaningUtils.make_label_from_cleaner_code(
-                            cc.code_scheme, cc.code_scheme.get_code_with_control_code(Codes.TRUE_MISSING),
-                            Metadata.get_call_location()
-                        ).to_dict()
-                        missing_dict[cc.coded_field] = na_label if cc.coding_mode == CodingModes.SINGLE else [na_label]
+                        missing_dict[cc.coded_field] = label_templates.coded_value(cc, Codes.TRUE_MISSING)
                 elif td[plan.raw_field] == "":
                     for cc in plan.coding_configurations:
-                        nc_label = CleaningUtils.make_label_from_cleaner_code(
-                            cc.code_scheme, cc.code_scheme.get_code_with_control_code(Codes.NOT_CODED),
-                            Metadata.get_call_location()
-                        ).to_dict()
-                        missing_dict[cc.coded_field] = nc_label if cc.coding_mode == CodingModes.SINGLE else [nc_label]
-            td.append_data(missing_dict, Metadata(user, Metadata.get_call_location(), time.time()))
+                        missing_dict[cc.coded_field] = label_templates.coded_value(cc, Codes.NOT_CODED)
+            td.append_data(missing_dict, metadata_factory.metadata())
 
         # Mark data that is noise as Codes.NOT_CODED
         for td in data:
@@ -137,18 +57,43 @@ class ApplyManualCodes(object):
                 for plan in PipelineConfiguration.RQA_CODING_PLANS:
                     for cc in plan.coding_configurations:
                         if cc.coded_field not in td:
-                            nc_label = CleaningUtils.make_label_from_cleaner_code(
-                                cc.code_scheme, cc.code_scheme.get_code_with_control_code(Codes.NOT_CODED),
-                                Metadata.get_call_location()
-                            ).to_dict()
-                            nc_dict[cc.coded_field] = nc_label if cc.coding_mode == CodingModes.SINGLE else [nc_label]
-                td.append_data(nc_dict, Metadata(user, Metadata.get_call_location(), time.time()))
+                            nc_dict[cc.coded_field] = label_templates.coded_value(cc, Codes.NOT_CODED)
+                td.append_data(nc_dict, metadata_factory.metadata())
+
+    @classmethod
+    def apply_manual_codes(cls, user, data, coda_input_dir):
+        # Run every step below against a batch for each message, so that all the labels this stage writes to a
+        # message are committed to its history together.
+        batches = TracedDataBatch.for_each(data, MetadataFactory(user))
+
+        # Merge manually coded data into the cleaned dataset
+        for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
+            if plan.coda_filename is None:
+                continue
+
+            scheme_key_map = dict()
+            multi_coded_scheme_key_map = dict()
+            for cc in plan.coding_configurations:
+                if cc.coding_mode == CodingModes.SINGLE:
+                    scheme_key_map[cc.coded_field] = cc.code_scheme
+                else:
+                    multi_coded_scheme_key_map[cc.coded_field] = cc.code_scheme
+            scheme_key_map[f"{plan.raw_field}_correct_dataset"] = CodeSchemes.WS_CORRECT_DATASET_SCHEME
+
+            CodaDatasetCache.load(path.join(coda_input_dir, plan.coda_filename), missing_ok=True).apply_labels(
+                user, batches, plan.id_field, scheme_key_map, multi_coded_scheme_key_map
+            )
+
+        cls._impute_missing_and_noise_codes(user, batches)
 
         # Run code imputation functions
+        label_templates = LabelTemplates(MetadataFactory(user))
         for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
             if plan.code_imputation_function is not None:
-                plan.code_imputation_function(user, data, plan.coding_configurations)
+                plan.code_imputation_function(batches, plan.coding_configurations, label_templates)
+
+        cls._impute_coding_error_codes(user, batches)
 
-        cls._impute_coding_error_codes(user, data)
+        TracedDataBatch.commit_all(batches)
 
         return data
@@ -3,10 +3,11 @@ from os import path
 
 from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.logging import Logger
-from core_data_modules.traced_data.io import TracedDataCSVIO, TracedDataCodaV2IO
+from core_data_modules.traced_data.io import TracedDataCSVIO
 from core_data_modules.util import IOUtils
 
-from src.lib import PipelineConfiguration, MessageFilters, ICRTools
+from src.lib import PipelineConfiguration, MessageFilters, ICRSampler, CleanerCache, CodaExportManifest, \
+    CodaMessagesWriter, MessageIdCache, ValidationModes, MetadataFactory, TracedDataBatch
 
 log = Logger(__name__)
 
@@ -15,6 +16,7 @@ class AutoCode(object):
     NOISE_KEY = "noise"
     ICR_MESSAGES_COUNT = 200
     ICR_SEED = 0
+    ICR_DEDUPLICATE_MESSAGES = False
 
     @staticmethod
     def log_empty_string_stats_for_field(data, raw_fields):
@@ -53,75 +55,112 @@ class AutoCode(object):
         cls.log_empty_string_stats_for_field(survey_data.values(), raw_survey_fields)
 
     @classmethod
-    def filter_messages(cls, data, project_start_date, project_end_date, filter_test_messages=True):
+    def filter_messages(cls, data, project_start_date, project_end_date, filter_test_messages=True, timestamps=None,
+                        validation=ValidationModes.FULL):
+        filters = []
+
         # Filter out test messages sent by AVF.
         if filter_test_messages:
-            data = MessageFilters.filter_test_messages(data)
+            filters.append(MessageFilters.test_messages_filter())
         else:
             log.debug("Not filtering out test messages (because the pipeline configuration json key "
                       "'FilterTestMessages' was set to false)")
 
         # Filter for runs which don't contain a response to any week's question
-        data = MessageFilters.filter_empty_messages(data,
-                                                    [plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS])
+        filters.append(MessageFilters.empty_messages_filter(
+            [plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS]))
 
         # Filter out runs sent outwith the project start and end dates
         time_keys = {plan.time_field for plan in PipelineConfiguration.RQA_CODING_PLANS}
-        data = MessageFilters.filter_time_range(data, time_keys, project_start_date, project_end_date)
+        filters.append(MessageFilters.time_range_filter(time_keys, project_start_date, project_end_date, timestamps,
+                                                        validation))
 
-        return data
+        return MessageFilters.apply_filters(data, filters)
 
     @classmethod
-    def run_cleaners(cls, user, data):
+    def run_cleaners(cls, user, data, processes=1):
+        # Demographic answers repeat heavily, so run each cleaner through a cache, priming it with the unique raw
+        # values of each field first so that large fields can be cleaned in parallel.
+        cleaner_cache = CleanerCache(processes=processes)
         for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
             for cc in plan.coding_configurations:
                 if cc.cleaner is not None:
+                    cleaner_cache.prime(cc.cleaner, (td[plan.raw_field] for td in data if plan.raw_field in td))
                     CleaningUtils.apply_cleaner_to_traced_data_iterable(user, data, plan.raw_field, cc.coded_field,
-                                                                        cc.cleaner, cc.code_scheme)
+                                                                        cleaner_cache.memoise(cc.cleaner),
+                                                                        cc.code_scheme)
+        log.info(f"Ran cleaners with {cleaner_cache.hits} cache hits and {cleaner_cache.misses} cache misses")
 
     @classmethod
-    def export_coda(cls, user, data, coda_output_dir):
+    def export_coda(cls, user, data, coda_output_dir, message_ids=None):
+        if message_ids is None:
+            message_ids = MessageIdCache()
+
+        # Only rewrite the Coda files whose messages have changed since the last run, so that they are the only files
+        # the coda add scripts need to push.
         IOUtils.ensure_dirs_exist(coda_output_dir)
+        manifest = CodaExportManifest(coda_output_dir)
         for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
             if plan.coda_filename is None:
                 continue
 
-            TracedDataCodaV2IO.compute_message_ids(user, data, plan.raw_field, plan.id_field)
+            message_ids.compute_message_ids(user, data, plan.raw_field, plan.id_field)
+
+            scheme_key_map = {cc.coded_field: cc.code_scheme for cc in plan.coding_configurations}
+            content_hash = CodaExportManifest.content_hash(
+                data, plan.raw_field, plan.time_field, plan.id_field, scheme_key_map)
+            if manifest.is_unchanged(plan.coda_filename, content_hash):
+                log.info(f"Skipping export of {plan.coda_filename}, because its messages and labels have not "
+                         f"changed since the last export")
+                continue
 
             coda_output_path = path.join(coda_output_dir, plan.coda_filename)
             with open(coda_output_path, "w") as f:
-                TracedDataCodaV2IO.export_traced_data_iterable_to_coda_2(
-                    data, plan.raw_field, plan.time_field, plan.id_field,
-                    {cc.coded_field: cc.code_scheme for cc in plan.coding_configurations},
-                    f
+                messages_count = CodaMessagesWriter.write(
+                    data, plan.raw_field, plan.time_field, plan.id_field, scheme_key_map, f
                 )
+            log.info(f"Exported {messages_count} messages to {plan.coda_filename}")
+            manifest.update(plan.coda_filename, content_hash)
+
+        manifest.save()
 
     @classmethod
     def export_icr(cls, data, icr_output_dir):
-        # Output messages for ICR
-        IOUtils.ensure_dirs_exist(icr_output_dir)
+        # Sample messages for every RQA plan in a single pass, with one seeded reservoir per plan.
+        samplers = dict()  # of plan raw field -> (plan, ICRSampler)
         for plan in PipelineConfiguration.RQA_CODING_PLANS:
-            rqa_messages = []
-            for td in data:
-                if plan.raw_field in td:
-                    rqa_messages.append(td)
+            deduplicate_key = plan.raw_field if cls.ICR_DEDUPLICATE_MESSAGES else None
+            samplers[plan.raw_field] = (
+                plan, ICRSampler(cls.ICR_MESSAGES_COUNT, random.Random(cls.ICR_SEED), deduplicate_key)
+            )
 
-            icr_messages = ICRTools.generate_sample_for_icr(
-                rqa_messages, cls.ICR_MESSAGES_COUNT, random.Random(cls.ICR_SEED))
+        for td in data:
+            for raw_field, (_, sampler) in samplers.items():
+                if raw_field in td:
+                    sampler.add(td)
 
+        # Output messages for ICR
+        IOUtils.ensure_dirs_exist(icr_output_dir)
+        for plan, sampler in samplers.values():
             icr_output_path = path.join(icr_output_dir, plan.icr_filename)
             with open(icr_output_path, "w") as f:
                 TracedDataCSVIO.export_traced_data_iterable_to_csv(
-                    icr_messages, f, headers=[plan.run_id_field, plan.raw_field]
+                    sampler.sample(), f, headers=[plan.run_id_field, plan.raw_field]
                 )
 
     @classmethod
-    def auto_code(cls, user, data, pipeline_configuration, icr_output_dir, coda_output_dir):
+    def auto_code(cls, user, data, pipeline_configuration, icr_output_dir, coda_output_dir, timestamps=None,
+                  processes=1, message_ids=None, validation=ValidationModes.FULL):
         data = cls.filter_messages(data, pipeline_configuration.project_start_date,
-                                   pipeline_configuration.project_end_date, pipeline_configuration.filter_test_messages)
+                                   pipeline_configuration.project_end_date, pipeline_configuration.filter_test_messages,
+                                   timestamps, validation)
+
+        # Write the cleaned labels and message ids of every plan to each message in a single batch.
+        batches = TracedDataBatch.for_each(data, MetadataFactory(user))
+        cls.run_cleaners(user, batches, processes)
+        cls.export_coda(user, batches, coda_output_dir, message_ids)
+        TracedDataBatch.commit_all(batches)
 
-        cls.run_cleaners(user, data)
-        cls.export_coda(user, data, coda_output_dir)
         cls.export_icr(data, icr_output_dir)
         cls.log_empty_string_stats(data)
 
@@ -1,4 +1,15 @@
+from .cleaner_cache import CleanerCache
+from .coda_datasets import CodaDataset, CodaDatasetCache
+from .coda_export import CodaExportManifest, CodaMessagesWriter
+from .coding_consistency import CodingConsistency
 from .consent_utils import ConsentUtils
-from .icr_tools import ICRTools
-from .message_filters import MessageFilters
+from .icr_tools import ICRSampler, ICRTools
+from .label_matrix import CodeSchemeIndex, LabelMatrix
+from .label_templates import LabelTemplates
+from .message_id_cache import MessageIdCache
+from .message_filters import MessageFilter, MessageFilters, ValidationModes
+from .metadata_factory import MetadataFactory
 from .pipeline_configuration import PipelineConfiguration
+from .raw_data_cache import RawDataCache
+from .timestamp_store import TimestampStore
+from .traced_data_batch import TracedDataBatch
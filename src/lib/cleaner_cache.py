@@ -0,0 +1,125 @@
+import functools
+import multiprocessing
+from collections import OrderedDict
+
+from core_data_modules.logging import Logger
+
+log = Logger(__name__)
+
+# Cleaner being run by the worker processes in `CleanerCache.prime`. Cleaners are often lambdas, which can't be
+# pickled, so this is set before the pool is started and inherited by the workers instead. This needs the workers to
+# be forked, so `prime` always starts them with the 'fork' start method rather than the platform default, which is
+# 'spawn' on e.g. macOS.
+_pool_cleaner = None
+
+
+def _clean_values(texts):
+    # Module-level so that it can be pickled and sent to the worker processes in `CleanerCache.prime`.
+    return [_pool_cleaner(text) for text in texts]
+
+
+class CleanerCache(object):
+    def __init__(self, max_size=100000, processes=1, parallel_threshold=10000):
+        """
+        Bounded, least-recently-used cache of the values returned by cleaners, keyed by (cleaner, raw text).
+
+        Demographic answers repeat heavily, so most messages can be cleaned with a lookup rather than a call to the
+        cleaner. Cleaners must therefore be pure functions of the raw text.
+
+        :param max_size: Maximum number of (cleaner, raw text) entries to hold. Once full, the least recently used
+                         entry is evicted to make room for each new one.
+        :type max_size: int
+        :param processes: Number of worker processes `CleanerCache.prime` may use to run the cleaner on new values.
+        :type processes: int
+        :param parallel_threshold: Minimum number of new unique values `CleanerCache.prime` must be given before it
+                                   uses worker processes. Below this, starting the workers costs more than it saves.
+        :type parallel_threshold: int
+        """
+        self.max_size = max_size
+        self.processes = processes
+        self.parallel_threshold = parallel_threshold
+        self.hits = 0
+        self.misses = 0
+
+        self._cache = OrderedDict()  # of (cleaner, raw text) -> clean value, least recently used first
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clean(self, cleaner, text):
+        """
+        :param cleaner: Cleaner to run.
+        :type cleaner: function of str -> str
+        :param text: Raw text to clean.
+        :type text: str
+        :return: `cleaner(text)`. The cleaner is only called if this value is not already cached.
+        :rtype: str
+        """
+        key = (cleaner, text)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        self.misses += 1
+        clean_value = cleaner(text)
+        self._put(key, clean_value)
+        return clean_value
+
+    def memoise(self, cleaner):
+        """
+        :param cleaner: Cleaner to memoise.
+        :type cleaner: function of str -> str
+        :return: Function which cleans using this cache, with the name and module of `cleaner` so that labels made
+                 from its results have the same origin as labels made by the cleaner itself.
+        :rtype: function of str -> str
+        """
+        @functools.wraps(cleaner)
+        def memoised_cleaner(text):
+            return self.clean(cleaner, text)
+
+        return memoised_cleaner
+
+    def prime(self, cleaner, texts):
+        """
+        Runs a cleaner on each of the given texts which isn't already cached, and caches the results.
+
+        If there are at least `parallel_threshold` new unique texts and `processes` is greater than 1, the cleaner is
+        run in worker processes forked from this process. On platforms which can't fork, the texts are left to be
+        cleaned as they are looked up instead.
+
+        :param cleaner: Cleaner to run.
+        :type cleaner: function of str -> str
+        :param texts: Raw texts to clean. These may repeat.
+        :type texts: iterable of str
+        """
+        new_texts = [text for text in OrderedDict.fromkeys(texts) if (cleaner, text) not in self._cache]
+        if self.processes <= 1 or len(new_texts) < self.parallel_threshold:
+            return
+
+        if "fork" not in multiprocessing.get_all_start_methods():
+            log.warning(f"Not cleaning {len(new_texts)} unique values in worker processes, because this platform "
+                        f"can't fork them")
+            return
+
+        # Don't prime more values than will fit, as the first would be evicted before they were used.
+        new_texts = new_texts[:self.max_size]
+        log.info(f"Cleaning {len(new_texts)} unique values using {self.processes} worker processes...")
+
+        global _pool_cleaner
+        _pool_cleaner = cleaner
+        try:
+            chunk_size = (len(new_texts) + self.processes - 1) // self.processes
+            chunks = [new_texts[i:i + chunk_size] for i in range(0, len(new_texts), chunk_size)]
+            with multiprocessing.get_context("fork").Pool(self.processes) as pool:
+                for chunk, clean_values in zip(chunks, pool.map(_clean_values, chunks)):
+                    for text, clean_value in zip(chunk, clean_values):
+                        self.misses += 1
+                        self._put((cleaner, text), clean_value)
+        finally:
+            _pool_cleaner = None
+
+    def _put(self, key, clean_value):
+        self._cache[key] = clean_value
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
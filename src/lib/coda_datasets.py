@@ -0,0 +1,227 @@
+import json
+import os
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.data_models import Label
+from core_data_modules.logging import Logger
+from core_data_modules.util import TimeUtils
+
+from src.lib.label_templates import LabelTemplates
+from src.lib.metadata_factory import MetadataFactory
+
+log = Logger(__name__)
+
+
+# TODO: Move to Core, alongside TracedDataCodaV2IO
+class CodaDataset(object):
+    SPECIAL_REMOVE_CODE_ID = "SPECIAL-REMOVE"
+
+    def __init__(self, messages):
+        """
+        Index of the labels in a Coda messages file, by message id and scheme id.
+
+        :param messages: Messages in the Coda firebase format, as exported by Coda or by
+                         `TracedDataCodaV2IO.export_traced_data_iterable_to_coda_2`.
+        :type messages: list of dict
+        """
+        self._labels = dict()  # of message id -> (dict of scheme id -> list of Label, newest first)
+        self._message_labels = dict()  # of message id -> list of every Label on the message, in Coda order
+        for message in messages:
+            message_labels = []
+            labels_by_scheme = dict()
+            for label_map in message["Labels"]:
+                label = Label.from_firebase_map(label_map)
+                message_labels.append(label)
+                if label.scheme_id not in labels_by_scheme:
+                    labels_by_scheme[label.scheme_id] = []
+                labels_by_scheme[label.scheme_id].append(label)
+            self._labels[message["MessageID"]] = labels_by_scheme
+            self._message_labels[message["MessageID"]] = message_labels
+
+    @classmethod
+    def empty(cls):
+        """
+        :return: A dataset with no messages, for coding plans which don't have a Coda file yet.
+        :rtype: CodaDataset
+        """
+        return cls([])
+
+    def __len__(self):
+        return len(self._labels)
+
+    def labels(self, message_id, scheme_id):
+        """
+        :param message_id: Id of the message to get the labels of.
+        :type message_id: str
+        :param scheme_id: Id of the scheme to get the labels under.
+        :type scheme_id: str
+        :return: Every label assigned to the message under the scheme, newest first.
+                 These are shared by every caller, so must not be modified.
+        :rtype: list of core_data_modules.data_models.Label
+        """
+        return self._labels.get(message_id, dict()).get(scheme_id, [])
+
+    def multi_coded_labels(self, message_id, scheme_id):
+        """
+        :param message_id: Id of the message to get the labels of.
+        :type message_id: str
+        :param scheme_id: Id of the multi-coded scheme to get the labels under.
+        :type scheme_id: str
+        :return: Every label assigned to the message under the scheme or any of its duplicates in Coda
+                 (which have scheme ids of the form '<scheme_id>-<n>'), in the order they are in the Coda file,
+                 i.e. newest first across all of the duplicates.
+                 These are shared by every caller, so must not be modified.
+        :rtype: list of core_data_modules.data_models.Label
+        """
+        return [label for label in self._message_labels.get(message_id, [])
+                if label.scheme_id.startswith(scheme_id)]
+
+    @staticmethod
+    def index_by_message_id(data, message_id_key):
+        """
+        :param data: TracedData objects to index.
+        :type data: iterable of TracedData
+        :param message_id_key: Key in each TracedData object of the message id to index by.
+                               Objects without this key are not indexed.
+        :type message_id_key: str
+        :return: Dictionary of message id -> the TracedData objects with that message id, in input order.
+        :rtype: dict of str -> list of TracedData
+        """
+        index = dict()
+        for td in data:
+            if message_id_key not in td:
+                continue
+            message_id = td[message_id_key]
+            if message_id not in index:
+                index[message_id] = []
+            index[message_id].append(td)
+        return index
+
+    def apply_labels(self, user, data, message_id_key, scheme_key_map, multi_coded_scheme_key_map=None):
+        """
+        Applies the labels in this dataset to coded fields of the given TracedData objects, in a single join of this
+        dataset with an index of `data` by message id. Each TracedData object gets one append, containing all of
+        its updated fields.
+
+        Single-coded fields are imported as by `TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable`: each field
+        is set to its newest label, or to NOT_REVIEWED if there is no label or the newest label has not been checked.
+
+        Multi-coded fields are imported as by `TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable_multi_coded`:
+        each field is set to the newest label in each of the scheme's duplicates in Coda, without SPECIAL-REMOVE
+        labels, with scheme ids normalised to the scheme's id and de-duplicated by code id. If none of those labels
+        have been checked, the field is set to NOT_REVIEWED.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: TracedData objects to apply the labels to. Objects without a `message_id_key` are skipped.
+        :type data: iterable of TracedData
+        :param message_id_key: Key in each TracedData object of the message id to look up.
+        :type message_id_key: str
+        :param scheme_key_map: Dictionary of key in each TracedData object to write a single-coded label to ->
+                               code scheme of the labels to read.
+        :type scheme_key_map: dict of str -> core_data_modules.data_models.CodeScheme
+        :param multi_coded_scheme_key_map: Dictionary of key in each TracedData object to write multi-coded labels to
+                                           -> code scheme of the labels to read.
+        :type multi_coded_scheme_key_map: dict of str -> core_data_modules.data_models.CodeScheme | None
+        """
+        if multi_coded_scheme_key_map is None:
+            multi_coded_scheme_key_map = dict()
+
+        metadata_factory = MetadataFactory(user, TimeUtils.utc_now_as_iso_string)
+        label_templates = LabelTemplates(metadata_factory)
+        for message_id, tds in self.index_by_message_id(data, message_id_key).items():
+            for td in tds:
+                updates = dict()
+                for coded_key, scheme in scheme_key_map.items():
+                    label = self._single_coded_label_for_td(td, message_id, coded_key, scheme, label_templates)
+                    if label is not None:
+                        updates[coded_key] = label
+                for coded_key, scheme in multi_coded_scheme_key_map.items():
+                    updates[coded_key] = self._multi_coded_labels_for_td(
+                        td, message_id, coded_key, scheme, label_templates)
+
+                if len(updates) > 0:
+                    td.append_data(updates, metadata_factory.metadata())
+
+    def _single_coded_label_for_td(self, td, message_id, coded_key, scheme, label_templates):
+        # Returns the label to set, or None if the checked label already in the TracedData stands.
+        labels = self.labels(message_id, scheme.scheme_id)
+        if len(labels) > 0:
+            label = labels[0].to_dict()
+        else:
+            label = td.get(coded_key)
+
+        if label is None or not label.get("Checked", False):
+            return label_templates.label(scheme, Codes.NOT_REVIEWED)
+
+        if len(labels) == 0:
+            return None
+        return label
+
+    def _multi_coded_labels_for_td(self, td, message_id, coded_key, scheme, label_templates):
+        # Start from the labels currently in the TracedData, then replay the message's labels in reverse Coda order,
+        # as TracedDataCodaV2IO does, so that the newest label in each of the scheme's duplicates wins and the
+        # labels stay in the same order.
+        labels_lut = {label["SchemeID"]: label for label in td.get(coded_key, [])}  # of scheme id -> label dict
+        for label in reversed(self.multi_coded_labels(message_id, scheme.scheme_id)):
+            labels_lut[label.scheme_id] = label.to_dict()
+
+        labels = [label for label in labels_lut.values() if label["CodeID"] != self.SPECIAL_REMOVE_CODE_ID]
+
+        if not any(label.get("Checked", False) for label in labels):
+            return [label_templates.label(scheme, Codes.NOT_REVIEWED)]
+
+        # Normalise the scheme ids of the duplicates, then keep the first label with each code id. There can be
+        # more than one when the same code was applied to this message in different duplicates of the scheme.
+        unique_labels = []
+        seen_code_ids = set()
+        for label in labels:
+            assert label["SchemeID"].startswith(scheme.scheme_id)
+            if label["CodeID"] in seen_code_ids:
+                continue
+            seen_code_ids.add(label["CodeID"])
+            unique_labels.append(dict(label, SchemeID=scheme.scheme_id))
+
+        return unique_labels
+
+
+class CodaDatasetCache(object):
+    # Process-level cache of parsed Coda files, shared by every stage of this pipeline.
+    _datasets = dict()  # of absolute path -> (modification time, size, CodaDataset)
+
+    @classmethod
+    def load(cls, coda_file_path, missing_ok=False):
+        """
+        Loads a Coda messages file, parsing it only if it has not been parsed before in this process or has changed
+        since.
+
+        :param coda_file_path: Path to the Coda messages file to load.
+        :type coda_file_path: str
+        :param missing_ok: Whether to return an empty dataset if there is no file at `coda_file_path`, rather than
+                           raising a FileNotFoundError.
+        :type missing_ok: bool
+        :return: The parsed dataset.
+        :rtype: CodaDataset
+        """
+        if missing_ok and not os.path.exists(coda_file_path):
+            return CodaDataset.empty()
+
+        path = os.path.abspath(coda_file_path)
+        stat = os.stat(path)
+        cached = cls._datasets.get(path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        log.debug(f"Parsing Coda file '{coda_file_path}'...")
+        with open(path) as f:
+            dataset = CodaDataset(json.load(f))
+        cls._datasets[path] = (stat.st_mtime_ns, stat.st_size, dataset)
+
+        return dataset
+
+    @classmethod
+    def clear(cls):
+        """
+        Forgets every parsed Coda file.
+        """
+        cls._datasets.clear()
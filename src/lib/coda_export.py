@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+
+import pytz
+from core_data_modules.data_models import Label, Message
+from core_data_modules.logging import Logger
+from dateutil.parser import isoparse
+
+log = Logger(__name__)
+
+
+class CodaExportManifest(object):
+    FILENAME = ".coda_export_hashes.json"
+
+    def __init__(self, coda_output_dir):
+        """
+        Record of the content hash of each Coda file written to a directory by a previous run of this pipeline, so
+        that files whose messages have not changed since need not be written again.
+
+        The manifest is stored in `coda_output_dir` itself, so it is only trusted for files which are still there.
+
+        :param coda_output_dir: Directory the Coda files are exported to.
+        :type coda_output_dir: str
+        """
+        self.coda_output_dir = coda_output_dir
+        self._path = os.path.join(coda_output_dir, self.FILENAME)
+
+        self._hashes = dict()  # of Coda filename -> content hash
+        if os.path.exists(self._path):
+            with open(self._path) as f:
+                self._hashes = json.load(f)
+
+    @staticmethod
+    def content_hash(data, raw_key, creation_date_time_key, message_id_key, scheme_key_map):
+        """
+        Hashes everything `CodaMessagesWriter.write` would write for the given arguments, apart from the time each
+        label was made. Automatic labels are re-made with the current time on every run, so including their times
+        would mean no file was ever unchanged.
+
+        :param data: TracedData objects to hash the messages of. Objects without a `raw_key` are ignored.
+        :type data: iterable of TracedData
+        :param raw_key: Key in each TracedData object of the message text.
+        :type raw_key: str
+        :param creation_date_time_key: Key in each TracedData object of the time the message was sent.
+        :type creation_date_time_key: str
+        :param message_id_key: Key in each TracedData object of the message id.
+        :type message_id_key: str
+        :param scheme_key_map: Dictionary of key in each TracedData object of the labels to export -> code scheme of
+                               those labels.
+        :type scheme_key_map: dict of str -> core_data_modules.data_models.CodeScheme
+        :return: SHA-256 hex digest of the ids, texts, creation times and labels of the unique messages in `data`, in
+                 order, and of the code schemes exported.
+        :rtype: str
+        """
+        sha = hashlib.sha256()
+        sha.update(json.dumps([[coded_key, scheme.scheme_id] for coded_key, scheme in scheme_key_map.items()])
+                   .encode("utf-8"))
+
+        seen_message_ids = set()
+        for td in data:
+            if raw_key not in td or td[message_id_key] in seen_message_ids:
+                continue
+            seen_message_ids.add(td[message_id_key])
+
+            labels = []
+            for coded_key in scheme_key_map.keys():
+                if coded_key not in td:
+                    continue
+                for label in td[coded_key] if isinstance(td[coded_key], list) else [td[coded_key]]:
+                    labels.append({k: v for k, v in label.items() if k != "DateTimeUTC"})
+
+            sha.update(json.dumps(
+                [td[message_id_key], td[raw_key], td[creation_date_time_key], labels], sort_keys=True
+            ).encode("utf-8"))
+        return sha.hexdigest()
+
+    def is_unchanged(self, coda_filename, content_hash):
+        """
+        :param coda_filename: Name of the Coda file in the output directory.
+        :type coda_filename: str
+        :param content_hash: Hash of the messages which would now be written to this file.
+        :type content_hash: str
+        :return: Whether the file already exists and was last written with messages with this hash.
+        :rtype: bool
+        """
+        return self._hashes.get(coda_filename) == content_hash and \
+            os.path.exists(os.path.join(self.coda_output_dir, coda_filename))
+
+    def update(self, coda_filename, content_hash):
+        """
+        Records that a Coda file has been written. Call `CodaExportManifest.save` to persist this for later runs.
+
+        :param coda_filename: Name of the Coda file which was written.
+        :type coda_filename: str
+        :param content_hash: Hash of the messages which were written.
+        :type content_hash: str
+        """
+        self._hashes[coda_filename] = content_hash
+
+    def save(self):
+        with open(self._path, "w") as f:
+            json.dump(self._hashes, f, sort_keys=True, indent=2)
+
+
+class CodaMessagesWriter(object):
+    @staticmethod
+    def write(data, raw_key, creation_date_time_key, message_id_key, scheme_key_map, f):
+        """
+        Writes messages to a Coda messages file, in the format written by
+        `TracedDataCodaV2IO.export_traced_data_iterable_to_coda_2`, one message at a time rather than building the
+        whole file in memory first.
+
+        :param data: TracedData objects to export. Objects without a `raw_key` are skipped, as are objects with a
+                     message id that has already been written.
+        :type data: iterable of TracedData
+        :param raw_key: Key in each TracedData object of the message text.
+        :type raw_key: str
+        :param creation_date_time_key: Key in each TracedData object of the time the message was sent,
+                                       in ISO 8601 format.
+        :type creation_date_time_key: str
+        :param message_id_key: Key in each TracedData object of the message id.
+        :type message_id_key: str
+        :param scheme_key_map: Dictionary of key in each TracedData object of the labels to export -> code scheme of
+                               those labels.
+        :type scheme_key_map: dict of str -> core_data_modules.data_models.CodeScheme
+        :param f: File to write the messages to.
+        :type f: file-like
+        :return: Number of messages written.
+        :rtype: int
+        """
+        seen_message_ids = set()
+        f.write("[")
+        for td in data:
+            if raw_key not in td or td[message_id_key] in seen_message_ids:
+                continue
+            seen_message_ids.add(td[message_id_key])
+
+            labels = []
+            for coded_key in scheme_key_map.keys():
+                if coded_key not in td:
+                    continue
+                if isinstance(td[coded_key], list):
+                    labels.extend(Label.from_dict(label) for label in td[coded_key])
+                else:
+                    labels.append(Label.from_dict(td[coded_key]))
+
+            message = Message(
+                message_id=td[message_id_key], text=td[raw_key],
+                creation_date_time_utc=isoparse(td[creation_date_time_key]).astimezone(pytz.utc).isoformat(),
+                labels=labels
+            )
+
+            if len(seen_message_ids) > 1:
+                f.write(",")
+            f.write("\n  ")
+            json.dump(message.to_firebase_map(), f, sort_keys=True)
+        f.write("\n]\n")
+
+        return len(seen_message_ids)
@@ -0,0 +1,66 @@
+from core_data_modules.cleaners import Codes
+from core_data_modules.data_models.code_scheme import CodeTypes
+from core_data_modules.logging import Logger
+
+from configurations.code_schemes import CodeSchemes
+from src.lib.configuration_objects import CodingModes
+from src.lib.label_matrix import LabelMatrix
+
+log = Logger(__name__)
+
+
+class CodingConsistency(object):
+    @staticmethod
+    def find_coding_errors(data, coding_plans, coded_field_suffix, correct_dataset_suffix):
+        """
+        Finds the messages whose labels disagree on whether they are in the wrong scheme.
+
+        A (message, plan) pair is inconsistent if exactly one of the following holds:
+         - a coded field of the plan has a label with the control code WRONG_SCHEME.
+         - the plan's 'WS - Correct Dataset' field has a label with a Normal code or NOT_CODED, i.e. the message was
+           moved to another dataset, or was marked as not belonging to any dataset.
+
+        The check runs over a `LabelMatrix` of every plan's fields, so each label is decoded once, and logs one
+        warning per plan with the number of inconsistent messages.
+
+        :param data: TracedData objects to check.
+        :type data: list of TracedData
+        :param coding_plans: Coding plans to check.
+        :type coding_plans: iterable of src.lib.pipeline_configuration.CodingPlan
+        :param coded_field_suffix: Suffix to append to each coded field to get the key of its labels, e.g. "_WS" for
+                                   the labels imported for WS correction, or "" for the coded fields themselves.
+        :type coded_field_suffix: str
+        :param correct_dataset_suffix: Suffix to append to each plan's raw field to get the key of its
+                                       'WS - Correct Dataset' label, e.g. "_WS_correct_dataset" or "_correct_dataset".
+        :type correct_dataset_suffix: str
+        :return: For each coding plan, the rows in `data` which are inconsistent for that plan, in ascending order.
+        :rtype: list of (src.lib.pipeline_configuration.CodingPlan, list of int)
+        """
+        matrix = LabelMatrix(data, [])
+        coding_errors = []
+        for plan in coding_plans:
+            coded_keys = []
+            for cc in plan.coding_configurations:
+                coded_key = f"{cc.coded_field}{coded_field_suffix}"
+                matrix.add_column(coded_key, cc.code_scheme, cc.coding_mode)
+                coded_keys.append(coded_key)
+            has_ws_code_in_code_scheme = matrix.rows_with_control_code(coded_keys, Codes.WRONG_SCHEME)
+
+            correct_dataset_key = f"{plan.raw_field}{correct_dataset_suffix}"
+            matrix.add_column(correct_dataset_key, CodeSchemes.WS_CORRECT_DATASET_SCHEME, CodingModes.SINGLE)
+            ws_index = matrix.scheme_index(correct_dataset_key)
+            ws_mask = ws_index.code_type_mask(CodeTypes.NORMAL) | ws_index.control_code_mask(Codes.NOT_CODED)
+
+            has_ws_code_in_ws_scheme = matrix.rows_with_code_in_mask(correct_dataset_key, ws_mask)
+
+            rows = [
+                i for i, (in_code_scheme, in_ws_scheme)
+                in enumerate(zip(has_ws_code_in_code_scheme, has_ws_code_in_ws_scheme))
+                if in_code_scheme != in_ws_scheme
+            ]
+            if len(rows) > 0:
+                log.warning(f"Coding Error: {len(rows)} messages in {plan.raw_field} have inconsistent WS codes in "
+                            f"their code schemes and in '{correct_dataset_key}'")
+            coding_errors.append((plan, rows))
+
+        return coding_errors
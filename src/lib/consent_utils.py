@@ -1,9 +1,9 @@
-import time
-
 from core_data_modules.cleaners import Codes
-from core_data_modules.traced_data import Metadata
 
+from configurations.code_schemes import CodeSchemeLookup
 from src.lib.configuration_objects import CodingModes
+from src.lib.label_matrix import LabelMatrix
+from src.lib.metadata_factory import MetadataFactory
 
 
 class ConsentUtils(object):
@@ -21,12 +21,13 @@ class ConsentUtils(object):
         """
         for plan in coding_plans:
             for cc in plan.coding_configurations:
+                lookup = CodeSchemeLookup.for_scheme(cc.code_scheme)
                 if cc.coding_mode == CodingModes.SINGLE:
-                    if cc.code_scheme.get_code_with_code_id(td[cc.coded_field]["CodeID"]).control_code == Codes.STOP:
+                    if lookup.flags(td[cc.coded_field]["CodeID"]).is_stop:
                         return True
                 else:
                     for label in td[cc.coded_field]:
-                        if cc.code_scheme.get_code_with_code_id(label["CodeID"]).control_code == Codes.STOP:
+                        if lookup.flags(label["CodeID"]).is_stop:
                             return True
         return False
 
@@ -43,26 +44,24 @@ class ConsentUtils(object):
         :param user: Identifier of the user running this program, for TracedData Metadata.
         :type user: str
         :param data: TracedData objects to determine consent for.
-        :type data: iterable of TracedData
+        :type data: list of TracedData
         :param coding_plans: Coding plans for the fields to search for stop codes.
         :type coding_plans: iterable of CodingPlan
         :param withdrawn_key: Name of key to use for the consent withdrawn field.
         :type withdrawn_key: str
         """
+        metadata_factory = MetadataFactory(user)
         for td in data:
-            td.append_data({withdrawn_key: Codes.FALSE}, Metadata(user, Metadata.get_call_location(), time.time()))
+            td.append_data({withdrawn_key: Codes.FALSE}, metadata_factory.metadata())
 
-        stopped_uids = set()
-        for td in data:
-            if cls.td_has_stop_code(td, coding_plans):
-                stopped_uids.add(td["uid"])
+        coding_configurations = [cc for plan in coding_plans for cc in plan.coding_configurations]
+        stop_rows = LabelMatrix(data, coding_configurations).rows_with_control_code(
+            [cc.coded_field for cc in coding_configurations], Codes.STOP)
+        stopped_uids = {td["uid"] for td, stopped in zip(data, stop_rows) if stopped}
 
         for td in data:
             if td["uid"] in stopped_uids:
-                td.append_data(
-                    {withdrawn_key: Codes.TRUE},
-                    Metadata(user, Metadata.get_call_location(), time.time())
-                )
+                td.append_data({withdrawn_key: Codes.TRUE}, metadata_factory.metadata())
 
     @staticmethod
     def set_stopped(user, data, withdrawn_key="consent_withdrawn", additional_keys=None):
@@ -82,7 +81,8 @@ class ConsentUtils(object):
         if additional_keys is None:
             additional_keys = []
 
+        metadata_factory = MetadataFactory(user)
         for td in data:
             if td.get(withdrawn_key) == Codes.TRUE:
                 stop_dict = {key: Codes.STOP for key in list(td.keys()) + additional_keys if key != withdrawn_key}
-                td.append_data(stop_dict, Metadata(user, Metadata.get_call_location(), time.time()))
+                td.append_data(stop_dict, metadata_factory.metadata())
@@ -8,14 +8,103 @@ log = Logger(__name__)
 # TODO: Move to Core
 class ICRTools(object):
     @staticmethod
-    def generate_sample_for_icr(data, sample_size, random_generator=None):
-        # FIXME: Should data be de-duplicated before exporting for ICR?
-
+    def generate_sample_for_icr(data, sample_size, random_generator=None, deduplicate_key=None):
+        """
+        :param data: Items to sample from.
+        :type data: list
+        :param sample_size: Number of items to sample.
+        :type sample_size: int
+        :param random_generator: Random generator to sample with. If None, uses the `random` module.
+        :type random_generator: random.Random | None
+        :param deduplicate_key: If set, only the first item with each value of `item[deduplicate_key]` is eligible
+                                for the sample, so that e.g. identical message texts are not coded twice.
+        :type deduplicate_key: str | None
+        :return: The sampled items.
+        :rtype: list
+        """
         if random_generator is None:
             random_generator = random
+        if deduplicate_key is not None:
+            data = ICRTools.deduplicate(data, deduplicate_key)
         if len(data) < sample_size:
             log.warning(f"The size of the ICR data ({len(data)} items) is less than the requested sample_size "
                         f"({sample_size} items). Returning all the input data as ICR.")
             sample_size = len(data)
 
         return random_generator.sample(data, sample_size)
+
+    @staticmethod
+    def deduplicate(data, key):
+        """
+        :param data: Items to de-duplicate.
+        :type data: iterable
+        :param key: Key of the value to de-duplicate the items by.
+        :type key: str
+        :return: The first item with each value of `item[key]`, in input order.
+        :rtype: list
+        """
+        seen_values = set()
+        unique_data = []
+        for item in data:
+            if item[key] in seen_values:
+                continue
+            seen_values.add(item[key])
+            unique_data.append(item)
+        return unique_data
+
+
+class ICRSampler(object):
+    def __init__(self, sample_size, random_generator=None, deduplicate_key=None):
+        """
+        Single-pass, fixed-memory sampler of items for ICR, which reservoir samples items as they are added
+        (Vitter's algorithm R) instead of needing all of the eligible items in a list up front.
+
+        For a seeded `random_generator`, the sample depends only on the seed and the order the items are added in.
+
+        :param sample_size: Number of items to sample.
+        :type sample_size: int
+        :param random_generator: Random generator to sample with. If None, uses the `random` module.
+        :type random_generator: random.Random | None
+        :param deduplicate_key: If set, only the first item added with each value of `item[deduplicate_key]` is
+                                eligible for the sample. Note that this holds every distinct value in memory.
+        :type deduplicate_key: str | None
+        """
+        if random_generator is None:
+            random_generator = random
+
+        self.sample_size = sample_size
+        self.random_generator = random_generator
+        self.deduplicate_key = deduplicate_key
+        self.items_count = 0
+
+        self._reservoir = []
+        self._seen_values = set()
+
+    def add(self, item):
+        """
+        :param item: Item to consider for the sample.
+        :type item: any
+        """
+        if self.deduplicate_key is not None:
+            if item[self.deduplicate_key] in self._seen_values:
+                return
+            self._seen_values.add(item[self.deduplicate_key])
+
+        self.items_count += 1
+        if len(self._reservoir) < self.sample_size:
+            self._reservoir.append(item)
+            return
+
+        i = self.random_generator.randrange(self.items_count)
+        if i < self.sample_size:
+            self._reservoir[i] = item
+
+    def sample(self):
+        """
+        :return: The sampled items. If fewer than `sample_size` items were added, returns all of them.
+        :rtype: list
+        """
+        if self.items_count < self.sample_size:
+            log.warning(f"The size of the ICR data ({self.items_count} items) is less than the requested sample_size "
+                        f"({self.sample_size} items). Returning all the input data as ICR.")
+        return list(self._reservoir)
@@ -0,0 +1,260 @@
+from configurations.code_schemes import CodeSchemeLookup
+from src.lib.configuration_objects import CodingModes
+
+
+class CodeSchemeIndex(object):
+    _indexes = dict()  # of id(code scheme) -> (code scheme, CodeSchemeIndex), shared by every LabelMatrix
+
+    def __init__(self, code_scheme):
+        """
+        Integer index of the codes in a code scheme, with the control code and code type of each code precomputed.
+        Code ids are resolved to positions by the scheme's shared `CodeSchemeLookup`.
+
+        Use `CodeSchemeIndex.for_scheme` rather than constructing this directly, so that each scheme is only indexed
+        once.
+
+        :param code_scheme: Code scheme to index.
+        :type code_scheme: core_data_modules.data_models.CodeScheme
+        """
+        self.code_scheme = code_scheme
+        self.lookup = CodeSchemeLookup.for_scheme(code_scheme)
+        self.codes = list(code_scheme.codes)
+        self.control_codes = [code.control_code for code in self.codes]
+        self.code_types = [code.code_type for code in self.codes]
+
+    @classmethod
+    def for_scheme(cls, code_scheme):
+        """
+        :param code_scheme: Code scheme to get the index of.
+        :type code_scheme: core_data_modules.data_models.CodeScheme
+        :return: The index of `code_scheme`, building it if this scheme has not been indexed before.
+        :rtype: CodeSchemeIndex
+        """
+        cached = cls._indexes.get(id(code_scheme))
+        if cached is None or cached[0] is not code_scheme:
+            cached = (code_scheme, cls(code_scheme))
+            cls._indexes[id(code_scheme)] = cached
+        return cached[1]
+
+    def index_of(self, code_id):
+        """
+        :param code_id: Id of the code to look up.
+        :type code_id: str
+        :return: Position of the code with id `code_id` in this scheme.
+        :rtype: int
+        """
+        return self.lookup.position_of(code_id)
+
+    def control_code_mask(self, *control_codes):
+        """
+        :param control_codes: Control codes to match.
+        :type control_codes: str
+        :return: Bitset with the bit set for every code in this scheme which has one of the given control codes.
+        :rtype: int
+        """
+        return self._mask(self.control_codes, control_codes)
+
+    def code_type_mask(self, *code_types):
+        """
+        :param code_types: Code types to match.
+        :type code_types: str
+        :return: Bitset with the bit set for every code in this scheme which has one of the given code types.
+        :rtype: int
+        """
+        return self._mask(self.code_types, code_types)
+
+    @staticmethod
+    def _mask(values, matches):
+        mask = 0
+        for i, value in enumerate(values):
+            if value in matches:
+                mask |= 1 << i
+        return mask
+
+
+class LabelMatrix(object):
+    # Entry in a SINGLE coded field's column for rows with no label in that field.
+    NO_LABEL = -1
+
+    def __init__(self, data, coding_configurations):
+        """
+        Columnar, integer-coded view of the labels in a dataset.
+
+        Each coded field has one column, with one entry per TracedData object, in terms of the positions of the codes
+        in the field's code scheme (see `CodeSchemeIndex`):
+         - SINGLE coded fields hold the position of the labelled code, or `LabelMatrix.NO_LABEL`.
+         - MULTIPLE coded fields hold a bitset, where bit i is set if the object has a label with the i'th code, or
+           0 if it has no labels.
+        Fields which are absent from an object are treated as having no labels.
+
+        The labels are decoded once, when the matrix is built, so that consent, noise, relevance and distribution
+        checks can then be computed with integer operations over whole columns.
+
+        The MULTIPLE bitsets are Python ints rather than a fixed-width NumPy dtype because some schemes, e.g. age,
+        have more than 64 codes.
+
+        Every field must hold labels. In particular, objects which have been through `ConsentUtils.set_stopped` hold
+        'STOP' instead of labels if consent was withdrawn, so must be excluded before building the matrix.
+
+        :param data: TracedData objects to index the labels of. The rows of the matrix are in the same order.
+        :type data: list of TracedData
+        :param coding_configurations: Coding configurations of the coded fields to index.
+        :type coding_configurations: iterable of src.lib.pipeline_configuration.CodingConfiguration
+        """
+        self.data = data
+        self._columns = dict()  # of coded field -> list of int
+        self._indexes = dict()  # of coded field -> CodeSchemeIndex
+        self._coding_modes = dict()  # of coded field -> str
+
+        for cc in coding_configurations:
+            self.add_column(cc.coded_field, cc.code_scheme, cc.coding_mode)
+
+    def __len__(self):
+        return len(self.data)
+
+    def add_column(self, coded_field, code_scheme, coding_mode):
+        """
+        Indexes the labels in another coded field. Does nothing if this field has already been indexed.
+
+        :param coded_field: Key of the labels in each TracedData object.
+        :type coded_field: str
+        :param code_scheme: Code scheme the labels in `coded_field` are from.
+        :type code_scheme: core_data_modules.data_models.CodeScheme
+        :param coding_mode: Coding mode of `coded_field`.
+        :type coding_mode: str
+        """
+        if coded_field in self._columns:
+            return
+
+        index = CodeSchemeIndex.for_scheme(code_scheme)
+        if coding_mode == CodingModes.SINGLE:
+            column = [index.index_of(td[coded_field]["CodeID"]) if coded_field in td else self.NO_LABEL
+                      for td in self.data]
+        else:
+            assert coding_mode == CodingModes.MULTIPLE
+            column = []
+            for td in self.data:
+                bitset = 0
+                if coded_field in td:
+                    for label in td[coded_field]:
+                        bitset |= 1 << index.index_of(label["CodeID"])
+                column.append(bitset)
+
+        self._columns[coded_field] = column
+        self._indexes[coded_field] = index
+        self._coding_modes[coded_field] = coding_mode
+
+    def column(self, coded_field):
+        """
+        :param coded_field: Coded field to get the column of.
+        :type coded_field: str
+        :return: For each row, the position of the code in `coded_field` or `LabelMatrix.NO_LABEL` if the field is
+                 SINGLE coded, or the bitset of the codes in `coded_field` if the field is MULTIPLE coded.
+        :rtype: list of int
+        """
+        return self._columns[coded_field]
+
+    def coding_mode(self, coded_field):
+        """
+        :param coded_field: Coded field to get the coding mode of.
+        :type coded_field: str
+        :return: Coding mode of `coded_field`, which determines the format of its column.
+        :rtype: str
+        """
+        return self._coding_modes[coded_field]
+
+    def scheme_index(self, coded_field):
+        """
+        :param coded_field: Coded field to get the scheme index of.
+        :type coded_field: str
+        :return: Index of the code scheme of `coded_field`, which maps the entries in this field's column to codes.
+        :rtype: CodeSchemeIndex
+        """
+        return self._indexes[coded_field]
+
+    def labelled_rows(self, coded_field):
+        """
+        :param coded_field: Coded field to search.
+        :type coded_field: str
+        :return: For each row, whether `coded_field` contains at least one label.
+        :rtype: list of bool
+        """
+        if self._coding_modes[coded_field] == CodingModes.SINGLE:
+            return [code_index != self.NO_LABEL for code_index in self._columns[coded_field]]
+        return [bitset != 0 for bitset in self._columns[coded_field]]
+
+    def rows_with_code_in_mask(self, coded_field, mask):
+        """
+        :param coded_field: Coded field to search.
+        :type coded_field: str
+        :param mask: Bitset of the codes to search for, e.g. from `CodeSchemeIndex.control_code_mask`.
+        :type mask: int
+        :return: For each row, whether `coded_field` contains a label with any of the codes in `mask`.
+        :rtype: list of bool
+        """
+        if self._coding_modes[coded_field] == CodingModes.SINGLE:
+            in_mask = [mask >> i & 1 == 1 for i in range(len(self._indexes[coded_field].codes))]
+            return [code_index != self.NO_LABEL and in_mask[code_index] for code_index in self._columns[coded_field]]
+        return [bitset & mask != 0 for bitset in self._columns[coded_field]]
+
+    def rows_with_control_code(self, coded_fields, *control_codes):
+        """
+        :param coded_fields: Coded fields to search.
+        :type coded_fields: iterable of str
+        :param control_codes: Control codes to search for.
+        :type control_codes: str
+        :return: For each row, whether any of the `coded_fields` contain a label with any of the `control_codes`.
+        :rtype: list of bool
+        """
+        return self._rows_matching(
+            coded_fields, lambda coded_field: self._indexes[coded_field].control_code_mask(*control_codes))
+
+    def rows_with_code_type(self, coded_fields, *code_types):
+        """
+        :param coded_fields: Coded fields to search.
+        :type coded_fields: iterable of str
+        :param code_types: Code types to search for.
+        :type code_types: str
+        :return: For each row, whether any of the `coded_fields` contain a label with any of the `code_types`.
+        :rtype: list of bool
+        """
+        return self._rows_matching(
+            coded_fields, lambda coded_field: self._indexes[coded_field].code_type_mask(*code_types))
+
+    def _rows_matching(self, coded_fields, make_mask):
+        matches = [False] * len(self.data)
+        for coded_field in coded_fields:
+            mask = make_mask(coded_field)
+            if mask == 0:
+                continue
+            matches = [matched or in_mask
+                       for matched, in_mask in zip(matches, self.rows_with_code_in_mask(coded_field, mask))]
+        return matches
+
+    def code_counts(self, coded_field, rows=None):
+        """
+        Counts the number of rows with a label for each code in a coded field.
+
+        :param coded_field: Coded field to count the codes of.
+        :type coded_field: str
+        :param rows: For each row, whether to include it in the counts. If None, all rows are counted.
+        :type rows: list of bool | None
+        :return: Number of rows labelled with each code, in the order of the codes in the field's scheme.
+        :rtype: list of int
+        """
+        counts = [0] * len(self._indexes[coded_field].codes)
+        single_coded = self._coding_modes[coded_field] == CodingModes.SINGLE
+        for i, entry in enumerate(self._columns[coded_field]):
+            if rows is not None and not rows[i]:
+                continue
+            if single_coded:
+                if entry != self.NO_LABEL:
+                    counts[entry] += 1
+                continue
+            code_index = 0
+            while entry != 0:
+                if entry & 1:
+                    counts[code_index] += 1
+                entry >>= 1
+                code_index += 1
+        return counts
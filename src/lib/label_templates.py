@@ -0,0 +1,77 @@
+from core_data_modules.cleaners.cleaning_utils import CleaningUtils
+from core_data_modules.traced_data import Metadata
+
+from configurations.code_schemes import CodeSchemeLookup
+from src.lib.configuration_objects import CodingModes
+
+
+class LabelTemplates(object):
+    def __init__(self, metadata_factory):
+        """
+        Cache of the labels a pipeline stage assigns automatically, e.g. TRUE_MISSING, NOT_CODED or CODING_ERROR, or
+        imputed codes, so that each label is built once per stage rather than once per message and field.
+
+        Every label handed out is a copy of its template, so callers may modify the labels they receive. Labels from
+        the same template share the stage's origin and the time the template was built, as the Metadata from a
+        `MetadataFactory` does. In `MetadataFactory.STRICT` mode, every label is built afresh instead.
+
+        :param metadata_factory: Metadata factory of the stage, for the origin of the labels.
+        :type metadata_factory: src.lib.MetadataFactory
+        """
+        self.metadata_factory = metadata_factory
+        self._templates = dict()  # of (id(code scheme), code id) -> (code scheme, label dict)
+
+    def label(self, code_scheme, control_code):
+        """
+        :param code_scheme: Code scheme of the label.
+        :type code_scheme: core_data_modules.data_models.CodeScheme
+        :param control_code: Control code of the code to label with.
+        :type control_code: str
+        :return: A label with the code in `code_scheme` which has `control_code`, as a dict.
+        :rtype: dict
+        """
+        return self._label(code_scheme, CodeSchemeLookup.for_scheme(code_scheme).code_with_control_code(control_code))
+
+    def _label(self, code_scheme, code):
+        # Only called from the public methods, so in strict mode the origin is the caller of those methods.
+        if self.metadata_factory.strict:
+            return self._make_label(code_scheme, code, Metadata.get_call_location(depth=3))
+
+        key = (id(code_scheme), code.code_id)
+        cached = self._templates.get(key)
+        if cached is None or cached[0] is not code_scheme:
+            cached = (code_scheme, self._make_label(code_scheme, code, self.metadata_factory.call_location()))
+            self._templates[key] = cached
+
+        return {k: dict(v) if isinstance(v, dict) else v for k, v in cached[1].items()}
+
+    def coded_value(self, coding_configuration, control_code):
+        """
+        :param coding_configuration: Coding configuration of the field to label.
+        :type coding_configuration: src.lib.configuration_objects.CodingConfiguration
+        :param control_code: Control code of the code to label with.
+        :type control_code: str
+        :return: The value to write to the coded field: a label with the given control code for SINGLE coded fields,
+                 or a list containing that label for MULTIPLE coded fields.
+        :rtype: dict | list of dict
+        """
+        code_scheme = coding_configuration.code_scheme
+        label = self._label(code_scheme, CodeSchemeLookup.for_scheme(code_scheme).code_with_control_code(control_code))
+        return label if coding_configuration.coding_mode == CodingModes.SINGLE else [label]
+
+    def coded_value_with_code(self, coding_configuration, code):
+        """
+        :param coding_configuration: Coding configuration of the field to label.
+        :type coding_configuration: src.lib.configuration_objects.CodingConfiguration
+        :param code: Code in the configuration's code scheme to label with, e.g. an imputed code.
+        :type code: core_data_modules.data_models.Code
+        :return: The value to write to the coded field: a label with `code` for SINGLE coded fields, or a list
+                 containing that label for MULTIPLE coded fields.
+        :rtype: dict | list of dict
+        """
+        label = self._label(coding_configuration.code_scheme, code)
+        return label if coding_configuration.coding_mode == CodingModes.SINGLE else [label]
+
+    @staticmethod
+    def _make_label(code_scheme, code, origin_id):
+        return CleaningUtils.make_label_from_cleaner_code(code_scheme, code, origin_id).to_dict()
@@ -1,12 +1,38 @@
 from core_data_modules.logging import Logger
-from dateutil.parser import isoparse
 from src.lib.pipeline_configuration import PipelineConfiguration
-from src.lib.pipeline_configuration import CodingModes
 from core_data_modules.cleaners import Codes
+from src.lib.label_matrix import LabelMatrix
+from src.lib.timestamp_store import TimestampStore
 
 log = Logger(__name__)
 
 
+class ValidationModes(object):
+    FULL = "full"  # Validate every message
+    SAMPLED = "sampled"  # Validate one message in every `MessageFilter.VALIDATION_SAMPLE_INTERVAL`
+    OFF = "off"  # Don't validate
+
+
+class MessageFilter(object):
+    # Number of messages between each message validated by filters in ValidationModes.SAMPLED.
+    VALIDATION_SAMPLE_INTERVAL = 100
+
+    def __init__(self, keep, start_log_message, end_log_message):
+        """
+        A named predicate over messages, for fusing with other filters in `MessageFilters.apply_filters`.
+
+        :param keep: Function which, given a message, returns whether to keep it.
+        :type keep: function of TracedData -> bool
+        :param start_log_message: Message to log at debug level before filtering.
+        :type start_log_message: str
+        :param end_log_message: Message to log at info level after filtering, before the count of messages kept.
+        :type end_log_message: str
+        """
+        self.keep = keep
+        self.start_log_message = start_log_message
+        self.end_log_message = end_log_message
+
+
 # TODO: Move to Core once adapted for and tested on a pipeline that supports multiple radio shows
 class MessageFilters(object):
     @staticmethod
@@ -17,104 +43,204 @@ class MessageFilters(object):
                  f"Returning {len(filtered)}/{len(messages)} messages.")
         return filtered
 
+    @staticmethod
+    def apply_filters(messages, filters):
+        """
+        Filters a list of messages for messages which pass all of the given filters, in a single pass.
+
+        The filters are applied to each message in order, stopping at the first filter which drops it, so each filter
+        only sees the messages kept by the filters before it. The log lines are the same as if each filter had been
+        run as a separate pass over the output of the one before.
+
+        The messages are only iterated over once, so they may be given as any iterable, e.g. a generator.
+
+        :param messages: Message objects to filter.
+        :type messages: iterable of TracedData
+        :param filters: Filters to apply, in order.
+        :type filters: list of MessageFilter
+        :return: Filtered list.
+        :rtype: list of TracedData
+        """
+        for f in filters:
+            log.debug(f.start_log_message)
+
+        filtered = []
+        messages_count = 0
+        dropped_counts = [0] * len(filters)
+        for td in messages:
+            messages_count += 1
+            for i, f in enumerate(filters):
+                if not f.keep(td):
+                    dropped_counts[i] += 1
+                    break
+            else:
+                filtered.append(td)
+
+        for f, dropped_count in zip(filters, dropped_counts):
+            log.info(f"{f.end_log_message} "
+                     f"Returning {messages_count - dropped_count}/{messages_count} messages.")
+            messages_count -= dropped_count
+
+        return filtered
+
+    @staticmethod
+    def test_messages_filter(test_run_key="test_run"):
+        """
+        :param test_run_key: Key in each TracedData of the test message tag.
+                             TracedData objects td where td.get(test_run_key) == True are dropped.
+        :type test_run_key: str
+        :return: Filter which drops messages tagged as being test messages.
+        :rtype: MessageFilter
+        """
+        return MessageFilter(
+            lambda td: not td.get(test_run_key, False),
+            "Filtering out test messages...",
+            "Filtered out test messages."
+        )
+
     @staticmethod
     def filter_test_messages(messages, test_run_key="test_run"):
         """
         Filters a list of messages for messages which aren't tagged as being test messages.
+
+        The messages are only iterated over once, so they may be given as any iterable, e.g. a generator.
         
-        :param messages: List of message objects to filter. 
-        :type messages: list of TracedData
+        :param messages: Message objects to filter. 
+        :type messages: iterable of TracedData
         :param test_run_key: Key in each TracedData of the test message tag.
                              TracedData objects td where td.get(test_run_key) == True are dropped.
         :type test_run_key: str
         :return: Filtered list.
         :rtype: list of TracedData
         """
-        log.debug("Filtering out test messages...")
-        filtered = [td for td in messages if not td.get(test_run_key, False)]
-        log.info(f"Filtered out test messages. "
-                 f"Returning {len(filtered)}/{len(messages)} messages.")
-        return filtered
+        return MessageFilters.apply_filters(messages, [MessageFilters.test_messages_filter(test_run_key)])
+
+    @staticmethod
+    def empty_messages_filter(message_keys):
+        """
+        :param message_keys: Keys in each TracedData to search for a message.
+        :type message_keys: list of str
+        :return: Filter which drops messages which don't contain an answer in any of the `message_keys`.
+        :rtype: MessageFilter
+        """
+        return MessageFilter(
+            lambda td: any(message_key in td for message_key in message_keys),
+            "Filtering out empty message objects...",
+            "Filtered out empty message objects."
+        )
 
     @staticmethod
     def filter_empty_messages(messages, message_keys):
         """
         Filters a list of messages for objects which contain an answer in at least one of the given message_keys.
+
+        The messages are only iterated over once, so they may be given as any iterable, e.g. a generator.
         
-        :param messages: List of message objects to filter.
-        :type messages: list of TracedData
+        :param messages: Message objects to filter.
+        :type messages: iterable of TracedData
         :param message_keys: Keys in each TracedData to search for a message.
         :type message_keys: list of str
         :return: Filtered list.
         :rtype: list of TracedData 
         """
-        log.debug("Filtering out empty message objects...")
-        filtered = []
-        for td in messages:
-            for message_key in message_keys:
-                if message_key in td:
-                    filtered.append(td)
-                    continue
-        log.info(f"Filtered out empty message objects. "
-                 f"Returning {len(filtered)}/{len(messages)} messages.")
-        return filtered
+        return MessageFilters.apply_filters(messages, [MessageFilters.empty_messages_filter(message_keys)])
 
     @staticmethod
-    def filter_time_range(messages, time_keys, start_time_inclusive, end_time_inclusive):
+    def time_range_filter(time_keys, start_time_inclusive, end_time_inclusive, timestamps=None,
+                          validation=ValidationModes.FULL):
         """
-        Filters a list of messages for messages received within the given time range.
-
-        :param messages: List of message objects to filter.
-        :type messages: list of TracedData
         :param time_keys: Keys in each TracedData object that contain the time the message was sent.
                           Each TracedData should have exactly one match for each key.
                           The values must be strings in ISO 8601 format.
         :type time_keys: set of str
         :param start_time_inclusive: Inclusive start time of the time range to keep.
-                           Messages sent before this time will be dropped. 
+                           Messages sent before this time will be dropped.
         :type start_time_inclusive: datetime.datetime
         :param end_time_inclusive: Exclusive end time of the time range to keep.
                          Messages sent after this time will be dropped.
         :type end_time_inclusive: datetime.datetime
-        :return: Filtered list.
-        :rtype: list of TracedData
+        :param timestamps: Store to read the parsed message timestamps from. If None, a new store is used.
+        :type timestamps: src.lib.TimestampStore | None
+        :param validation: Which messages to check contain exactly one of the `time_keys`, one of ValidationModes.
+        :type validation: str
+        :return: Filter which drops messages sent outside the given time range.
+        :rtype: MessageFilter
         """
         # De-duplicate time_keys
         assert isinstance(time_keys, set)
+        assert validation in {ValidationModes.FULL, ValidationModes.SAMPLED, ValidationModes.OFF}
 
-        log.debug(f"Filtering out messages sent outside the time range "
-                  f"{start_time_inclusive.isoformat()} to {end_time_inclusive.isoformat()} "
-                  f"for time keys {time_keys}...")
+        if timestamps is None:
+            timestamps = TimestampStore()
+        range_start = TimestampStore.microseconds_since_epoch(start_time_inclusive)
+        range_end = TimestampStore.microseconds_since_epoch(end_time_inclusive)
 
-        # Validate the input data to ensure that each message object only contains one of the time_keys.
-        for td in messages:
-            matching_time_keys = 0
-            for time_key in time_keys:
-                if time_key in td:
-                    matching_time_keys += 1
-            assert matching_time_keys == 1, matching_time_keys
+        validated_count = [0]  # of messages seen, in a list so that it can be updated by `keep`
+
+        def keep(td):
+            # Validate the input data to ensure that each message object only contains one of the time_keys.
+            if validation == ValidationModes.FULL or \
+                    (validation == ValidationModes.SAMPLED and
+                     validated_count[0] % MessageFilter.VALIDATION_SAMPLE_INTERVAL == 0):
+                matching_time_keys = 0
+                for time_key in time_keys:
+                    if time_key in td:
+                        matching_time_keys += 1
+                assert matching_time_keys == 1, matching_time_keys
+            validated_count[0] += 1
 
-        # Perform the actual filtering
-        filtered = []
-        for td in messages:
             for time_key in time_keys:
-                if time_key in td and start_time_inclusive <= isoparse(td[time_key]) < end_time_inclusive:
-                    filtered.append(td)
-                    break
+                if time_key in td and range_start <= timestamps.get(td, time_key).epoch_microseconds < range_end:
+                    return True
+            return False
 
-        log.info(f"Filtered out messages sent outside the time range "
-                 f"{start_time_inclusive.isoformat()} to {end_time_inclusive.isoformat()}. "
-                 f"Returning {len(filtered)}/{len(messages)} messages.")
+        return MessageFilter(
+            keep,
+            f"Filtering out messages sent outside the time range "
+            f"{start_time_inclusive.isoformat()} to {end_time_inclusive.isoformat()} for time keys {time_keys}...",
+            f"Filtered out messages sent outside the time range "
+            f"{start_time_inclusive.isoformat()} to {end_time_inclusive.isoformat()}."
+        )
 
-        return filtered
+    @staticmethod
+    def filter_time_range(messages, time_keys, start_time_inclusive, end_time_inclusive, timestamps=None,
+                          validation=ValidationModes.FULL):
+        """
+        Filters a list of messages for messages received within the given time range.
+
+        The messages are only iterated over once, so they may be given as any iterable, e.g. a generator.
+
+        :param messages: Message objects to filter.
+        :type messages: iterable of TracedData
+        :param time_keys: Keys in each TracedData object that contain the time the message was sent.
+                          Each TracedData should have exactly one match for each key.
+                          The values must be strings in ISO 8601 format.
+        :type time_keys: set of str
+        :param start_time_inclusive: Inclusive start time of the time range to keep.
+                           Messages sent before this time will be dropped. 
+        :type start_time_inclusive: datetime.datetime
+        :param end_time_inclusive: Exclusive end time of the time range to keep.
+                         Messages sent after this time will be dropped.
+        :type end_time_inclusive: datetime.datetime
+        :param timestamps: Store to read the parsed message timestamps from. If None, a new store is used.
+        :type timestamps: src.lib.TimestampStore | None
+        :param validation: Which messages to check contain exactly one of the `time_keys`, one of ValidationModes.
+        :type validation: str
+        :return: Filtered list.
+        :rtype: list of TracedData
+        """
+        return MessageFilters.apply_filters(messages, [MessageFilters.time_range_filter(
+            time_keys, start_time_inclusive, end_time_inclusive, timestamps, validation)])
 
     @staticmethod
     def filter_noise(messages, message_key, noise_fn):
         """
         Filters a list of messages for messages which aren't noise.
+
+        The messages are only iterated over once, so they may be given as any iterable, e.g. a generator.
         
-        :param messages: List of message objects to filter.
-        :type messages: list of TracedData
+        :param messages: Message objects to filter.
+        :type messages: iterable of TracedData
         :param message_key: Key in the TracedData of the value to test for noise.
         :type message_key: str
         :param noise_fn: Function which, given a value, returns whether this message is noise.
@@ -123,9 +249,14 @@ class MessageFilters(object):
         :rtype: list of TracedData
         """
         log.debug("Filtering out messages identified as noise...")
-        filtered = [td for td in messages if not noise_fn(td.get(message_key))]
+        filtered = []
+        messages_count = 0
+        for td in messages:
+            messages_count += 1
+            if not noise_fn(td.get(message_key)):
+                filtered.append(td)
         log.info(f"Filtered out messages identified as noise. "
-                 f"Returning {len(filtered)}/{len(messages)} messages.")
+                 f"Returning {len(filtered)}/{messages_count} messages.")
         return filtered
 
     @staticmethod
@@ -138,22 +269,15 @@ class MessageFilters(object):
         :return: Filtered list.
         :rtype: list of TracedData
         """
-        noise_other_channel_uuids = set()
-        for td in messages:
-            codes = []
-            for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
-                for cc in plan.coding_configurations:
-                    if cc.coding_mode == CodingModes.SINGLE:
-                        if cc.coded_field in td:
-                            label = td[cc.coded_field]
-                            codes.append(cc.code_scheme.get_code_with_code_id(label["CodeID"]).control_code)
-                    else:
-                        assert cc.coding_mode == CodingModes.MULTIPLE
-                        for label in td.get(cc.coded_field, []):
-                            codes.append(cc.code_scheme.get_code_with_code_id(label["CodeID"]).control_code)
-
-            if Codes.NOISE_OTHER_CHANNEL in codes:
-                noise_other_channel_uuids.add(td['uid'])
+        coding_configurations = [
+            cc for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS
+            for cc in plan.coding_configurations
+        ]
+        noise_other_channel_rows = LabelMatrix(messages, coding_configurations).rows_with_control_code(
+            [cc.coded_field for cc in coding_configurations], Codes.NOISE_OTHER_CHANNEL)
+        noise_other_channel_uuids = {
+            td['uid'] for td, noise_other_channel in zip(messages, noise_other_channel_rows) if noise_other_channel
+        }
 
         filtered = [td for td in messages if td['uid'] not in noise_other_channel_uuids]
 
@@ -0,0 +1,96 @@
+import os
+import pickle
+
+from core_data_modules.logging import Logger
+from core_data_modules.util import SHAUtils
+
+from src.lib.metadata_factory import MetadataFactory
+
+log = Logger(__name__)
+
+
+class MessageIdCache(object):
+    # Increment this if the way message ids are derived from message texts changes, so that caches written by older
+    # versions of this pipeline are ignored.
+    VERSION = 1
+
+    def __init__(self, cache_path=None):
+        """
+        Cache of the Coda message id of each message text, shared by every stage of this pipeline which computes
+        message ids, and optionally persisted between runs.
+
+        A message id is the SHA-256 of the message's text alone, so a text hashed for one coding plan or stage is
+        reused for every other raw field it appears in.
+
+        :param cache_path: Path to the file to load the cache from, and to write it to in `MessageIdCache.save`.
+                           If None, the cache only lasts for this run.
+        :type cache_path: str | None
+        """
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+
+        self._message_ids = dict()  # of message text -> message id
+        self._used_texts = set()  # of the message texts looked up in this run, the only ones persisted by `save`
+
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                version, message_ids = pickle.load(f)
+            if version == self.VERSION:
+                self._message_ids = message_ids
+                log.info(f"Loaded {len(self._message_ids)} message ids from '{cache_path}'")
+
+    def message_id(self, text):
+        """
+        :param text: Message text to get the id of.
+        :type text: str
+        :return: The Coda message id of `text`, as computed by `TracedDataCodaV2IO.compute_message_ids`.
+        :rtype: str
+        """
+        self._used_texts.add(text)
+        message_id = self._message_ids.get(text)
+        if message_id is not None:
+            self.hits += 1
+            return message_id
+
+        self.misses += 1
+        message_id = SHAUtils.sha_string(text)
+        self._message_ids[text] = message_id
+        return message_id
+
+    def compute_message_ids(self, user, data, message_key, message_id_key_to_write):
+        """
+        Equivalent to `TracedDataCodaV2IO.compute_message_ids`, but only hashes texts which aren't in this cache.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: TracedData objects to compute the message ids of. Objects without a `message_key` are skipped.
+        :type data: iterable of TracedData
+        :param message_key: Key in each TracedData object of the message text.
+        :type message_key: str
+        :param message_id_key_to_write: Key to write each message id to.
+        :type message_id_key_to_write: str
+        """
+        metadata_factory = MetadataFactory(user)
+        for td in data:
+            if message_key in td:
+                td.append_data({message_id_key_to_write: self.message_id(td[message_key])},
+                               metadata_factory.metadata())
+
+    def save(self):
+        """
+        Writes the ids of the message texts looked up in this run to `cache_path`, so that texts which are no longer
+        in the data are dropped rather than accumulating between runs. Does nothing if `cache_path` is None.
+        """
+        if self.cache_path is None:
+            return
+
+        message_ids = {text: self._message_ids[text] for text in self._used_texts}
+
+        # Write to a temporary file first so that an interrupted run can't leave a truncated cache behind.
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump((self.VERSION, message_ids), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.cache_path)
+        log.info(f"Saved {len(message_ids)} message ids to '{self.cache_path}' "
+                 f"({self.hits} cache hits and {self.misses} cache misses this run)")
@@ -0,0 +1,50 @@
+import time
+
+from core_data_modules.traced_data import Metadata
+
+
+class MetadataFactory(object):
+    # When True, every factory looks up the call location and reads the clock on every call, rather than once when the
+    # factory is created. This makes each history entry point at the exact line which wrote it, for audits, at the
+    # cost of a stack inspection per entry. Set from generate_outputs.py.
+    STRICT = False
+
+    def __init__(self, user, timestamp_fn=time.time):
+        """
+        Creates the TracedData Metadata for one pipeline stage.
+
+        Looking up the call location inspects the stack, which is expensive to do for every message and every step.
+        A stage should therefore create one factory before its per-message loops and reuse it in those loops, in which
+        case all the Metadata it creates will share the call location of the stage and the time the factory was
+        created, unless `MetadataFactory.STRICT` is set.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param timestamp_fn: Function which returns the current time in the format this stage records timestamps in,
+                             e.g. `time.time` or `TimeUtils.utc_now_as_iso_string`.
+        :type timestamp_fn: function of () -> float | str
+        """
+        self.user = user
+        self.timestamp_fn = timestamp_fn
+        self.strict = self.STRICT
+
+        self._call_location = Metadata.get_call_location(depth=2)
+        self._timestamp = timestamp_fn()
+
+    def call_location(self):
+        """
+        :return: Location of the stage which created this factory, or of the caller of this method in strict mode.
+        :rtype: str
+        """
+        if self.strict:
+            return Metadata.get_call_location(depth=2)
+        return self._call_location
+
+    def metadata(self):
+        """
+        :return: Metadata for a new history entry.
+        :rtype: Metadata
+        """
+        if self.strict:
+            return Metadata(self.user, Metadata.get_call_location(depth=2), self.timestamp_fn())
+        return Metadata(self.user, self._call_location, self._timestamp)
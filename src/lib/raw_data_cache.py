@@ -0,0 +1,168 @@
+import hashlib
+import os
+import pickle
+
+import pkg_resources
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+log = Logger(__name__)
+
+
+class RawDataCache(object):
+    # Increment this whenever a change to the loading code would change the TracedData produced for the same raw
+    # data, so that snapshots written by older versions of this pipeline are ignored.
+    VERSION = 1
+
+    SNAPSHOT_EXTENSION = ".pickle"
+    MESSAGE_IDS_FILENAME = "message_ids.cache"
+    CODE_SCHEMES_DIR = "code_schemes"
+
+    def __init__(self, cache_dir, configuration_hash, max_size_bytes):
+        """
+        On-disk cache of parsed raw datasets, stored as pickled snapshots which are much faster to load than the
+        JSONL files they were parsed from.
+
+        Snapshots are content-addressed: each is keyed by the SHA-256 of the raw file it was parsed from, the hash of
+        the pipeline configuration, the kind of dataset stored (e.g. 'runs' or 'coalesced_runs'), and the hash of the
+        environment the snapshot was parsed in (see `RawDataCache.hash_environment`). Files which are changed by
+        fetch_raw_data.py, runs with a different pipeline configuration, and runs after a code scheme change or a
+        CoreDataModules upgrade therefore miss the cache automatically.
+
+        The cache directory also holds the `MessageIdCache` file at `message_ids_path`. It counts towards
+        `max_size_bytes` and is evicted and invalidated in the same way as the snapshots.
+
+        :param cache_dir: Directory to read and write the snapshots in.
+        :type cache_dir: str
+        :param configuration_hash: Hash of the pipeline configuration this cache is being used with.
+        :type configuration_hash: str
+        :param max_size_bytes: Maximum total size of the files in `cache_dir`. When this is exceeded, the least
+                               recently used files are deleted.
+        :type max_size_bytes: int
+        """
+        self.cache_dir = cache_dir
+        self.configuration_hash = configuration_hash
+        self.max_size_bytes = max_size_bytes
+        self.environment_hash = self.hash_environment()
+        self._file_hashes = dict()  # of raw file path -> SHA-256 of its contents, so each file is only hashed once
+
+        IOUtils.ensure_dirs_exist(self.cache_dir)
+
+    @staticmethod
+    def hash_file(path):
+        """
+        :param path: Path to the file to hash.
+        :type path: str
+        :return: SHA-256 hex digest of the contents of the file at `path`.
+        :rtype: str
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @classmethod
+    def hash_environment(cls):
+        """
+        :return: SHA-256 hex digest of the installed CoreDataModules version and the contents of the code scheme files,
+                 which both affect how the raw data is parsed and whether the pickled TracedData can be loaded.
+        :rtype: str
+        """
+        sha = hashlib.sha256()
+        sha.update(pkg_resources.get_distribution("CoreDataModules").version.encode("utf-8"))
+        for filename in sorted(os.listdir(cls.CODE_SCHEMES_DIR)):
+            sha.update(f"/{filename}/{cls.hash_file(os.path.join(cls.CODE_SCHEMES_DIR, filename))}".encode("utf-8"))
+        return sha.hexdigest()
+
+    def _snapshot_path(self, raw_file_path, kind):
+        if raw_file_path not in self._file_hashes:
+            self._file_hashes[raw_file_path] = self.hash_file(raw_file_path)
+
+        key = hashlib.sha256(
+            f"{self.VERSION}/{self.configuration_hash}/{self.environment_hash}/{kind}/"
+            f"{self._file_hashes[raw_file_path]}".encode("utf-8")
+        ).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}{self.SNAPSHOT_EXTENSION}")
+
+    def _entry_paths(self):
+        return [os.path.join(self.cache_dir, filename) for filename in os.listdir(self.cache_dir)
+                if filename.endswith(self.SNAPSHOT_EXTENSION) or filename == self.MESSAGE_IDS_FILENAME]
+
+    @property
+    def message_ids_path(self):
+        """
+        :return: Path to keep the `MessageIdCache` file at, so that it is evicted and invalidated with this cache.
+                 After saving the message ids there, call `RawDataCache.evict` to keep the cache within its size.
+        :rtype: str
+        """
+        return os.path.join(self.cache_dir, self.MESSAGE_IDS_FILENAME)
+
+    def get(self, raw_file_path, kind):
+        """
+        Loads the dataset of the given kind that was previously parsed from the current contents of `raw_file_path`.
+
+        :param raw_file_path: Path to the raw file the dataset was parsed from.
+        :type raw_file_path: str
+        :param kind: Kind of dataset to load, as given to `RawDataCache.put`.
+        :type kind: str
+        :return: The cached dataset, or None if there is no snapshot for this file, kind and configuration.
+        :rtype: list of TracedData | None
+        """
+        snapshot_path = self._snapshot_path(raw_file_path, kind)
+        if not os.path.exists(snapshot_path):
+            return None
+
+        with open(snapshot_path, "rb") as f:
+            dataset = pickle.load(f)
+        # Mark this snapshot as recently used, so that it is evicted after any snapshots that were not.
+        os.utime(snapshot_path)
+
+        return dataset
+
+    def put(self, raw_file_path, kind, dataset):
+        """
+        Saves a dataset that was parsed from the current contents of `raw_file_path`, then evicts the least recently
+        used snapshots if the cache is now larger than its maximum size.
+
+        :param raw_file_path: Path to the raw file the dataset was parsed from.
+        :type raw_file_path: str
+        :param kind: Kind of dataset being saved, used to distinguish between different datasets derived from the same
+                     raw file.
+        :type kind: str
+        :param dataset: Dataset to save.
+        :type dataset: list of TracedData
+        """
+        snapshot_path = self._snapshot_path(raw_file_path, kind)
+
+        # Write to a temporary file first so that an interrupted run can't leave a truncated snapshot behind.
+        temp_path = f"{snapshot_path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(dataset, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, snapshot_path)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used files until the total size of the cache is within `max_size_bytes`.
+        """
+        entries = [(path, os.stat(path)) for path in self._entry_paths()]
+        entries.sort(key=lambda entry: entry[1].st_mtime)
+
+        total_size = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            log.debug(f"Evicting raw data cache file '{path}' ({stat.st_size} bytes)")
+            os.remove(path)
+            total_size -= stat.st_size
+
+    def invalidate(self):
+        """
+        Deletes every file in the cache, including the message ids file.
+        """
+        entry_paths = self._entry_paths()
+        for path in entry_paths:
+            os.remove(path)
+        log.info(f"Invalidated the raw data cache, deleting {len(entry_paths)} files")
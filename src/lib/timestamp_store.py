@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytz
+from dateutil.parser import isoparse
+
+_EPOCH = pytz.utc.localize(datetime(1970, 1, 1))
+
+
+class ParsedTimestamp(object):
+    def __init__(self, iso_string):
+        """
+        An ISO 8601 timestamp string, parsed.
+
+        :param iso_string: Timestamp to parse, in ISO 8601 format.
+        :type iso_string: str
+        """
+        self.iso_string = iso_string
+        self.datetime = isoparse(iso_string)
+        self.epoch_microseconds = TimestampStore.microseconds_since_epoch(self.datetime)
+
+    @property
+    def epoch_seconds(self):
+        return self.epoch_microseconds / 1e6
+
+
+class TimestampStore(object):
+    def __init__(self):
+        """
+        Parse-once store of the timestamps in the time fields of messages, for the stages of this pipeline which filter
+        or order messages by time.
+
+        Timestamps are looked up by message and time field. Each distinct timestamp string is only parsed once, so
+        copies of a message, and fields which had their key renamed but kept their value, share a single parse.
+
+        A stage which rewrites a time field must call `TimestampStore.invalidate` for that message and field.
+        As a safeguard, an entry is also re-parsed if its string no longer matches the message's current value.
+        """
+        self._by_message = dict()  # of (id(message), time_key) -> ParsedTimestamp
+        self._by_iso_string = dict()  # of ISO 8601 string -> ParsedTimestamp
+
+    @staticmethod
+    def microseconds_since_epoch(dt):
+        """
+        :param dt: Timezone-aware datetime to convert.
+        :type dt: datetime.datetime
+        :return: Number of microseconds between the Unix epoch and `dt`, as an integer so that comparisons are exact
+                 at every point in the range datetime.min to datetime.max.
+        :rtype: int
+        """
+        return (dt - _EPOCH) // timedelta(microseconds=1)
+
+    def parse(self, iso_string):
+        """
+        :param iso_string: Timestamp to parse, in ISO 8601 format.
+        :type iso_string: str
+        :return: `iso_string`, parsed. This is only parsed the first time a string is seen.
+        :rtype: ParsedTimestamp
+        """
+        parsed = self._by_iso_string.get(iso_string)
+        if parsed is None:
+            parsed = ParsedTimestamp(iso_string)
+            self._by_iso_string[iso_string] = parsed
+        return parsed
+
+    def get(self, message, time_key):
+        """
+        :param message: Message to get the timestamp of.
+        :type message: TracedData | dict
+        :param time_key: Key in `message` of the timestamp to get. The value must be a string in ISO 8601 format.
+        :type time_key: str
+        :return: The parsed timestamp in `message[time_key]`.
+        :rtype: ParsedTimestamp
+        """
+        iso_string = message[time_key]
+        key = (id(message), time_key)
+        parsed = self._by_message.get(key)
+        if parsed is None or parsed.iso_string != iso_string:
+            parsed = self.parse(iso_string)
+            self._by_message[key] = parsed
+        return parsed
+
+    def invalidate(self, message, time_key):
+        """
+        Forgets the parsed timestamp of a message's time field, for use when that field has been rewritten.
+
+        :param message: Message whose time field was rewritten.
+        :type message: TracedData | dict
+        :param time_key: Key of the time field which was rewritten.
+        :type time_key: str
+        """
+        self._by_message.pop((id(message), time_key), None)
@@ -0,0 +1,120 @@
+class TracedDataBatch(object):
+    def __init__(self, td, metadata_factory):
+        """
+        Batch of the updates a pipeline stage makes to one TracedData object, which are written to the object's
+        history together when the batch is committed, rather than as one history layer per call.
+
+        A batch stands in for its TracedData: it supports `append_data` and `hide_keys` with the same arguments, and
+        reads see the object's current values with the batch's pending updates applied. Stages can therefore be run
+        against batches without changing their code.
+
+        Use as a context manager (`with TracedDataBatch(td, metadata_factory) as batch:`) to commit the batch when the
+        block exits normally, and discard it if the block raises.
+
+        A commit writes at most one `hide_keys` layer, for the keys hidden by the batch which are in the TracedData,
+        followed by at most one `append_data` layer.
+
+        :param td: TracedData object to update.
+        :type td: TracedData
+        :param metadata_factory: Factory for the Metadata of the committed layers.
+        :type metadata_factory: src.lib.MetadataFactory
+        """
+        self.td = td
+        self.metadata_factory = metadata_factory
+
+        self._appends = dict()  # of key -> new value
+        self._hides = set()  # of key
+
+    @classmethod
+    def for_each(cls, data, metadata_factory):
+        """
+        :param data: TracedData objects to make batches for.
+        :type data: iterable of TracedData
+        :param metadata_factory: Factory for the Metadata of the committed layers.
+        :type metadata_factory: src.lib.MetadataFactory
+        :return: A batch for each of the TracedData objects in `data`, in the same order.
+        :rtype: list of TracedDataBatch
+        """
+        return [cls(td, metadata_factory) for td in data]
+
+    @staticmethod
+    def commit_all(batches):
+        """
+        :param batches: Batches to commit.
+        :type batches: iterable of TracedDataBatch
+        """
+        for batch in batches:
+            batch.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+    def __contains__(self, key):
+        if key in self._appends:
+            return True
+        if key in self._hides:
+            return False
+        return key in self.td
+
+    def __getitem__(self, key):
+        if key in self._appends:
+            return self._appends[key]
+        if key in self._hides:
+            raise KeyError(key)
+        return self.td[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return {key for key in self.td.keys() if key not in self._hides}.union(self._appends.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def append_data(self, new_data, new_metadata=None):
+        """
+        :param new_data: Data to add to, or update in, the TracedData when this batch is committed.
+        :type new_data: dict
+        :param new_metadata: Ignored. Accepted so that a batch can stand in for a TracedData object.
+        :type new_metadata: core_data_modules.traced_data.Metadata | None
+        """
+        for key, value in new_data.items():
+            self._hides.discard(key)
+            self._appends[key] = value
+
+    def hide_keys(self, keys, new_metadata=None):
+        """
+        :param keys: Keys to hide in the TracedData when this batch is committed.
+        :type keys: iterable of str
+        :param new_metadata: Ignored. Accepted so that a batch can stand in for a TracedData object.
+        :type new_metadata: core_data_modules.traced_data.Metadata | None
+        """
+        for key in keys:
+            self._appends.pop(key, None)
+            self._hides.add(key)
+
+    def commit(self):
+        """
+        Writes the pending updates to the TracedData, then empties this batch.
+        """
+        hidden_keys = self._hides.intersection(self.td.keys())
+        if len(hidden_keys) > 0:
+            self.td.hide_keys(hidden_keys, self.metadata_factory.metadata())
+        if len(self._appends) > 0:
+            self.td.append_data(self._appends, self.metadata_factory.metadata())
+        self.discard()
+
+    def discard(self):
+        """
+        Empties this batch without writing its pending updates.
+        """
+        self._appends = dict()
+        self._hides = set()
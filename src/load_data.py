@@ -1,68 +1,255 @@
+from concurrent.futures import ProcessPoolExecutor
+
 from core_data_modules.logging import Logger
-from core_data_modules.traced_data import TracedData, Metadata
 from core_data_modules.traced_data.io import TracedDataJsonIO
 from core_data_modules.util import TimeUtils
 
+from src.lib import MetadataFactory
+
 log = Logger(__name__)
 
 
+def _import_jsonl_file(path):
+    # Module-level so that it can be pickled and sent to the worker processes in `LoadData.load_datasets`.
+    with open(path, "r") as f:
+        return TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
+
+
 class LoadData(object):
     @staticmethod
-    def load_datasets(raw_data_dir, flow_names):
-        datasets = []
-        for i, flow_name in enumerate(flow_names):
-            raw_flow_path = f"{raw_data_dir}/{flow_name}.jsonl"
-            log.info(f"Loading {i + 1}/{len(flow_names)}: {raw_flow_path}...")
-            with open(raw_flow_path, "r") as f:
-                runs = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
-            log.info(f"Loaded {len(runs)} runs")
-            datasets.append(runs)
+    def load_datasets(raw_data_dir, flow_names, processes=1, cache=None):
+        """
+        Loads the runs in each of the given flows.
+
+        :param raw_data_dir: Directory containing a '{flow_name}.jsonl' file for each of the `flow_names`.
+        :type raw_data_dir: str
+        :param flow_names: Names of the flows to load.
+        :type flow_names: list of str
+        :param processes: Number of worker processes to parse the flow files with.
+                          If 1, the flows are parsed one after another in this process.
+                          The returned datasets are in the same order as `flow_names` regardless of this setting.
+        :type processes: int
+        :param cache: Cache to load unchanged flows from, and to save newly parsed flows to, or None.
+                      If None, every flow is parsed from its JSONL file.
+        :type cache: src.lib.RawDataCache | None
+        :return: The runs in each flow, in the same order as `flow_names`.
+        :rtype: list of list of TracedData
+        """
+        raw_flow_paths = [f"{raw_data_dir}/{flow_name}.jsonl" for flow_name in flow_names]
+
+        datasets = [None] * len(raw_flow_paths)
+        if cache is not None:
+            for i, raw_flow_path in enumerate(raw_flow_paths):
+                datasets[i] = cache.get(raw_flow_path, "runs")
+                if datasets[i] is not None:
+                    log.info(f"Loaded {i + 1}/{len(raw_flow_paths)}: {raw_flow_path} from the raw data cache "
+                             f"({len(datasets[i])} runs)")
+        uncached_indices = [i for i, dataset in enumerate(datasets) if dataset is None]
+
+        if processes > 1 and len(uncached_indices) > 1:
+            log.info(f"Loading {len(uncached_indices)} flows using {processes} worker processes...")
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                # `map` yields the results in submission order, so the merge order is the same as for a serial load.
+                uncached_datasets = executor.map(_import_jsonl_file, [raw_flow_paths[i] for i in uncached_indices])
+                for i, runs in zip(uncached_indices, uncached_datasets):
+                    log.info(f"Loaded {i + 1}/{len(raw_flow_paths)}: {raw_flow_paths[i]} ({len(runs)} runs)")
+                    datasets[i] = runs
+        else:
+            for i in uncached_indices:
+                log.info(f"Loading {i + 1}/{len(raw_flow_paths)}: {raw_flow_paths[i]}...")
+                datasets[i] = _import_jsonl_file(raw_flow_paths[i])
+                log.info(f"Loaded {len(datasets[i])} runs")
+
+        if cache is not None:
+            for i in uncached_indices:
+                cache.put(raw_flow_paths[i], "runs", datasets[i])
+
         return datasets
 
     @staticmethod
     def coalesce_traced_runs_by_key(user, traced_runs, coalesce_key):
-        coalesced_runs = dict()
+        """
+        Coalesces runs which have the same value for `coalesce_key` into a single TracedData.
+
+        All the runs for each key are grouped first, then the later runs are merged into the first run for that key
+        in a single update, so a contact who completed a flow many times gets one extra history entry rather than one
+        per repeat. Where runs disagree on a value, the latest run wins.
 
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param traced_runs: Runs to coalesce, in the order they should be applied.
+        :type traced_runs: iterable of TracedData
+        :param coalesce_key: Key in each run to coalesce by.
+        :type coalesce_key: str
+        :return: One TracedData for each distinct value of `coalesce_key`, in order of first appearance.
+        :rtype: list of TracedData
+        """
+        grouped_runs = dict()  # of coalesce_key value -> list of runs with that value, in input order
         for run in traced_runs:
-            if run[coalesce_key] not in coalesced_runs:
-                coalesced_runs[run[coalesce_key]] = run
-            else:
-                coalesced_runs[run[coalesce_key]].append_data(
-                    dict(run.items()), Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+            key = run[coalesce_key]
+            if key not in grouped_runs:
+                grouped_runs[key] = []
+            grouped_runs[key].append(run)
 
-        return list(coalesced_runs.values())
+        metadata = MetadataFactory(user, TimeUtils.utc_now_as_iso_string).metadata()
+        coalesced_runs = []
+        for runs in grouped_runs.values():
+            coalesced_run = runs[0]
+            if len(runs) > 1:
+                merged = dict()
+                for run in runs[1:]:
+                    merged.update(run.items())
+                coalesced_run.append_data(merged, metadata)
+            coalesced_runs.append(coalesced_run)
+
+        return coalesced_runs
 
     @staticmethod
-    def combine_raw_datasets(user, messages_datasets, surveys_datasets):
-        data = []
+    def index_surveys_by_key(user, surveys_datasets, index_key):
+        """
+        Builds a single look-up table of `index_key` -> all the survey data for that key, over all the given survey
+        datasets.
 
-        for messages_dataset in messages_datasets:
-            data.extend(messages_dataset)
+        Where a key has runs in more than one survey dataset, those runs are joined into one TracedData, in dataset
+        order, so that later datasets take precedence over earlier ones just as they would if each dataset was added
+        to a message in turn.
 
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param surveys_datasets: Survey datasets, each already coalesced so that there is at most one run per
+                                 `index_key`.
+        :type surveys_datasets: list of list of TracedData
+        :param index_key: Key in each survey run to index by.
+        :type index_key: str
+        :return: Dictionary of `index_key` value -> TracedData containing all the survey data for that value.
+        :rtype: dict of str -> TracedData
+        """
+        metadata_factory = MetadataFactory(user, TimeUtils.utc_now_as_iso_string)
+        surveys_index = dict()
+        joined_keys = set()  # Keys whose entry in surveys_index is a copy we own and can append to.
         for surveys_dataset in surveys_datasets:
-            TracedData.update_iterable(user, "avf_phone_id", data, surveys_dataset, "survey_responses")
+            for survey in surveys_dataset:
+                key = survey[index_key]
+                if key not in surveys_index:
+                    surveys_index[key] = survey
+                    continue
+
+                if key not in joined_keys:
+                    surveys_index[key] = surveys_index[key].copy()
+                    joined_keys.add(key)
+                surveys_index[key].append_traced_data("survey_responses", survey, metadata_factory.metadata())
+
+        return surveys_index
+
+    @classmethod
+    def combine_raw_datasets(cls, user, messages_datasets, surveys_datasets):
+        """
+        Adds the survey data to each of the given activation messages.
+
+        The survey data is looked up in one 'avf_phone_id' index over all of the survey datasets, so each message is
+        visited once and gets a single history entry no matter how many survey datasets there are.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param messages_datasets: Activation datasets to add the survey data to.
+        :type messages_datasets: list of list of TracedData
+        :param surveys_datasets: Survey datasets, each already coalesced so that there is at most one run per
+                                 'avf_phone_id'.
+        :type surveys_datasets: list of list of TracedData
+        :return: The activation messages from all of the `messages_datasets`, with the survey data added.
+        :rtype: list of TracedData
+        """
+        surveys_index = cls.index_surveys_by_key(user, surveys_datasets, "avf_phone_id")
+
+        metadata_factory = MetadataFactory(user, TimeUtils.utc_now_as_iso_string)
+        data = []
+        for messages_dataset in messages_datasets:
+            for td in messages_dataset:
+                if td["avf_phone_id"] in surveys_index:
+                    td.append_traced_data(
+                        "survey_responses", surveys_index[td["avf_phone_id"]], metadata_factory.metadata()
+                    )
+                data.append(td)
 
         return data
 
     @classmethod
-    def load_raw_data(cls, user, raw_data_dir, pipeline_configuration):
+    def load_coalesced_survey_datasets(cls, user, raw_data_dir, survey_flow_names, processes=1, cache=None):
+        """
+        Loads the runs in each of the given survey flows, coalesced so that there is one run per 'avf_phone_id'.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param raw_data_dir: Directory containing a '{flow_name}.jsonl' file for each of the `survey_flow_names`.
+        :type raw_data_dir: str
+        :param survey_flow_names: Names of the survey flows to load.
+        :type survey_flow_names: list of str
+        :param processes: Number of worker processes to parse the flow files with. See `LoadData.load_datasets`.
+        :type processes: int
+        :param cache: Cache to load the coalesced runs of unchanged flows from, and to save newly coalesced flows to,
+                      or None. If None, every flow is parsed and coalesced from its JSONL file.
+        :type cache: src.lib.RawDataCache | None
+        :return: The coalesced runs in each flow, in the same order as `survey_flow_names`.
+        :rtype: list of list of TracedData
+        """
+        coalesced_datasets = [None] * len(survey_flow_names)
+        if cache is not None:
+            for i, flow_name in enumerate(survey_flow_names):
+                raw_flow_path = f"{raw_data_dir}/{flow_name}.jsonl"
+                coalesced_datasets[i] = cache.get(raw_flow_path, "coalesced_runs")
+                if coalesced_datasets[i] is not None:
+                    log.info(f"Loaded coalesced runs for {raw_flow_path} from the raw data cache "
+                             f"({len(coalesced_datasets[i])} runs)")
+        uncached_flow_names = [flow_name for flow_name, dataset in zip(survey_flow_names, coalesced_datasets)
+                               if dataset is None]
+
+        uncached_datasets = iter(cls.load_datasets(raw_data_dir, uncached_flow_names, processes))
+        for i, flow_name in enumerate(survey_flow_names):
+            if coalesced_datasets[i] is not None:
+                continue
+
+            coalesced_datasets[i] = cls.coalesce_traced_runs_by_key(user, next(uncached_datasets), "avf_phone_id")
+            if cache is not None:
+                cache.put(f"{raw_data_dir}/{flow_name}.jsonl", "coalesced_runs", coalesced_datasets[i])
+
+        return coalesced_datasets
+
+    @classmethod
+    def load_raw_data(cls, user, raw_data_dir, pipeline_configuration, processes=1, cache=None):
+        """
+        Loads the raw activation messages, with the survey data for each participant added.
+
+        Every message is held in memory at once. This is not streamed because WS correction, which runs straight
+        after key translation, and every stage after it need all of the messages at the same time.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param raw_data_dir: Directory containing the raw flow files exported by fetch_raw_data.py.
+        :type raw_data_dir: str
+        :param pipeline_configuration: Pipeline configuration.
+        :type pipeline_configuration: src.lib.PipelineConfiguration
+        :param processes: Number of worker processes to parse the raw flow files with. See `LoadData.load_datasets`.
+        :type processes: int
+        :param cache: Cache of previously loaded and coalesced flows, or None. See `src.lib.RawDataCache`.
+        :type cache: src.lib.RawDataCache | None
+        :return: The activation messages, with the survey data added.
+        :rtype: list of TracedData
+        """
         activation_flow_names = []
         survey_flow_names = []
         for raw_data_source in pipeline_configuration.raw_data_sources:
             activation_flow_names.extend(raw_data_source.get_activation_flow_names())
             survey_flow_names.extend(raw_data_source.get_survey_flow_names())
-            
+
         log.info("Loading activation datasets...")
-        activation_datasets = cls.load_datasets(raw_data_dir, activation_flow_names)
+        activation_datasets = cls.load_datasets(raw_data_dir, activation_flow_names, processes, cache)
 
         log.info("Loading survey datasets...")
-        survey_datasets = cls.load_datasets(raw_data_dir, survey_flow_names)
+        coalesced_survey_datasets = cls.load_coalesced_survey_datasets(
+            user, raw_data_dir, survey_flow_names, processes, cache)
 
         # Add survey data to the messages
         log.info("Combining Datasets...")
-        coalesced_survey_datasets = []
-        for dataset in survey_datasets:
-            coalesced_survey_datasets.append(cls.coalesce_traced_runs_by_key(user, dataset, "avf_phone_id"))
         data = cls.combine_raw_datasets(user, activation_datasets, coalesced_survey_datasets)
 
         return data
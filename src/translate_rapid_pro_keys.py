@@ -1,216 +1,320 @@
-from datetime import datetime
-
-import pytz
 from core_data_modules.logging import Logger
-from core_data_modules.traced_data import Metadata
 from core_data_modules.util import TimeUtils
-from dateutil.parser import isoparse
 
-from src.lib import PipelineConfiguration
+from src.lib import PipelineConfiguration, MetadataFactory, TimestampStore, TracedDataBatch
 
 log = Logger(__name__)
 
 
-class TranslateRapidProKeys(object):
-    @classmethod
-    def set_show_ids(cls, user, data, pipeline_configuration):
+class _CompiledTimestampRemapping(object):
+    def __init__(self, remapping):
         """
-        Sets a show pipeline key for each message, using the presence of Rapid Pro value keys to determine which
-        show each message belongs to.
+        A timestamp remapping with its time range and adjusted time pre-converted to microseconds since the epoch,
+        so that it can be tested against a message's parsed timestamp with integer comparisons.
 
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to set the show ids of.
-        :type data: iterable of TracedData
-        :param pipeline_configuration: Pipeline configuration.
-        :type pipeline_configuration: PipelineConfiguration
+        :param remapping: Timestamp remapping to compile.
+        :type remapping: src.lib.pipeline_configuration.TimestampRemapping
         """
-        for td in data:
-            show_dict = dict()
-
-            for remapping in pipeline_configuration.rapid_pro_key_remappings:
-                if not remapping.is_activation_message:
-                    continue
+        self.time_key = remapping.time_key
+        self.show_pipeline_key_to_remap_to = remapping.show_pipeline_key_to_remap_to
+        self.range_start_inclusive = TimestampStore.microseconds_since_epoch(remapping.range_start_inclusive)
+        self.range_end_exclusive = TimestampStore.microseconds_since_epoch(remapping.range_end_exclusive)
 
-                if td.get(remapping.rapid_pro_key) is not None:
-                    assert "rqa_message" not in show_dict
-                    show_dict["rqa_message"] = td[remapping.rapid_pro_key]
-                    show_dict["show_pipeline_key"] = remapping.pipeline_key
+        self.time_to_adjust_to = None
+        self.time_to_adjust_to_string = None
+        if remapping.time_to_adjust_to is not None:
+            self.time_to_adjust_to = TimestampStore.microseconds_since_epoch(remapping.time_to_adjust_to)
+            self.time_to_adjust_to_string = remapping.time_to_adjust_to.isoformat()
 
-            td.append_data(show_dict, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
 
-    @classmethod
-    def _remap_radio_show_by_time_range(cls, user, data, time_key, show_pipeline_key_to_remap_to,
-                                        range_start=None, range_end=None, time_to_adjust_to=None):
+class _CompiledKeyRemappings(object):
+    def __init__(self, activation_remappings, key_remappings, timestamp_remappings, null_message_fields):
         """
-        Remaps radio show messages received in the given time range to another radio show.
-
-        Optionally adjusts the datetime of re-mapped messages to a constant.
-
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to set the show ids of.
-        :type data: iterable of TracedData
-        :param time_key: Key in each TracedData of an ISO 8601-formatted datetime string to read the message sent on
-                         time from.
-        :type time_key: str
-        :param show_pipeline_key_to_remap_to: Pipeline key to assign to messages received within the given time range.
-        :type show_pipeline_key_to_remap_to: str
-        :param range_start: Start datetime for the time range to remap radio show messages from, inclusive.
-                            If None, defaults to the beginning of time.
-        :type range_start: datetime | None
-        :param range_end: End datetime for the time range to remap radio show messages from, exclusive.
-                          If None, defaults to the end of time.
-        :type range_end: datetime | None
-        :param time_to_adjust_to: Datetime to assign to the `time_key` field of re-mapped shows.
-                                  If None, re-mapped shows will not have timestamps re-adjusted.
-        :type time_to_adjust_to: datetime | None
-        """
-        if range_start is None:
-            range_start = pytz.utc.localize(datetime.min)
-        if range_end is None:
-            range_end = pytz.utc.localize(datetime.max)
-
-        log.info(f"Remapping messages in time range {range_start.isoformat()} to {range_end.isoformat()} "
-                 f"to show {show_pipeline_key_to_remap_to}...")
-
-        remapped_count = 0
-        for td in data:
-            if time_key in td and range_start <= isoparse(td[time_key]) < range_end:
-                remapped_count += 1
-
-                remapped = {
-                    "show_pipeline_key": show_pipeline_key_to_remap_to
-                }
-                if time_to_adjust_to is not None:
-                    remapped[time_key] = time_to_adjust_to.isoformat()
-
-                td.append_data(remapped,
-                               Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        Lookup tables for translating the keys of one message, compiled once from a pipeline configuration by
+        `TranslateRapidProKeys.compile_remappings`.
+
+        :param activation_remappings: Dictionary of Rapid Pro key -> pipeline key, for the keys which contain
+                                      activation messages.
+        :type activation_remappings: dict of str -> str
+        :param key_remappings: Dictionary of Rapid Pro key -> list of (index, pipeline key) for every other remapping
+                               of that key, where index is the position of that remapping in the configuration.
+        :type key_remappings: dict of str -> list of (int, str)
+        :param timestamp_remappings: Timestamp remappings to apply, in order.
+        :type timestamp_remappings: list of _CompiledTimestampRemapping
+        :param null_message_fields: List of (raw field, time field) for every coding plan, used to hide messages
+                                    which were null in Rapid Pro.
+        :type null_message_fields: list of (str, str)
+        """
+        self.activation_remappings = activation_remappings
+        self.key_remappings = key_remappings
+        self.timestamp_remappings = timestamp_remappings
+        self.null_message_fields = null_message_fields
 
-        log.info(f"Remapped {remapped_count} messages to show {show_pipeline_key_to_remap_to}")
 
-    @classmethod
-    def remap_radio_shows(cls, user, data, pipeline_configuration):
+class TranslateRapidProKeys(object):
+    @staticmethod
+    def compile_remappings(pipeline_configuration):
         """
-        Remaps radio shows which were in the wrong flow, and therefore have the wrong key/values set, to have the
-        key/values they would have had if they had been received by the correct flow.
+        Compiles the key and timestamp remappings in a pipeline configuration into lookup tables keyed by Rapid Pro
+        key, so that translating a message doesn't need to scan every remapping.
 
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to move the radio show messages in.
-        :type data: iterable of TracedData
         :param pipeline_configuration: Pipeline configuration.
         :type pipeline_configuration: PipelineConfiguration
+        :return: The compiled remappings.
+        :rtype: _CompiledKeyRemappings
         """
-        for remapping in pipeline_configuration.timestamp_remappings:
-            cls._remap_radio_show_by_time_range(
-                user, data, remapping.time_key, remapping.show_pipeline_key_to_remap_to,
-                remapping.range_start_inclusive, remapping.range_end_exclusive, remapping.time_to_adjust_to
-            )
+        activation_remappings = dict()
+        key_remappings = dict()
+        for i, remapping in enumerate(pipeline_configuration.rapid_pro_key_remappings):
+            if remapping.is_activation_message:
+                # A message with a Rapid Pro key that is remapped as an activation message more than once would
+                # belong to more than one show.
+                assert remapping.rapid_pro_key not in activation_remappings, \
+                    f"Rapid Pro key '{remapping.rapid_pro_key}' has more than one activation message remapping"
+                activation_remappings[remapping.rapid_pro_key] = remapping.pipeline_key
+            else:
+                if remapping.rapid_pro_key not in key_remappings:
+                    key_remappings[remapping.rapid_pro_key] = []
+                key_remappings[remapping.rapid_pro_key].append((i, remapping.pipeline_key))
+
+        null_message_fields = [
+            (plan.raw_field, plan.time_field)
+            for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS
+        ]
+
+        timestamp_remappings = [
+            _CompiledTimestampRemapping(remapping) for remapping in pipeline_configuration.timestamp_remappings
+        ]
+
+        return _CompiledKeyRemappings(activation_remappings, key_remappings, timestamp_remappings,
+                                      null_message_fields)
+
+    @staticmethod
+    def _set_show_id(message, remappings):
+        """
+        Sets a show pipeline key for a message, using the presence of Rapid Pro value keys to determine which show the
+        message belongs to.
 
-    @classmethod
-    def remap_key_names(cls, user, data, pipeline_configuration):
+        :param message: Current keys and values of the message to set the show id of. This is updated in place.
+        :type message: dict
+        :param remappings: Compiled remappings.
+        :type remappings: _CompiledKeyRemappings
         """
-        Remaps key names.
-        
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to remap the key names of.
-        :type data: iterable of TracedData
-        :param pipeline_configuration: Pipeline configuration.
-        :type pipeline_configuration: PipelineConfiguration
+        show_dict = dict()
+        for rapid_pro_key, pipeline_key in remappings.activation_remappings.items():
+            if message.get(rapid_pro_key) is not None:
+                assert "rqa_message" not in show_dict
+                show_dict["rqa_message"] = message[rapid_pro_key]
+                show_dict["show_pipeline_key"] = pipeline_key
+        message.update(show_dict)
+
+    @staticmethod
+    def _remap_radio_show(message, remappings, parse_time, remapped_counts):
         """
-        for td in data:
-            old_keys = set()
-            remapped = dict()
-
-            for remapping in pipeline_configuration.rapid_pro_key_remappings:
-                if remapping.is_activation_message:
-                    continue
+        Remaps a radio show message which was in the wrong flow, and therefore has the wrong key/values set, to have
+        the key/values it would have had if it had been received by the correct flow.
+
+        Each of the timestamp remappings is applied in turn. A remapping applies to the message if the message's
+        `time_key` is within the remapping's time range, in which case the message is assigned to the remapping's show,
+        and optionally has its `time_key` adjusted to a constant. Where the ranges of several remappings overlap, the
+        last matching remapping in the configuration therefore determines the show, and any time adjustment made by
+        an earlier remapping is what later remappings are tested against.
+
+        Each time key is parsed at most once per message, no matter how many remappings there are.
+
+        :param message: Current keys and values of the message to remap. This is updated in place.
+        :type message: dict
+        :param remappings: Compiled remappings.
+        :type remappings: _CompiledKeyRemappings
+        :param parse_time: Function which returns the microseconds since the epoch of the original value of the given
+                           time key in this message.
+        :type parse_time: function of str -> int
+        :param remapped_counts: Number of messages remapped by each of the timestamp remappings so far.
+                                This is updated in place.
+        :type remapped_counts: list of int
+        """
+        parsed_times = dict()  # of time key -> microseconds since the epoch of the current value of that key
+        for i, remapping in enumerate(remappings.timestamp_remappings):
+            time_key = remapping.time_key
+            if time_key not in message:
+                continue
 
-                old_key = remapping.rapid_pro_key
-                new_key = remapping.pipeline_key
-                
-                if old_key in td and new_key not in td:
-                    old_keys.add(old_key)
+            if time_key not in parsed_times:
+                parsed_times[time_key] = parse_time(time_key)
 
-                    # Some "old keys" translate to the same new key. This is sometimes desirable, for example if we ask
-                    # the same demog question to the same person in multiple places, we should take take their
-                    # newest response. However, if their newest response is "null" in the flow exported from Rapid Pro,
-                    # taking the newest response would cause loss of some valuable responses. This check ensures we
-                    # are taking the most recent response, unless the most response is "null" and there was a more
-                    # substantive response in the past.
-                    if td[old_key] is None and remapped.get(new_key) is not None:
-                        continue
+            if remapping.range_start_inclusive <= parsed_times[time_key] < remapping.range_end_exclusive:
+                remapped_counts[i] += 1
 
-                    remapped[new_key] = td[old_key]
+                message["show_pipeline_key"] = remapping.show_pipeline_key_to_remap_to
+                if remapping.time_to_adjust_to is not None:
+                    message[time_key] = remapping.time_to_adjust_to_string
+                    parsed_times[time_key] = remapping.time_to_adjust_to
 
-            td.hide_keys(old_keys, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
-            td.append_data(remapped, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+    @staticmethod
+    def _remap_key_names(message, remappings):
+        """
+        Remaps the Rapid Pro key names in a message to the pipeline key names.
 
-    @classmethod
-    def set_rqa_raw_keys_from_show_ids(cls, user, data):
+        :param message: Current keys and values of the message to remap the key names of. This is updated in place.
+        :type message: dict
+        :param remappings: Compiled remappings.
+        :type remappings: _CompiledKeyRemappings
+        """
+        # Look up the remappings for the keys in this message, then apply them in configuration order so that
+        # the precedence between remappings to the same pipeline key is the same as in the configuration.
+        matching_remappings = []
+        for key in message.keys():
+            matching_remappings.extend((i, key, new_key) for i, new_key in remappings.key_remappings.get(key, []))
+        matching_remappings.sort()
+
+        old_keys = set()
+        remapped = dict()
+        for _, old_key, new_key in matching_remappings:
+            if new_key in message:
+                continue
+
+            old_keys.add(old_key)
+
+            # Some "old keys" translate to the same new key. This is sometimes desirable, for example if we ask
+            # the same demog question to the same person in multiple places, we should take take their
+            # newest response. However, if their newest response is "null" in the flow exported from Rapid Pro,
+            # taking the newest response would cause loss of some valuable responses. This check ensures we
+            # are taking the most recent response, unless the most response is "null" and there was a more
+            # substantive response in the past.
+            if message[old_key] is None and remapped.get(new_key) is not None:
+                continue
+
+            remapped[new_key] = message[old_key]
+
+        for old_key in old_keys:
+            del message[old_key]
+        message.update(remapped)
+
+    @staticmethod
+    def _set_rqa_raw_key_from_show_id(message):
         """
         Despite the earlier phases of this pipeline stage using a common 'rqa_message' field and then a
         'show_pipeline_key' field to identify which radio show a message belonged to, the rest of the pipeline still
         uses the presence of a raw field for each show to determine which show a message belongs to.
         This function translates from the new 'show_id' method back to the old 'raw field presence` method.
-        
+
         TODO: Update the rest of the pipeline to use show_ids, and/or perform remapping before combining the datasets.
 
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to set raw radio show message fields for.
-        :type data: iterable of TracedData
+        :param message: Current keys and values of the message to set the raw radio show field for.
+                        This is updated in place.
+        :type message: dict
         """
-        for td in data:
-            if "show_pipeline_key" in td:
-                td.append_data({td["show_pipeline_key"]: td["rqa_message"]},
-                               Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        if "show_pipeline_key" in message:
+            message[message["show_pipeline_key"]] = message["rqa_message"]
 
-    @classmethod
-    def hide_null_messages(cls, user, data):
+    @staticmethod
+    def _hide_null_message(message, remappings):
         """
-        Hides messages which were null in Rapid Pro.
+        Hides the raw and time fields of responses which were null in Rapid Pro.
 
-        :param user: Identifier of the user running this program, for TracedData Metadata.
-        :type user: str
-        :param data: TracedData objects to search for null messages in and hide.
-        :type data: iterable of TracedData
+        :param message: Current keys and values of the message to hide null responses in. This is updated in place.
+        :type message: dict
+        :param remappings: Compiled remappings.
+        :type remappings: _CompiledKeyRemappings
         """
-        for td in data:
-            null_keys = set()
-            for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
-                if plan.raw_field in td and td[plan.raw_field] is None:
-                    null_keys.update({plan.raw_field, plan.time_field})
-            td.hide_keys(null_keys, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+        null_keys = set()
+        for raw_field, time_field in remappings.null_message_fields:
+            if raw_field in message and message[raw_field] is None:
+                null_keys.update({raw_field, time_field})
+
+        for key in null_keys:
+            message.pop(key, None)
 
     @classmethod
-    def translate_rapid_pro_keys(cls, user, data, pipeline_configuration):
+    def translate_td(cls, td, remappings, metadata_factory, timestamps, remapped_counts):
         """
-        Remaps the keys of rqa messages in the wrong flow into the correct one, and remaps all Rapid Pro keys to
-        more usable keys that can be used by the rest of the pipeline.
-        
-        TODO: Break this function such that the show remapping phase happens in one class, and the Rapid Pro remapping
-              in another?
+        Translates the Rapid Pro keys of a single TracedData object.
+
+        All of the translation phases are computed against a plain dictionary of the message's current values, and
+        the result is then written back to the TracedData in a single `TracedDataBatch`.
+
+        :param td: TracedData to translate.
+        :type td: TracedData
+        :param remappings: Remappings compiled by `TranslateRapidProKeys.compile_remappings`.
+        :type remappings: _CompiledKeyRemappings
+        :param metadata_factory: Factory for the Metadata of the updates made to `td`.
+        :type metadata_factory: src.lib.MetadataFactory
+        :param timestamps: Store to read the parsed timestamps of `td` from. The entries for any time keys which are
+                           adjusted by a timestamp remapping are invalidated.
+        :type timestamps: src.lib.TimestampStore
+        :param remapped_counts: Number of messages remapped by each of the timestamp remappings so far.
+                                This is updated in place.
+        :type remapped_counts: list of int
         """
+        original = dict(td.items())
+        message = dict(original)
+
         # Set the show pipeline key for each message, using the presence of Rapid Pro value keys in the TracedData.
         # These are necessary in order to be able to remap radio shows and key names separately (because data
         # can't be 'deleted' from TracedData).
-        cls.set_show_ids(user, data, pipeline_configuration)
+        cls._set_show_id(message, remappings)
 
         # Move rqa messages which ended up in the wrong flow to the correct one.
-        cls.remap_radio_shows(user, data, pipeline_configuration)
+        cls._remap_radio_show(message, remappings, lambda time_key: timestamps.get(td, time_key).epoch_microseconds,
+                              remapped_counts)
 
         # Remap the keys used by Rapid Pro to more usable key names that will be used by the rest of the pipeline.
-        cls.remap_key_names(user, data, pipeline_configuration)
+        cls._remap_key_names(message, remappings)
 
         # Convert from the new show key format to the raw field format still used by the rest of the pipeline.
-        cls.set_rqa_raw_keys_from_show_ids(user, data)
+        cls._set_rqa_raw_key_from_show_id(message)
 
         # Some Text inputs in Rapid Pro can be null. We don't know why, but there's no useful messages in those
         # cases so hide them (which means the rest of the pipeline will treat those as NA).
-        cls.hide_null_messages(user, data)
+        cls._hide_null_message(message, remappings)
+
+        hidden_keys = {key for key in original.keys() if key not in message}
+        updated = {key: value for key, value in message.items() if key not in original or original[key] != value}
+
+        with TracedDataBatch(td, metadata_factory) as batch:
+            batch.hide_keys(hidden_keys)
+            batch.append_data(updated)
+
+        for remapping in remappings.timestamp_remappings:
+            if remapping.time_key in updated:
+                timestamps.invalidate(td, remapping.time_key)
+
+    @classmethod
+    def translate_rapid_pro_keys(cls, user, data, pipeline_configuration, timestamps=None):
+        """
+        Remaps the keys of rqa messages in the wrong flow into the correct one, and remaps all Rapid Pro keys to
+        more usable keys that can be used by the rest of the pipeline.
+
+        The remappings are compiled once, and then each message is translated in a single pass, so `data` may be
+        any iterable, e.g. a generator.
+
+        :param user: Identifier of the user running this program, for TracedData Metadata.
+        :type user: str
+        :param data: TracedData objects to translate.
+        :type data: iterable of TracedData
+        :param pipeline_configuration: Pipeline configuration.
+        :type pipeline_configuration: PipelineConfiguration
+        :param timestamps: Store to read the parsed message timestamps from. If None, a new store is used.
+        :type timestamps: src.lib.TimestampStore | None
+        :return: The translated TracedData objects.
+        :rtype: list of TracedData
+        """
+        remappings = cls.compile_remappings(pipeline_configuration)
+        metadata_factory = MetadataFactory(user, TimeUtils.utc_now_as_iso_string)
+        if timestamps is None:
+            timestamps = TimestampStore()
+
+        for remapping in pipeline_configuration.timestamp_remappings:
+            log.info(f"Remapping messages in time range {remapping.range_start_inclusive.isoformat()} to "
+                     f"{remapping.range_end_exclusive.isoformat()} to show {remapping.show_pipeline_key_to_remap_to}...")
+
+        translated = []
+        remapped_counts = [0] * len(remappings.timestamp_remappings)
+        for td in data:
+            cls.translate_td(td, remappings, metadata_factory, timestamps, remapped_counts)
+            translated.append(td)
+
+        for remapping, remapped_count in zip(remappings.timestamp_remappings, remapped_counts):
+            log.info(f"Remapped {remapped_count} messages to show {remapping.show_pipeline_key_to_remap_to}")
 
-        return data
+        return translated
@@ -1,18 +1,31 @@
-import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
 from core_data_modules.cleaners import Codes
-from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.logging import Logger
-from core_data_modules.traced_data import Metadata
-from core_data_modules.traced_data.io import TracedDataCodaV2IO
 
-from src.lib import PipelineConfiguration
+from src.lib import PipelineConfiguration, MetadataFactory, TimestampStore, CodaDatasetCache, MessageIdCache, \
+    LabelTemplates, TracedDataBatch, CodingConsistency
 from src.lib.configuration_objects import CodingModes
 from configurations.code_schemes import CodeSchemes
 
 log = Logger(__name__)
 
 
+def _correct_shard(groups, routing, metadata_factory):
+    # Module-level so that it can be pickled and sent to the worker processes in
+    # `WSCorrection.move_wrong_scheme_messages`. Returns (corrected group, unknown target code counts) for each
+    # group, so that the parent can merge both in the original group order.
+    timestamps = TimestampStore()
+    results = []
+    for group in groups:
+        unknown_target_code_counts = dict()
+        corrected_group = WSCorrection.correct_group(
+            group, routing, timestamps, metadata_factory, unknown_target_code_counts)
+        results.append((corrected_group, unknown_target_code_counts))
+    return results
+
+
 class _WSUpdate(object):
     def __init__(self, message, timestamp, source_field, source_td):
         self.message = message
@@ -21,79 +34,360 @@ class _WSUpdate(object):
         self.source_td = source_td
 
 
+class _WSRoutingTable(object):
+    def __init__(self, ws_codes, move_targets, rqa_plans, survey_plans):
+        """
+        Lookup tables for routing WS-corrected data between coding plans, compiled once per run by
+        `_WSRoutingTable.compile`.
+
+        :param ws_codes: Dictionary of code id -> code, for every code in the 'WS - Correct Dataset' scheme.
+        :type ws_codes: dict of str -> core_data_modules.data_models.Code
+        :param move_targets: Dictionary of code id -> raw field of the plan that code requests a move to, for every
+                             'WS - Correct Dataset' code which requests a move. The raw field is None for codes which
+                             request a move but have no matching coding plan.
+        :type move_targets: dict of str -> (str | None)
+        :param rqa_plans: RQA coding plans.
+        :type rqa_plans: list of src.lib.pipeline_configuration.CodingPlan
+        :param survey_plans: Survey coding plans.
+        :type survey_plans: list of src.lib.pipeline_configuration.CodingPlan
+        """
+        self.ws_codes = ws_codes
+        self.move_targets = move_targets
+
+        self.survey_plans = survey_plans
+        self.coded_survey_plans = [plan for plan in survey_plans if plan.coda_filename is not None]
+        self.coded_rqa_plans = [plan for plan in rqa_plans if plan.coda_filename is not None]
+
+        self.raw_survey_fields = {plan.raw_field for plan in survey_plans}
+        self.raw_rqa_fields = {plan.raw_field for plan in rqa_plans}
+        self.rqa_time_fields = {plan.time_field for plan in rqa_plans}
+
+        self.raw_field_to_rqa_plan = {plan.raw_field: plan for plan in rqa_plans}
+        self.raw_field_to_plans = dict()  # of raw field -> every survey or RQA plan with that raw field
+        for plan in survey_plans + rqa_plans:
+            if plan.raw_field not in self.raw_field_to_plans:
+                self.raw_field_to_plans[plan.raw_field] = []
+            self.raw_field_to_plans[plan.raw_field].append(plan)
+
+    @classmethod
+    def compile(cls, ws_correct_dataset_scheme, rqa_plans, survey_plans):
+        """
+        :param ws_correct_dataset_scheme: 'WS - Correct Dataset' code scheme.
+        :type ws_correct_dataset_scheme: core_data_modules.data_models.CodeScheme
+        :param rqa_plans: RQA coding plans.
+        :type rqa_plans: list of src.lib.pipeline_configuration.CodingPlan
+        :param survey_plans: Survey coding plans.
+        :type survey_plans: list of src.lib.pipeline_configuration.CodingPlan
+        :return: Routing table for these plans.
+        :rtype: _WSRoutingTable
+        """
+        # Construct a map from WS normal code id to the raw field that code indicates a requested move to.
+        ws_code_to_raw_field_map = dict()
+        for plan in rqa_plans + survey_plans:
+            if plan.ws_code is not None:
+                ws_code_to_raw_field_map[plan.ws_code.code_id] = plan.raw_field
+
+        ws_codes = dict()
+        move_targets = dict()
+        for code in ws_correct_dataset_scheme.codes:
+            ws_codes[code.code_id] = code
+            if code.code_type == "Normal" or code.control_code == Codes.NOT_CODED:
+                move_targets[code.code_id] = ws_code_to_raw_field_map.get(code.code_id)
+
+        return cls(ws_codes, move_targets, rqa_plans, survey_plans)
+
+    def move_target(self, ws_label, unknown_target_code_counts):
+        """
+        :param ws_label: 'WS - Correct Dataset' label to route.
+        :type ws_label: dict
+        :param unknown_target_code_counts: Counts of the codes which requested a move to a plan that doesn't exist.
+                                           This is updated in place.
+        :type unknown_target_code_counts: dict of (str, str) -> int
+        :return: Whether `ws_label` requests a move, and the raw field to move to, which is None if there is no
+                 plan for the requested target.
+        :rtype: (bool, str | None)
+        """
+        ws_code = self.ws_codes[ws_label["CodeID"]]
+        if ws_code.code_id not in self.move_targets:
+            return False, None
+
+        target_field = self.move_targets[ws_code.code_id]
+        if target_field is None:
+            if (ws_code.code_id, ws_code.display_text) not in unknown_target_code_counts:
+                unknown_target_code_counts[(ws_code.code_id, ws_code.display_text)] = 0
+            unknown_target_code_counts[(ws_code.code_id, ws_code.display_text)] += 1
+        return True, target_field
+
+
 class WSCorrection(object):
     @staticmethod
-    def move_wrong_scheme_messages(user, data, coda_input_dir):
+    def _make_corrected_base(source_td, flattened_survey_updates, routing, metadata_factory):
+        """
+        Makes a copy of a TracedData object with the WS-corrected survey data, and with all of the RQA fields hidden,
+        ready for one corrected RQA message to be appended.
+
+        :param source_td: TracedData to copy.
+        :type source_td: TracedData
+        :param flattened_survey_updates: Dictionary of survey key -> corrected value, or None if the key's data has
+                                         been moved away.
+        :type flattened_survey_updates: dict of str -> (str | None)
+        :param routing: Routing table for this run.
+        :type routing: _WSRoutingTable
+        :param metadata_factory: Factory for the Metadata of the updates.
+        :type metadata_factory: src.lib.MetadataFactory
+        :return: The corrected copy of `source_td`.
+        :rtype: TracedData
+        """
+        corrected_td = source_td.copy()
+
+        with TracedDataBatch(corrected_td, metadata_factory) as batch:
+            # Hide the survey keys currently in the TracedData which have had data moved away.
+            batch.hide_keys({k for k, v in flattened_survey_updates.items() if v is None})
+
+            # Update with the corrected survey data
+            batch.append_data({k: v for k, v in flattened_survey_updates.items() if v is not None})
+
+            # Hide all the RQA fields (they will be added back, in turn, by the caller).
+            batch.hide_keys(routing.raw_rqa_fields)
+            batch.hide_keys(routing.rqa_time_fields)
+
+        return corrected_td
+
+    @classmethod
+    def correct_group(cls, group, routing, timestamps, metadata_factory, unknown_target_code_counts):
+        """
+        Performs the WS correction for the messages from one uid.
+
+        :param group: All the messages from one uid, with the '_WS' labels imported.
+        :type group: list of TracedData
+        :param routing: Routing table for this run.
+        :type routing: _WSRoutingTable
+        :param timestamps: Store to read the parsed message timestamps from.
+        :type timestamps: src.lib.TimestampStore
+        :param metadata_factory: Factory for the Metadata of the updates.
+        :type metadata_factory: src.lib.MetadataFactory
+        :param unknown_target_code_counts: Counts of the 'WS - Correct Dataset' codes with no matching coding plan.
+                                           This is updated in place.
+        :type unknown_target_code_counts: dict of (str, str) -> int
+        :return: The corrected messages, one per RQA message after the correction.
+        :rtype: list of TracedData
+        """
+        # Find all the surveys data being moved.
+        # (Note: we only need to check one td in this group because all the demographics are the same)
+        td = group[0]
+        survey_moves = dict()  # of source_field -> target_field
+        for plan in routing.coded_survey_plans:
+            if plan.raw_field not in td:
+                continue
+            moving, target_field = routing.move_target(
+                td[f"{plan.raw_field}_WS_correct_dataset"], unknown_target_code_counts)
+            if moving:
+                survey_moves[plan.raw_field] = target_field
+
+        # Find all the RQA data being moved.
+        rqa_moves = dict()  # of (index in group, source_field) -> target_field
+        for i, td in enumerate(group):
+            for plan in routing.coded_rqa_plans:
+                if plan.raw_field not in td:
+                    continue
+                moving, target_field = routing.move_target(
+                    td[f"{plan.raw_field}_WS_correct_dataset"], unknown_target_code_counts)
+                if moving:
+                    rqa_moves[(i, plan.raw_field)] = target_field
+
+        # Build a dictionary of the survey fields that haven't been moved, and cleared fields for those which have.
+        survey_updates = dict()  # of raw_field -> updated value
+        for plan in routing.coded_survey_plans:
+            if plan.raw_field in survey_moves.keys():
+                # Data is moving
+                survey_updates[plan.raw_field] = []
+            elif plan.raw_field in td:
+                # Data is not moving
+                survey_updates[plan.raw_field] = [
+                    _WSUpdate(td[plan.raw_field], td[plan.time_field], plan.raw_field, td)
+                ]
+
+        # Build a list of the rqa fields that haven't been moved.
+        rqa_updates = []  # of (raw_field, _WSUpdate)
+        for i, td in enumerate(group):
+            for plan in routing.coded_rqa_plans:
+                if plan.raw_field in td:
+                    if (i, plan.raw_field) in rqa_moves.keys():
+                        # Data is moving
+                        pass
+                    else:
+                        # Data is not moving
+                        rqa_updates.append(
+                            (plan.raw_field, _WSUpdate(td[plan.raw_field], td[plan.time_field], plan.raw_field, td))
+                        )
+
+        # Add data moving from survey fields to the relevant survey_/rqa_updates
+        for source_field, target_field in survey_moves.items():
+            if target_field is None:
+                continue
+
+            for plan in routing.raw_field_to_plans[source_field]:
+                update = _WSUpdate(td[plan.raw_field], td[plan.time_field], plan.raw_field, td)
+                if target_field in routing.raw_survey_fields:
+                    survey_updates[target_field] = survey_updates.get(target_field, []) + [update]
+                else:
+                    assert target_field in routing.raw_rqa_fields, f"Raw field '{target_field}' not in any coding plan"
+                    rqa_updates.append((target_field, update))
+
+        # Add data moving from RQA fields to the relevant survey_/rqa_updates
+        for (i, source_field), target_field in rqa_moves.items():
+            if target_field is None:
+                continue
+
+            for plan in routing.raw_field_to_plans[source_field]:
+                _td = group[i]
+                update = _WSUpdate(_td[plan.raw_field], _td[plan.time_field], plan.raw_field, td)
+                if target_field in routing.raw_survey_fields:
+                    survey_updates[target_field] = survey_updates.get(target_field, []) + [update]
+                else:
+                    assert target_field in routing.raw_rqa_fields, f"Raw field '{target_field}' not in any coding plan"
+                    rqa_updates.append((target_field, update))
+
+        # Re-format the survey updates to a form suitable for use by the rest of the pipeline
+        flattened_survey_updates = {}
+        for plan in routing.survey_plans:
+            if plan.raw_field in survey_updates:
+                plan_updates = survey_updates[plan.raw_field]
+
+                if len(plan_updates) > 0:
+                    flattened_survey_updates[plan.raw_field] = "; ".join([u.message for u in plan_updates])
+                    flattened_survey_updates[plan.time_field] = min(
+                        plan_updates, key=lambda u: timestamps.parse(u.timestamp).epoch_microseconds).timestamp
+                    flattened_survey_updates[f"{plan.raw_field}_source"] = "; ".join(
+                        [u.source_field for u in plan_updates])
+                else:
+                    flattened_survey_updates[plan.raw_field] = None
+                    flattened_survey_updates[plan.time_field] = None
+                    flattened_survey_updates[f"{plan.raw_field}_source"] = None
+
+        # For each RQA message, create a copy of its source td, append the updated TracedData, and add this to
+        # the list of TracedData to be returned.
+        # The layers which hide and update the survey fields and hide the RQA fields are the same for every RQA
+        # message from the same source td, so are only built once per source, on a single copy which is then
+        # shared. Each corrected td only adds its own RQA layer on top, and the last td from each source reuses
+        # the shared copy itself rather than copying it again.
+        remaining_updates_per_source = dict()  # of id(source td) -> number of RQA updates still to apply
+        for _, update in rqa_updates:
+            source_id = id(update.source_td)
+            remaining_updates_per_source[source_id] = remaining_updates_per_source.get(source_id, 0) + 1
+
+        corrected_group = []
+        corrected_bases = dict()  # of id(source td) -> copy of the source td with the shared layers applied
+        for target_field, update in rqa_updates:
+            source_id = id(update.source_td)
+            if source_id not in corrected_bases:
+                corrected_bases[source_id] = cls._make_corrected_base(
+                    update.source_td, flattened_survey_updates, routing, metadata_factory)
+
+            remaining_updates_per_source[source_id] -= 1
+            if remaining_updates_per_source[source_id] == 0:
+                corrected_td = corrected_bases.pop(source_id)
+            else:
+                corrected_td = corrected_bases[source_id].copy()
+
+            target_coding_plan = routing.raw_field_to_rqa_plan[target_field]
+
+            rqa_dict = {
+                target_field: update.message,
+                target_coding_plan.time_field: update.timestamp,
+                f"{target_field}_source": update.source_field
+            }
+
+            corrected_td.append_data(rqa_dict, metadata_factory.metadata())
+            corrected_group.append(corrected_td)
+
+        return corrected_group
+
+    @staticmethod
+    def _correct_groups_in_parallel(uid_groups, routing, metadata_factory, processes):
+        """
+        Runs `WSCorrection.correct_group` on every group in a process pool, with the uids hash-partitioned into one
+        shard per process.
+
+        :param uid_groups: List of (uid, all the messages from that uid).
+        :type uid_groups: list of (str, list of TracedData)
+        :param routing: Routing table for this run.
+        :type routing: _WSRoutingTable
+        :param metadata_factory: Factory for the Metadata of the updates.
+        :type metadata_factory: src.lib.MetadataFactory
+        :param processes: Number of worker processes to use.
+        :type processes: int
+        :return: (corrected group, unknown target code counts) for each group, in the same order as `uid_groups`.
+        :rtype: list of (list of TracedData, dict of (str, str) -> int)
+        """
+        shards = [[] for _ in range(processes)]  # of list of group index in uid_groups
+        for i, (uid, _) in enumerate(uid_groups):
+            # A stable hash rather than `hash`, which is randomised per process.
+            shards[zlib.crc32(uid.encode("utf-8")) % processes].append(i)
+
+        log.info(f"Correcting {len(uid_groups)} uids in {processes} shards of sizes "
+                 f"{[len(shard) for shard in shards]}...")
+        results = [None] * len(uid_groups)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            shard_results = executor.map(
+                _correct_shard,
+                [[uid_groups[i][1] for i in shard] for shard in shards],
+                [routing] * processes,
+                [metadata_factory] * processes
+            )
+            for shard, shard_result in zip(shards, shard_results):
+                for i, result in zip(shard, shard_result):
+                    results[i] = result
+
+        return results
+
+    @staticmethod
+    def move_wrong_scheme_messages(user, data, coda_input_dir, timestamps=None, processes=1, message_ids=None):
+        if timestamps is None:
+            timestamps = TimestampStore()
+        if message_ids is None:
+            message_ids = MessageIdCache()
+
         log.info("Importing manually coded Coda files to '_WS' fields...")
+        # Write the message ids, '_WS' labels and coding errors of every plan to each message in a single batch.
+        batches = TracedDataBatch.for_each(data, MetadataFactory(user))
         for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
             if plan.coda_filename is None:
                 continue
 
-            TracedDataCodaV2IO.compute_message_ids(user, data, plan.raw_field, f"{plan.id_field}_WS")
-            with open(f"{coda_input_dir}/{plan.coda_filename}") as f:
-                TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                    user, data, f"{plan.id_field}_WS",
-                    {f"{plan.raw_field}_WS_correct_dataset": CodeSchemes.WS_CORRECT_DATASET_SCHEME}, f
-                )
-
+            message_ids.compute_message_ids(user, batches, plan.raw_field, f"{plan.id_field}_WS")
+            scheme_key_map = {f"{plan.raw_field}_WS_correct_dataset": CodeSchemes.WS_CORRECT_DATASET_SCHEME}
+            multi_coded_scheme_key_map = dict()
             for cc in plan.coding_configurations:
-                with open(f"{coda_input_dir}/{plan.coda_filename}") as f:
-                    if cc.coding_mode == CodingModes.SINGLE:
-                        TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
-                            user, data, plan.id_field + "_WS",
-                            {f"{cc.coded_field}_WS": cc.code_scheme}, f
-                        )
-                    else:
-                        assert cc.coding_mode == CodingModes.MULTIPLE
-                        TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable_multi_coded(
-                            user, data, f"{plan.id_field}_WS",
-                            {f"{cc.coded_field}_WS": cc.code_scheme}, f
-                        )
+                if cc.coding_mode == CodingModes.SINGLE:
+                    scheme_key_map[f"{cc.coded_field}_WS"] = cc.code_scheme
+                else:
+                    assert cc.coding_mode == CodingModes.MULTIPLE
+                    multi_coded_scheme_key_map[f"{cc.coded_field}_WS"] = cc.code_scheme
 
-        log.info("Checking for WS Coding Errors...")
-        # Check for coding errors
-        for td in data:
-            for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
-                rqa_codes = []
-                for cc in plan.coding_configurations:
-                    if cc.coding_mode == CodingModes.SINGLE:
-                        if f"{cc.coded_field}_WS" in td:
-                            label = td[f"{cc.coded_field}_WS"]
-                            rqa_codes.append(cc.code_scheme.get_code_with_code_id(label["CodeID"]))
-                    else:
-                        assert cc.coding_mode == CodingModes.MULTIPLE
-                        for label in td.get(f"{cc.coded_field}_WS", []):
-                            rqa_codes.append(cc.code_scheme.get_code_with_code_id(label["CodeID"]))
-
-                has_ws_code_in_code_scheme = False
-                for code in rqa_codes:
-                    if code.control_code == Codes.WRONG_SCHEME:
-                        has_ws_code_in_code_scheme = True
-
-                has_ws_code_in_ws_scheme = False
-                if f"{plan.raw_field}_WS_correct_dataset" in td:
-                    ws_code = CodeSchemes.WS_CORRECT_DATASET_SCHEME.get_code_with_code_id(
-                        td[f"{plan.raw_field}_WS_correct_dataset"]["CodeID"])
-                    has_ws_code_in_ws_scheme = ws_code.code_type == "Normal" or ws_code.control_code == Codes.NOT_CODED
-
-                if has_ws_code_in_code_scheme != has_ws_code_in_ws_scheme:
-                    log.warning(f"Coding Error: {plan.raw_field}: {td[plan.raw_field]}")
-                    coding_error_dict = {
-                        f"{plan.raw_field}_WS_correct_dataset":
-                            CleaningUtils.make_label_from_cleaner_code(
-                                CodeSchemes.WS_CORRECT_DATASET_SCHEME,
-                                CodeSchemes.WS_CORRECT_DATASET_SCHEME.get_code_with_control_code(
-                                    Codes.CODING_ERROR),
-                                Metadata.get_call_location(),
-                            ).to_dict()
-                    }
-                    td.append_data(coding_error_dict, Metadata(user, Metadata.get_call_location(), time.time()))
+            CodaDatasetCache.load(f"{coda_input_dir}/{plan.coda_filename}").apply_labels(
+                user, batches, f"{plan.id_field}_WS", scheme_key_map, multi_coded_scheme_key_map
+            )
 
-        # Construct a map from WS normal code id to the raw field that code indicates a requested move to.
-        ws_code_to_raw_field_map = dict()
-        for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
-            if plan.ws_code is not None:
-                ws_code_to_raw_field_map[plan.ws_code.code_id] = plan.raw_field
+        log.info("Checking for WS Coding Errors...")
+        metadata_factory = MetadataFactory(user)
+        label_templates = LabelTemplates(metadata_factory)
+        coding_errors = CodingConsistency.find_coding_errors(
+            batches, PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS,
+            coded_field_suffix="_WS", correct_dataset_suffix="_WS_correct_dataset"
+        )
+        for plan, rows in coding_errors:
+            for i in rows:
+                batches[i].append_data({
+                    f"{plan.raw_field}_WS_correct_dataset":
+                        label_templates.label(CodeSchemes.WS_CORRECT_DATASET_SCHEME, Codes.CODING_ERROR)
+                })
+        TracedDataBatch.commit_all(batches)
+
+        routing = _WSRoutingTable.compile(
+            CodeSchemes.WS_CORRECT_DATASET_SCHEME,
+            PipelineConfiguration.RQA_CODING_PLANS, PipelineConfiguration.SURVEY_CODING_PLANS
+        )
 
         # Group the TracedData by uid.
         data_grouped_by_uid = dict()
@@ -108,156 +402,17 @@ class WSCorrection(object):
         corrected_data = []  # List of TracedData with the WS data moved.
         unknown_target_code_counts = dict()  # 'WS - Correct Dataset' codes with no matching code id in any coding plan
                                              # for this project, with a count of the occurrences
-        for group in data_grouped_by_uid.values():
-            # Find all the surveys data being moved.
-            # (Note: we only need to check one td in this group because all the demographics are the same)
-            td = group[0]
-            survey_moves = dict()  # of source_field -> target_field
-            for plan in PipelineConfiguration.SURVEY_CODING_PLANS:
-                if plan.raw_field not in td or plan.coda_filename is None:
-                    continue
-                ws_code = CodeSchemes.WS_CORRECT_DATASET_SCHEME.get_code_with_code_id(
-                    td[f"{plan.raw_field}_WS_correct_dataset"]["CodeID"])
-                if ws_code.code_type == "Normal" or ws_code.control_code == Codes.NOT_CODED:
-                    if ws_code.code_id in ws_code_to_raw_field_map:
-                        survey_moves[plan.raw_field] = ws_code_to_raw_field_map[ws_code.code_id]
-                    else:
-                        if (ws_code.code_id, ws_code.display_text) not in unknown_target_code_counts:
-                            unknown_target_code_counts[(ws_code.code_id, ws_code.display_text)] = 0
-                        unknown_target_code_counts[(ws_code.code_id, ws_code.display_text)] += 1
-                        survey_moves[plan.raw_field] = None
-
-            # Find all the RQA data being moved.
-            rqa_moves = dict()  # of (index in group, source_field) -> target_field
-            for i, td in enumerate(group):
-                for plan in PipelineConfiguration.RQA_CODING_PLANS:
-                    if plan.raw_field not in td or plan.coda_filename is None:
-                        continue
-                    ws_code = CodeSchemes.WS_CORRECT_DATASET_SCHEME.get_code_with_code_id(
-                        td[f"{plan.raw_field}_WS_correct_dataset"]["CodeID"])
-                    if ws_code.code_type == "Normal" or ws_code.control_code == Codes.NOT_CODED:
-                        if ws_code.code_id in ws_code_to_raw_field_map:
-                            rqa_moves[(i, plan.raw_field)] = ws_code_to_raw_field_map[ws_code.code_id]
-                        else:
-                            if (ws_code.code_id, ws_code.display_text) not in unknown_target_code_counts:
-                                unknown_target_code_counts[(ws_code.code_id, ws_code.display_text)] = 0
-                            unknown_target_code_counts[(ws_code.code_id, ws_code.display_text)] += 1
-                            rqa_moves[(i, plan.raw_field)] = None
-
-            # Build a dictionary of the survey fields that haven't been moved, and cleared fields for those which have.
-            survey_updates = dict()  # of raw_field -> updated value
-            for plan in PipelineConfiguration.SURVEY_CODING_PLANS:
-                if plan.coda_filename is None:
-                    continue
-
-                if plan.raw_field in survey_moves.keys():
-                    # Data is moving
-                    survey_updates[plan.raw_field] = []
-                elif plan.raw_field in td:
-                    # Data is not moving
-                    survey_updates[plan.raw_field] = [
-                        _WSUpdate(td[plan.raw_field], td[plan.time_field], plan.raw_field, td)
-                    ]
-
-            # Build a list of the rqa fields that haven't been moved.
-            rqa_updates = []  # of (raw_field, _WSUpdate)
-            for i, td in enumerate(group):
-                for plan in PipelineConfiguration.RQA_CODING_PLANS:
-                    if plan.coda_filename is None:
-                        continue
-
-                    if plan.raw_field in td:
-                        if (i, plan.raw_field) in rqa_moves.keys():
-                            # Data is moving
-                            pass
-                        else:
-                            # Data is not moving
-                            rqa_updates.append(
-                                (plan.raw_field, _WSUpdate(td[plan.raw_field], td[plan.time_field], plan.raw_field, td))
-                            )
-
-            # Add data moving from survey fields to the relevant survey_/rqa_updates
-            raw_survey_fields = {plan.raw_field for plan in PipelineConfiguration.SURVEY_CODING_PLANS}
-            raw_rqa_fields = {plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS}
-            for plan in PipelineConfiguration.SURVEY_CODING_PLANS + PipelineConfiguration.RQA_CODING_PLANS:
-                if plan.raw_field not in survey_moves:
-                    continue
-
-                target_field = survey_moves[plan.raw_field]
-                if target_field is None:
-                    continue
-
-                update = _WSUpdate(td[plan.raw_field], td[plan.time_field], plan.raw_field, td)
-                if target_field in raw_survey_fields:
-                    survey_updates[target_field] = survey_updates.get(target_field, []) + [update]
-                else:
-                    assert target_field in raw_rqa_fields, f"Raw field '{target_field}' not in any coding plan"
-                    rqa_updates.append((target_field, update))
-
-            # Add data moving from RQA fields to the relevant survey_/rqa_updates
-            for (i, source_field), target_field in rqa_moves.items():
-                if target_field is None:
-                    continue
-
-                for plan in PipelineConfiguration.SURVEY_CODING_PLANS + PipelineConfiguration.RQA_CODING_PLANS:
-                    if plan.raw_field == source_field:
-                        _td = group[i]
-                        update = _WSUpdate(_td[plan.raw_field], _td[plan.time_field], plan.raw_field, td)
-                        if target_field in raw_survey_fields:
-                            survey_updates[target_field] = survey_updates.get(target_field, []) + [update]
-                        else:
-                            assert target_field in raw_rqa_fields, f"Raw field '{target_field}' not in any coding plan"
-                            rqa_updates.append((target_field, update))
-
-            # Re-format the survey updates to a form suitable for use by the rest of the pipeline
-            flattened_survey_updates = {}
-            for plan in PipelineConfiguration.SURVEY_CODING_PLANS:
-                if plan.raw_field in survey_updates:
-                    plan_updates = survey_updates[plan.raw_field]
-
-                    if len(plan_updates) > 0:
-                        flattened_survey_updates[plan.raw_field] = "; ".join([u.message for u in plan_updates])
-                        flattened_survey_updates[plan.time_field] = sorted([u.timestamp for u in plan_updates])[0]
-                        flattened_survey_updates[f"{plan.raw_field}_source"] = "; ".join(
-                            [u.source_field for u in plan_updates])
-                    else:
-                        flattened_survey_updates[plan.raw_field] = None
-                        flattened_survey_updates[plan.time_field] = None
-                        flattened_survey_updates[f"{plan.raw_field}_source"] = None
-
-            # For each RQA message, create a copy of its source td, append the updated TracedData, and add this to
-            # the list of TracedData to be returned
-            raw_field_to_rqa_plan_map = {plan.raw_field: plan for plan in PipelineConfiguration.RQA_CODING_PLANS}
-            for target_field, update in rqa_updates:
-                corrected_td = update.source_td.copy()
-
-                # Hide the survey keys currently in the TracedData which have had data moved away.
-                corrected_td.hide_keys(
-                    {k for k, v in flattened_survey_updates.items() if v is None}.intersection(corrected_td.keys()),
-                    Metadata(user, Metadata.get_call_location(), time.time()))
-
-                # Update with the corrected survey data
-                corrected_td.append_data({k: v for k, v in flattened_survey_updates.items() if v is not None},
-                                         Metadata(user, Metadata.get_call_location(), time.time()))
-
-                # Hide all the RQA fields (they will be added back, in turn, in the next step).
-                corrected_td.hide_keys(
-                    {plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS}.intersection(corrected_td.keys()),
-                    Metadata(user, Metadata.get_call_location(), time.time()))
-                corrected_td.hide_keys(
-                    {plan.time_field for plan in PipelineConfiguration.RQA_CODING_PLANS}.intersection(corrected_td.keys()),
-                    Metadata(user, Metadata.get_call_location(), time.time()))
-
-                target_coding_plan = raw_field_to_rqa_plan_map[target_field]
-
-                rqa_dict = {
-                    target_field: update.message,
-                    target_coding_plan.time_field: update.timestamp,
-                    f"{target_field}_source": update.source_field
-                }
-
-                corrected_td.append_data(rqa_dict, Metadata(user, Metadata.get_call_location(), time.time()))
-                corrected_data.append(corrected_td)
+        if processes > 1:
+            shard_results = WSCorrection._correct_groups_in_parallel(
+                list(data_grouped_by_uid.items()), routing, metadata_factory, processes)
+            for corrected_group, group_unknown_target_code_counts in shard_results:
+                corrected_data.extend(corrected_group)
+                for code, count in group_unknown_target_code_counts.items():
+                    unknown_target_code_counts[code] = unknown_target_code_counts.get(code, 0) + count
+        else:
+            for group in data_grouped_by_uid.values():
+                corrected_data.extend(WSCorrection.correct_group(
+                    group, routing, timestamps, metadata_factory, unknown_target_code_counts))
 
         if len(unknown_target_code_counts) > 0:
             log.warning("Found the following 'WS - Correct Dataset' CodeIDs with no matching coding plan:")
@@ -0,0 +1,153 @@
+import random
+import unittest
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.traced_data import Metadata, TracedData
+
+from src.analysis_utils import AnalysisUtils
+from src.lib import PipelineConfiguration, ConsentUtils
+from src.lib.configuration_objects import CodingModes
+from src.lib.label_matrix import LabelMatrix
+
+USER = "test_user"
+CONSENT_WITHDRAWN_KEY = "consent_withdrawn"
+# One RQA and one survey plan, so that some participants respond to neither.
+CODING_PLANS = PipelineConfiguration.KAKUMA_RQA_CODING_PLANS[:1] + PipelineConfiguration.KAKUMA_SURVEY_CODING_PLANS[:1]
+
+
+def generate_data(coding_plans, count, seed=0):
+    """
+    Generates participants with a label in every coded field of the given plans. Fields are either NA or NS alone,
+    or one (SINGLE) or up to three (MULTIPLE) of the other codes.
+    """
+    rng = random.Random(seed)
+    metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+
+    data = []
+    for _ in range(count):
+        d = {CONSENT_WITHDRAWN_KEY: rng.choice([Codes.TRUE, Codes.FALSE, Codes.FALSE, Codes.FALSE])}
+        for plan in coding_plans:
+            for cc in plan.coding_configurations:
+                missing_codes = [code for code in cc.code_scheme.codes
+                                 if code.control_code in {Codes.TRUE_MISSING, Codes.SKIPPED}]
+                other_codes = [code for code in cc.code_scheme.codes
+                               if code.control_code not in {Codes.TRUE_MISSING, Codes.SKIPPED}]
+                if len(missing_codes) > 0 and rng.random() < 0.3:
+                    codes = [rng.choice(missing_codes)]
+                elif cc.coding_mode == CodingModes.SINGLE:
+                    codes = [rng.choice(other_codes)]
+                else:
+                    codes = rng.sample(other_codes, rng.randint(1, 3))
+
+                labels = [{"SchemeID": cc.code_scheme.scheme_id, "CodeID": code.code_id} for code in codes]
+                d[cc.coded_field] = labels[0] if cc.coding_mode == CodingModes.SINGLE else labels
+        data.append(TracedData(d, metadata))
+
+    return data
+
+
+class TestAnalysisUtilsFilters(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data = generate_data(CODING_PLANS, 300)
+        # The filters which take a consent key run on data where the participants who withdrew consent have 'STOP'
+        # in place of their labels.
+        cls.stopped_data = generate_data(CODING_PLANS, 300)
+        ConsentUtils.set_stopped(USER, cls.stopped_data, CONSENT_WITHDRAWN_KEY)
+
+    def assert_same_objects(self, actual, expected):
+        self.assertEqual([id(td) for td in actual], [id(td) for td in expected])
+        self.assertGreater(len(actual), 0)
+        self.assertLess(len(actual), len(self.data))
+
+    def test_withdrawn_participants_are_stopped(self):
+        withdrawn = [td for td in self.stopped_data if td[CONSENT_WITHDRAWN_KEY] == Codes.TRUE]
+        self.assertGreater(len(withdrawn), 0)
+        for td in withdrawn:
+            for plan in CODING_PLANS:
+                for cc in plan.coding_configurations:
+                    self.assertEqual(td[cc.coded_field], Codes.STOP)
+
+    def test_filter_responded_matches_responded(self):
+        self.assert_same_objects(
+            AnalysisUtils.filter_responded(self.data, CODING_PLANS),
+            [td for td in self.data if any(AnalysisUtils.responded(td, plan) for plan in CODING_PLANS)]
+        )
+
+    def test_filter_opt_ins_matches_opt_in(self):
+        self.assert_same_objects(
+            AnalysisUtils.filter_opt_ins(self.stopped_data, CONSENT_WITHDRAWN_KEY, CODING_PLANS),
+            [td for td in self.stopped_data
+             if any(AnalysisUtils.opt_in(td, CONSENT_WITHDRAWN_KEY, plan) for plan in CODING_PLANS)]
+        )
+
+    def test_filter_partially_labelled_matches_labelled(self):
+        self.assert_same_objects(
+            AnalysisUtils.filter_partially_labelled(self.stopped_data, CONSENT_WITHDRAWN_KEY, CODING_PLANS),
+            [td for td in self.stopped_data
+             if any(AnalysisUtils.labelled(td, CONSENT_WITHDRAWN_KEY, plan) for plan in CODING_PLANS)]
+        )
+
+    def test_filter_fully_labelled_matches_labelled(self):
+        self.assert_same_objects(
+            AnalysisUtils.filter_fully_labelled(self.stopped_data, CONSENT_WITHDRAWN_KEY, CODING_PLANS),
+            [td for td in self.stopped_data
+             if all(AnalysisUtils.labelled(td, CONSENT_WITHDRAWN_KEY, plan) for plan in CODING_PLANS)]
+        )
+
+    def test_filter_relevant_matches_relevant(self):
+        self.assert_same_objects(
+            AnalysisUtils.filter_relevant(self.stopped_data, CONSENT_WITHDRAWN_KEY, CODING_PLANS),
+            [td for td in self.stopped_data
+             if any(AnalysisUtils.relevant(td, CONSENT_WITHDRAWN_KEY, plan) for plan in CODING_PLANS)]
+        )
+
+
+class TestLabelMatrix(unittest.TestCase):
+    def test_columns_and_code_counts_match_the_labels(self):
+        data = generate_data(CODING_PLANS, 100)
+        coding_configurations = [cc for plan in CODING_PLANS for cc in plan.coding_configurations]
+        matrix = LabelMatrix(data, coding_configurations)
+
+        rows = [i % 2 == 0 for i in range(len(data))]
+        for cc in coding_configurations:
+            expected_counts = [0] * len(cc.code_scheme.codes)
+            for i, td in enumerate(data):
+                labels = [td[cc.coded_field]] if cc.coding_mode == CodingModes.SINGLE else td[cc.coded_field]
+                code_ids = {label["CodeID"] for label in labels}
+
+                code_indexes = [j for j, code in enumerate(cc.code_scheme.codes) if code.code_id in code_ids]
+                if cc.coding_mode == CodingModes.SINGLE:
+                    self.assertEqual([matrix.column(cc.coded_field)[i]], code_indexes)
+                else:
+                    self.assertEqual(
+                        [j for j in range(len(cc.code_scheme.codes)) if matrix.column(cc.coded_field)[i] & (1 << j)],
+                        code_indexes
+                    )
+                if rows[i]:
+                    for j, code in enumerate(cc.code_scheme.codes):
+                        if code.code_id in code_ids:
+                            expected_counts[j] += 1
+
+            self.assertEqual(matrix.code_counts(cc.coded_field, rows), expected_counts)
+
+    def test_rows_with_control_code_and_absent_fields(self):
+        data = generate_data(CODING_PLANS, 50)
+        data.append(TracedData({CONSENT_WITHDRAWN_KEY: Codes.FALSE}, Metadata(USER, "test", "2020-06-01")))
+        coding_configurations = [cc for plan in CODING_PLANS for cc in plan.coding_configurations]
+        coded_fields = [cc.coded_field for cc in coding_configurations]
+        matrix = LabelMatrix(data, coding_configurations)
+
+        expected = []
+        for td in data:
+            control_codes = set()
+            for cc in coding_configurations:
+                if cc.coded_field not in td:
+                    continue
+                labels = [td[cc.coded_field]] if cc.coding_mode == CodingModes.SINGLE else td[cc.coded_field]
+                for label in labels:
+                    control_codes.add(cc.code_scheme.get_code_with_code_id(label["CodeID"]).control_code)
+            expected.append(Codes.TRUE_MISSING in control_codes or Codes.SKIPPED in control_codes)
+
+        self.assertEqual(matrix.rows_with_control_code(coded_fields, Codes.TRUE_MISSING, Codes.SKIPPED), expected)
+        self.assertEqual([matrix.labelled_rows(field)[-1] for field in coded_fields], [False] * len(coded_fields))
@@ -0,0 +1,41 @@
+import unittest
+
+from src.lib import CleanerCache
+
+
+class TestCleanerCache(unittest.TestCase):
+    def test_clean_memoises_and_evicts_least_recently_used(self):
+        calls = []
+
+        def cleaner(text):
+            calls.append(text)
+            return text.upper()
+
+        cache = CleanerCache(max_size=2)
+        self.assertEqual(cache.clean(cleaner, "a"), "A")
+        self.assertEqual(cache.clean(cleaner, "b"), "B")
+        self.assertEqual(cache.clean(cleaner, "a"), "A")
+        self.assertEqual(cache.clean(cleaner, "c"), "C")  # Evicts "b", the least recently used.
+        self.assertEqual(cache.clean(cleaner, "b"), "B")
+
+        self.assertEqual(calls, ["a", "b", "c", "b"])
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+        self.assertEqual(len(cache), 2)
+
+    def test_memoise_keeps_the_cleaner_name(self):
+        def clean_gender(text):
+            return text
+
+        self.assertEqual(CleanerCache().memoise(clean_gender).__name__, "clean_gender")
+
+    def test_prime_with_worker_processes_matches_serial_cleaning(self):
+        # A lambda can't be pickled, so this also checks the workers get the cleaner without it being sent to them.
+        cleaner = lambda text: text[::-1]
+        texts = [f"text {i % 50}" for i in range(200)]
+
+        cache = CleanerCache(processes=2, parallel_threshold=10)
+        cache.prime(cleaner, texts)
+        self.assertEqual(cache.misses, 50)
+
+        self.assertEqual([cache.clean(cleaner, text) for text in texts], [cleaner(text) for text in texts])
+        self.assertEqual(cache.misses, 50)
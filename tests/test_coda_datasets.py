@@ -0,0 +1,121 @@
+import io
+import json
+import unittest
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.data_models import Label, Message, Origin
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.traced_data.io import TracedDataCodaV2IO
+
+from configurations.code_schemes import CodeSchemes
+from src.lib import CodaDataset
+
+USER = "test_user"
+SINGLE_SCHEME = CodeSchemes.GENDER
+MULTI_SCHEME = CodeSchemes.KAKUMA_S01E01
+
+
+def make_label(scheme_id, code_id, date_time_utc, checked=True):
+    return Label(scheme_id, code_id, date_time_utc, Origin("test-coder", "Test Coder", "Manual"), checked=checked)
+
+
+def code_id(scheme, index):
+    return scheme.codes[index].code_id
+
+
+def make_coda_messages():
+    """
+    Coda messages covering the cases the importers have to agree on. Labels are newest first, as in Coda.
+    """
+    multi = MULTI_SCHEME.scheme_id
+    single = SINGLE_SCHEME.scheme_id
+    messages = [
+        # Duplicate schemes with interleaved labels.
+        Message("msg-1", "text 1", "2020-06-01T10:00:00+00:00", [
+            make_label(f"{multi}-1", code_id(MULTI_SCHEME, 1), "2020-06-05T10:00:00+00:00"),
+            make_label(f"{multi}-2", code_id(MULTI_SCHEME, 0), "2020-06-04T10:00:00+00:00"),
+            make_label(f"{multi}-1", code_id(MULTI_SCHEME, 2), "2020-06-02T10:00:00+00:00"),
+            make_label(single, code_id(SINGLE_SCHEME, 0), "2020-06-01T10:00:00+00:00")
+        ]),
+        # A SPECIAL-REMOVE label in one duplicate, the same code in two duplicates, and an unchecked newest
+        # single-coded label.
+        Message("msg-2", "text 2", "2020-06-01T10:00:00+00:00", [
+            make_label(f"{multi}-1", CodaDataset.SPECIAL_REMOVE_CODE_ID, "2020-06-03T10:00:00+00:00"),
+            make_label(multi, code_id(MULTI_SCHEME, 3), "2020-06-02T10:00:00+00:00"),
+            make_label(f"{multi}-2", code_id(MULTI_SCHEME, 3), "2020-06-01T10:00:00+00:00"),
+            make_label(single, code_id(SINGLE_SCHEME, 1), "2020-06-02T10:00:00+00:00", checked=False),
+            make_label(single, code_id(SINGLE_SCHEME, 0), "2020-06-01T10:00:00+00:00")
+        ]),
+        # Only unchecked labels.
+        Message("msg-3", "text 3", "2020-06-01T10:00:00+00:00", [
+            make_label(multi, code_id(MULTI_SCHEME, 0), "2020-06-02T10:00:00+00:00", checked=False)
+        ]),
+        # No labels.
+        Message("msg-4", "text 4", "2020-06-01T10:00:00+00:00", [])
+    ]
+    return [message.to_firebase_map() for message in messages]
+
+
+def make_data():
+    metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+    existing_multi_label = make_label(MULTI_SCHEME.scheme_id, code_id(MULTI_SCHEME, 4),
+                                      "2020-05-01T10:00:00+00:00").to_dict()
+    existing_single_label = make_label(SINGLE_SCHEME.scheme_id, code_id(SINGLE_SCHEME, 1),
+                                       "2020-05-01T10:00:00+00:00").to_dict()
+    return [
+        TracedData({"id": "msg-1", "multi_coded": [existing_multi_label]}, metadata),
+        TracedData({"id": "msg-1"}, metadata),
+        TracedData({"id": "msg-2"}, metadata),
+        TracedData({"id": "msg-3", "single_coded": existing_single_label}, metadata),
+        TracedData({"id": "msg-4"}, metadata),
+        TracedData({"id": "msg-not-in-coda", "single_coded": existing_single_label}, metadata),
+        TracedData({"text": "no message id"}, metadata)
+    ]
+
+
+def comparable(value):
+    # NOT_REVIEWED labels are created by the importer, so their origin and time depend on the implementation.
+    def comparable_label(label):
+        if label["CodeID"] in {SINGLE_SCHEME.get_code_with_control_code(Codes.NOT_REVIEWED).code_id,
+                               MULTI_SCHEME.get_code_with_control_code(Codes.NOT_REVIEWED).code_id}:
+            return {"SchemeID": label["SchemeID"], "CodeID": label["CodeID"]}
+        return label
+
+    if isinstance(value, list):
+        return [comparable_label(label) for label in value]
+    if isinstance(value, dict):
+        return comparable_label(value)
+    return value
+
+
+class TestCodaDataset(unittest.TestCase):
+    def test_apply_labels_matches_traced_data_coda_v2_io(self):
+        coda_messages = make_coda_messages()
+
+        expected = make_data()
+        TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable(
+            USER, expected, "id", {"single_coded": SINGLE_SCHEME}, io.StringIO(json.dumps(coda_messages)))
+        TracedDataCodaV2IO.import_coda_2_to_traced_data_iterable_multi_coded(
+            USER, expected, "id", {"multi_coded": MULTI_SCHEME}, io.StringIO(json.dumps(coda_messages)))
+
+        actual = make_data()
+        CodaDataset(coda_messages).apply_labels(
+            USER, actual, "id", {"single_coded": SINGLE_SCHEME}, {"multi_coded": MULTI_SCHEME})
+
+        self.assertEqual(len(actual), len(expected))
+        for actual_td, expected_td in zip(actual, expected):
+            self.assertEqual(
+                {key: comparable(value) for key, value in actual_td.items()},
+                {key: comparable(value) for key, value in expected_td.items()}
+            )
+
+    def test_multi_coded_labels_are_replayed_in_coda_order(self):
+        data = make_data()[1:2]
+        CodaDataset(make_coda_messages()).apply_labels(USER, data, "id", dict(), {"multi_coded": MULTI_SCHEME})
+
+        # Replaying msg-1's labels oldest first labels '-1' before '-2', so the newest code in '-1' comes first.
+        # Joining the labels per duplicate scheme instead would put the code in '-2' first.
+        self.assertEqual(
+            [(label["SchemeID"], label["CodeID"]) for label in data[0]["multi_coded"]],
+            [(MULTI_SCHEME.scheme_id, code_id(MULTI_SCHEME, 1)), (MULTI_SCHEME.scheme_id, code_id(MULTI_SCHEME, 0))]
+        )
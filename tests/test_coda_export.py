@@ -0,0 +1,84 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from core_data_modules.data_models import Label, Origin
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.traced_data.io import TracedDataCodaV2IO
+
+from configurations.code_schemes import CodeSchemes
+from src.lib import CodaExportManifest, CodaMessagesWriter
+
+USER = "test_user"
+SINGLE_SCHEME = CodeSchemes.GENDER
+MULTI_SCHEME = CodeSchemes.KAKUMA_S01E01
+SCHEME_KEY_MAP = {"single_coded": SINGLE_SCHEME, "multi_coded": MULTI_SCHEME}
+
+
+def make_label(scheme, code_index, date_time_utc="2020-06-02T10:00:00+00:00"):
+    return Label(scheme.scheme_id, scheme.codes[code_index].code_id, date_time_utc,
+                 Origin("test-cleaner", "Test Cleaner", "Automatic"), checked=False).to_dict()
+
+
+def make_data(date_time_utc="2020-06-02T10:00:00+00:00"):
+    metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+    return [
+        TracedData({"id": "msg-1", "text": "text 1", "sent_on": "2020-06-01T13:00:00+03:00",
+                    "single_coded": make_label(SINGLE_SCHEME, 0, date_time_utc),
+                    "multi_coded": [make_label(MULTI_SCHEME, 0, date_time_utc),
+                                    make_label(MULTI_SCHEME, 1, date_time_utc)]}, metadata),
+        TracedData({"id": "msg-2", "text": "text 2", "sent_on": "2020-06-01T14:00:00+03:00"}, metadata),
+        # A second message with the same id, which is only exported once.
+        TracedData({"id": "msg-1", "text": "text 1", "sent_on": "2020-06-01T13:00:00+03:00"}, metadata),
+        TracedData({"id": "msg-3", "sent_on": "2020-06-01T15:00:00+03:00"}, metadata)
+    ]
+
+
+class TestCodaMessagesWriter(unittest.TestCase):
+    def test_write_matches_traced_data_coda_v2_io(self):
+        expected = io.StringIO()
+        TracedDataCodaV2IO.export_traced_data_iterable_to_coda_2(
+            make_data(), "text", "sent_on", "id", SCHEME_KEY_MAP, expected)
+
+        actual = io.StringIO()
+        messages_count = CodaMessagesWriter.write(make_data(), "text", "sent_on", "id", SCHEME_KEY_MAP, actual)
+
+        self.assertEqual(messages_count, 2)
+        self.assertEqual(json.loads(actual.getvalue()), json.loads(expected.getvalue()))
+
+
+class TestCodaExportManifest(unittest.TestCase):
+    def content_hash(self, data):
+        return CodaExportManifest.content_hash(data, "text", "sent_on", "id", SCHEME_KEY_MAP)
+
+    def test_content_hash_ignores_label_times(self):
+        self.assertEqual(self.content_hash(make_data("2020-06-02T10:00:00+00:00")),
+                         self.content_hash(make_data("2020-06-03T10:00:00+00:00")))
+
+    def test_content_hash_covers_labels(self):
+        data = make_data()
+        data[0].append_data({"single_coded": make_label(SINGLE_SCHEME, 1)}, Metadata(USER, "test", "2020-06-04"))
+        self.assertNotEqual(self.content_hash(data), self.content_hash(make_data()))
+
+    def test_content_hash_covers_schemes(self):
+        self.assertNotEqual(
+            CodaExportManifest.content_hash(make_data(), "text", "sent_on", "id", {"single_coded": SINGLE_SCHEME}),
+            self.content_hash(make_data())
+        )
+
+    def test_is_unchanged_after_save(self):
+        with tempfile.TemporaryDirectory() as coda_output_dir:
+            content_hash = self.content_hash(make_data())
+
+            manifest = CodaExportManifest(coda_output_dir)
+            manifest.update("messages.json", content_hash)
+            manifest.save()
+
+            # The file itself must still exist for the manifest's hash to be trusted.
+            self.assertFalse(CodaExportManifest(coda_output_dir).is_unchanged("messages.json", content_hash))
+            with open(os.path.join(coda_output_dir, "messages.json"), "w") as f:
+                f.write("[]")
+            self.assertTrue(CodaExportManifest(coda_output_dir).is_unchanged("messages.json", content_hash))
+            self.assertFalse(CodaExportManifest(coda_output_dir).is_unchanged("messages.json", "other hash"))
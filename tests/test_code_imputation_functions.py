@@ -0,0 +1,78 @@
+import unittest
+
+from core_data_modules.data_models.code_scheme import CodeTypes
+from core_data_modules.traced_data import Metadata, TracedData
+
+from configurations import code_imputation_functions
+from configurations.code_schemes import CodeSchemes
+from src.lib import LabelTemplates, MetadataFactory
+from src.lib.configuration_objects import CodingConfiguration, CodingModes
+
+USER = "test_user"
+AGE_CC = CodingConfiguration(coding_mode=CodingModes.SINGLE, code_scheme=CodeSchemes.AGE, coded_field="age_coded",
+                             fold_strategy=None, analysis_file_key="age")
+AGE_CATEGORY_CC = CodingConfiguration(coding_mode=CodingModes.SINGLE, code_scheme=CodeSchemes.AGE_CATEGORY,
+                                      coded_field="age_category_coded", fold_strategy=None,
+                                      analysis_file_key="age_category")
+
+
+def age_category_code_per_message(age_code):
+    # The age category code impute_age_category assigned before it ran over columns, which searched the age
+    # categories and the code schemes for each message in turn.
+    if age_code.code_type == CodeTypes.NORMAL:
+        age_category = None
+        for age_range, category in code_imputation_functions.AGE_CATEGORIES.items():
+            if age_range[0] <= age_code.numeric_value <= age_range[1]:
+                age_category = category
+        assert age_category is not None
+        return CodeSchemes.AGE_CATEGORY.get_code_with_match_value(age_category)
+    elif age_code.code_type == CodeTypes.META:
+        return CodeSchemes.AGE_CATEGORY.get_code_with_meta_code(age_code.meta_code)
+    else:
+        assert age_code.code_type == CodeTypes.CONTROL
+        return CodeSchemes.AGE_CATEGORY.get_code_with_control_code(age_code.control_code)
+
+
+def categorised_age_codes():
+    # The age codes which are in an age category, or which have a code with the same control or meta code in the
+    # age category scheme.
+    age_codes = []
+    for code in CodeSchemes.AGE.codes:
+        try:
+            age_category_code_per_message(code)
+        except (AssertionError, KeyError, ValueError):
+            continue
+        age_codes.append(code)
+    return age_codes
+
+
+class TestImputeAgeCategory(unittest.TestCase):
+    def test_impute_age_category_codes_matches_per_message_imputation(self):
+        age_codes = categorised_age_codes()
+        self.assertGreater(len([code for code in age_codes if code.code_type == CodeTypes.NORMAL]), 0)
+        self.assertGreater(len([code for code in age_codes if code.code_type != CodeTypes.NORMAL]), 0)
+
+        # Repeat the codes so that the cached category codes are used as well.
+        age_codes = age_codes + age_codes
+        actual = code_imputation_functions.impute_age_category_codes(
+            CodeSchemes.AGE, CodeSchemes.AGE_CATEGORY,
+            [code.code_id for code in age_codes], [code.numeric_value for code in age_codes]
+        )
+
+        self.assertEqual([code.code_id for code in actual],
+                         [age_category_code_per_message(code).code_id for code in age_codes])
+
+    def test_impute_age_category_writes_one_label_per_message(self):
+        metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+        label_templates = LabelTemplates(MetadataFactory(USER))
+        age_codes = categorised_age_codes()
+        data = [
+            TracedData({AGE_CC.coded_field: label_templates.coded_value_with_code(AGE_CC, code)}, metadata)
+            for code in age_codes
+        ]
+
+        code_imputation_functions.impute_age_category(data, [AGE_CC, AGE_CATEGORY_CC], label_templates)
+
+        for td, age_code in zip(data, age_codes):
+            self.assertEqual(td[AGE_CATEGORY_CC.coded_field]["SchemeID"], CodeSchemes.AGE_CATEGORY.scheme_id)
+            self.assertEqual(td[AGE_CATEGORY_CC.coded_field]["CodeID"], age_category_code_per_message(age_code).code_id)
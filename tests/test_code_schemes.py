@@ -0,0 +1,45 @@
+import unittest
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.data_models import CodeScheme
+from core_data_modules.data_models.code_scheme import CodeTypes
+
+from configurations.code_schemes import CodeSchemes, CodeSchemeLookup
+
+SCHEMES = [value for value in vars(CodeSchemes).values() if isinstance(value, CodeScheme)]
+
+
+class TestCodeSchemeLookup(unittest.TestCase):
+    def test_lookups_match_code_scheme_searches(self):
+        self.assertGreater(len(SCHEMES), 0)
+        for scheme in SCHEMES:
+            lookup = CodeSchemeLookup.for_scheme(scheme)
+            for code in scheme.codes:
+                self.assertIs(lookup.code_with_code_id(code.code_id), scheme.get_code_with_code_id(code.code_id))
+                self.assertEqual(lookup.position_of(code.code_id), scheme.codes.index(code))
+                if code.control_code is not None:
+                    self.assertIs(lookup.code_with_control_code(code.control_code),
+                                  scheme.get_code_with_control_code(code.control_code))
+                if code.meta_code is not None:
+                    self.assertIs(lookup.code_with_meta_code(code.meta_code),
+                                  scheme.get_code_with_meta_code(code.meta_code))
+                for match_value in code.match_values or []:
+                    self.assertIs(lookup.code_with_match_value(match_value),
+                                  scheme.get_code_with_match_value(match_value))
+
+                flags = lookup.flags(code.code_id)
+                self.assertEqual(flags.is_stop, code.control_code == Codes.STOP)
+                self.assertEqual(flags.is_normal, code.code_type == CodeTypes.NORMAL)
+                self.assertEqual(flags.is_noise_other_channel, code.control_code == Codes.NOISE_OTHER_CHANNEL)
+                self.assertEqual(flags.string_value, code.string_value)
+
+    def test_for_scheme_shares_one_lookup_per_scheme(self):
+        self.assertIs(CodeSchemeLookup.for_scheme(CodeSchemes.GENDER), CodeSchemeLookup.for_scheme(CodeSchemes.GENDER))
+        self.assertIsNot(CodeSchemeLookup.for_scheme(CodeSchemes.GENDER), CodeSchemeLookup.for_scheme(CodeSchemes.AGE))
+
+    def test_missing_codes_raise_key_error(self):
+        lookup = CodeSchemeLookup.for_scheme(CodeSchemes.GENDER)
+        with self.assertRaises(KeyError):
+            lookup.code_with_code_id("not a code id")
+        with self.assertRaises(KeyError):
+            lookup.code_with_match_value("not a match value")
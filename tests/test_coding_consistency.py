@@ -0,0 +1,141 @@
+import random
+import tempfile
+import unittest
+
+from core_data_modules.cleaners import Codes
+from core_data_modules.traced_data import Metadata, TracedData
+
+from configurations.code_schemes import CodeSchemes
+from src.lib import PipelineConfiguration, CodingConsistency
+from src.lib.configuration_objects import CodingModes
+from src.ws_correction import WSCorrection
+
+USER = "test_user"
+
+
+def use_kakuma_configuration(test_case):
+    original_configuration = (PipelineConfiguration.RQA_CODING_PLANS, PipelineConfiguration.SURVEY_CODING_PLANS,
+                              CodeSchemes.WS_CORRECT_DATASET_SCHEME)
+
+    def restore_configuration():
+        (PipelineConfiguration.RQA_CODING_PLANS, PipelineConfiguration.SURVEY_CODING_PLANS,
+         CodeSchemes.WS_CORRECT_DATASET_SCHEME) = original_configuration
+
+    test_case.addCleanup(restore_configuration)
+    PipelineConfiguration.RQA_CODING_PLANS = PipelineConfiguration.KAKUMA_RQA_CODING_PLANS
+    PipelineConfiguration.SURVEY_CODING_PLANS = PipelineConfiguration.KAKUMA_SURVEY_CODING_PLANS
+    CodeSchemes.WS_CORRECT_DATASET_SCHEME = CodeSchemes.KAKUMA_WS_CORRECT_DATASET_SCHEME
+
+
+def find_coding_errors_per_message(data, coding_plans, coded_field_suffix, correct_dataset_suffix):
+    # The check this pipeline ran before `CodingConsistency`, which decoded the labels of each message in turn.
+    coding_errors = []
+    for plan in coding_plans:
+        rows = []
+        for i, td in enumerate(data):
+            codes = []
+            for cc in plan.coding_configurations:
+                coded_key = f"{cc.coded_field}{coded_field_suffix}"
+                if coded_key not in td:
+                    continue
+                if cc.coding_mode == CodingModes.SINGLE:
+                    codes.append(cc.code_scheme.get_code_with_code_id(td[coded_key]["CodeID"]))
+                else:
+                    for label in td[coded_key]:
+                        codes.append(cc.code_scheme.get_code_with_code_id(label["CodeID"]))
+            has_ws_code_in_code_scheme = any(code.control_code == Codes.WRONG_SCHEME for code in codes)
+
+            has_ws_code_in_ws_scheme = False
+            correct_dataset_key = f"{plan.raw_field}{correct_dataset_suffix}"
+            if correct_dataset_key in td:
+                ws_code = CodeSchemes.WS_CORRECT_DATASET_SCHEME.get_code_with_code_id(td[correct_dataset_key]["CodeID"])
+                has_ws_code_in_ws_scheme = ws_code.code_type == "Normal" or ws_code.control_code == Codes.NOT_CODED
+
+            if has_ws_code_in_code_scheme != has_ws_code_in_ws_scheme:
+                rows.append(i)
+        coding_errors.append((plan, rows))
+
+    return coding_errors
+
+
+def generate_data(coding_plans, messages_count, seed=0):
+    rng = random.Random(seed)
+    metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+
+    def random_code_id(scheme):
+        # Bias towards WRONG_SCHEME so that both sides of the check are well covered.
+        ws_codes = [code for code in scheme.codes if code.control_code == Codes.WRONG_SCHEME]
+        if rng.random() < 0.3 and len(ws_codes) > 0:
+            return ws_codes[0].code_id
+        return rng.choice(scheme.codes).code_id
+
+    data = []
+    for _ in range(messages_count):
+        d = dict()
+        for plan in coding_plans:
+            if rng.random() < 0.2:
+                continue
+            for cc in plan.coding_configurations:
+                if cc.coding_mode == CodingModes.SINGLE:
+                    d[f"{cc.coded_field}_WS"] = {"CodeID": random_code_id(cc.code_scheme)}
+                else:
+                    d[f"{cc.coded_field}_WS"] = [{"CodeID": random_code_id(cc.code_scheme)}
+                                                 for _ in range(rng.randint(1, 3))]
+            if rng.random() < 0.9:
+                d[f"{plan.raw_field}_WS_correct_dataset"] = \
+                    {"CodeID": rng.choice(CodeSchemes.WS_CORRECT_DATASET_SCHEME.codes).code_id}
+        data.append(TracedData(d, metadata))
+
+    return data
+
+
+class TestCodingConsistency(unittest.TestCase):
+    def setUp(self):
+        use_kakuma_configuration(self)
+        self.coding_plans = PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS
+
+    def test_find_coding_errors_matches_per_message_check(self):
+        data = generate_data(self.coding_plans, 500)
+
+        expected = find_coding_errors_per_message(data, self.coding_plans, "_WS", "_WS_correct_dataset")
+        actual = CodingConsistency.find_coding_errors(data, self.coding_plans, "_WS", "_WS_correct_dataset")
+
+        self.assertEqual([(plan.raw_field, rows) for plan, rows in actual],
+                         [(plan.raw_field, rows) for plan, rows in expected])
+        self.assertGreater(sum(len(rows) for _, rows in actual), 0)
+
+
+class TestMoveWrongSchemeMessages(unittest.TestCase):
+    def setUp(self):
+        use_kakuma_configuration(self)
+
+    @staticmethod
+    def make_data():
+        metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+        data = []
+        for i in range(20):
+            plan = PipelineConfiguration.RQA_CODING_PLANS[i % len(PipelineConfiguration.RQA_CODING_PLANS)]
+            data.append(TracedData({
+                "uid": f"uid-{i % 7}",
+                plan.raw_field: f"message {i}",
+                plan.time_field: f"2020-06-01T10:{i:02}:00+03:00",
+            }, metadata))
+        return data
+
+    def test_move_wrong_scheme_messages_with_uncoded_datasets(self):
+        with tempfile.TemporaryDirectory() as coda_input_dir:
+            for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
+                if plan.coda_filename is not None:
+                    with open(f"{coda_input_dir}/{plan.coda_filename}", "w") as f:
+                        f.write("[]")
+
+            serial = WSCorrection.move_wrong_scheme_messages(USER, self.make_data(), coda_input_dir)
+            parallel = WSCorrection.move_wrong_scheme_messages(USER, self.make_data(), coda_input_dir, processes=2)
+
+        # Nothing is coded, so no messages move and every message comes back out.
+        raw_fields = [plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS]
+        for corrected_data in [serial, parallel]:
+            self.assertEqual(
+                sorted((td["uid"], field, td[field]) for td in corrected_data for field in raw_fields if field in td),
+                sorted((td["uid"], field, td[field]) for td in self.make_data() for field in raw_fields if field in td)
+            )
@@ -0,0 +1,78 @@
+import csv
+import os
+import random
+import tempfile
+import unittest
+
+from core_data_modules.traced_data import Metadata, TracedData
+
+from src import AutoCode
+from src.lib import PipelineConfiguration, ICRSampler, ICRTools
+from tests.test_coding_consistency import use_kakuma_configuration
+
+USER = "test_user"
+
+
+def sample(items, sample_size, seed, deduplicate_key=None):
+    sampler = ICRSampler(sample_size, random.Random(seed), deduplicate_key)
+    for item in items:
+        sampler.add(item)
+    return sampler.sample()
+
+
+class TestICRSampler(unittest.TestCase):
+    def test_returns_every_item_if_there_are_too_few(self):
+        self.assertEqual(sample(range(5), 10, 0), [0, 1, 2, 3, 4])
+
+    def test_sample_is_deterministic_for_a_seed(self):
+        self.assertEqual(sample(range(1000), 20, 1), sample(range(1000), 20, 1))
+        self.assertNotEqual(sample(range(1000), 20, 1), sample(range(1000), 20, 2))
+
+        items = sample(range(1000), 20, 1)
+        self.assertEqual(len(items), 20)
+        self.assertEqual(len(set(items)), 20)
+
+    def test_every_item_is_equally_likely(self):
+        trials = 4000
+        counts = [0] * 10
+        for seed in range(trials):
+            for item in sample(range(10), 2, seed):
+                counts[item] += 1
+
+        # Each item is expected in 1/5 of the samples, i.e. 800 times. Allow about 5 standard deviations.
+        for count in counts:
+            self.assertAlmostEqual(count, trials * 2 / 10, delta=130)
+
+    def test_deduplicate_key_matches_generate_sample_for_icr(self):
+        items = [{"text": f"message {i % 30}", "i": i} for i in range(100)]
+
+        # Only the first item with each text is eligible, and there are fewer of those than the sample size.
+        self.assertEqual(
+            sorted(item["i"] for item in sample(items, 100, 0, deduplicate_key="text")),
+            sorted(item["i"] for item in ICRTools.generate_sample_for_icr(items, 100, random.Random(0), "text"))
+        )
+        self.assertEqual(sorted(item["i"] for item in sample(items, 100, 0, deduplicate_key="text")), list(range(30)))
+
+
+class TestExportICR(unittest.TestCase):
+    def setUp(self):
+        use_kakuma_configuration(self)
+
+    def test_single_pass_matches_a_sampler_per_plan(self):
+        rqa_plans = PipelineConfiguration.RQA_CODING_PLANS
+        metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+        data = []
+        for i in range(2000):
+            plan = rqa_plans[i % len(rqa_plans)]
+            data.append(TracedData({plan.run_id_field: f"run-{i}", plan.raw_field: f"message {i}"}, metadata))
+
+        with tempfile.TemporaryDirectory() as icr_output_dir:
+            AutoCode.export_icr(data, icr_output_dir)
+
+            for plan in rqa_plans:
+                with open(os.path.join(icr_output_dir, plan.icr_filename), "r") as f:
+                    actual = [row[plan.raw_field] for row in csv.DictReader(f)]
+
+                expected = sample([td for td in data if plan.raw_field in td], AutoCode.ICR_MESSAGES_COUNT,
+                                  AutoCode.ICR_SEED)
+                self.assertEqual(actual, [td[plan.raw_field] for td in expected])
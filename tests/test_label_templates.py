@@ -0,0 +1,80 @@
+import unittest
+
+from core_data_modules.cleaners import Codes
+
+from benchmarks.apply_manual_codes_labels import generate_data, impute_missing_and_noise_codes_per_message
+from configurations.code_schemes import CodeSchemes
+from src import ApplyManualCodes
+from src.lib import LabelTemplates, MetadataFactory
+from src.lib.configuration_objects import CodingConfiguration, CodingModes
+from tests.test_coding_consistency import use_kakuma_configuration
+
+USER = "test_user"
+
+
+def comparable(value):
+    # The labels' times and origin ids depend on when and where they were built, so leave those out.
+    def comparable_label(label):
+        label = dict(label)
+        label.pop("DateTimeUTC")
+        label["Origin"] = {k: v for k, v in label["Origin"].items() if k != "OriginID"}
+        return label
+
+    if isinstance(value, list):
+        return [comparable_label(label) if isinstance(label, dict) else label for label in value]
+    if isinstance(value, dict) and "CodeID" in value:
+        return comparable_label(value)
+    return value
+
+
+class TestLabelTemplates(unittest.TestCase):
+    def test_labels_are_independent_copies(self):
+        label_templates = LabelTemplates(MetadataFactory(USER))
+
+        label = label_templates.label(CodeSchemes.GENDER, Codes.TRUE_MISSING)
+        self.assertEqual(label["CodeID"], CodeSchemes.GENDER.get_code_with_control_code(Codes.TRUE_MISSING).code_id)
+        label["CodeID"] = "modified"
+        label["Origin"]["OriginID"] = "modified"
+
+        label = label_templates.label(CodeSchemes.GENDER, Codes.TRUE_MISSING)
+        self.assertEqual(label["CodeID"], CodeSchemes.GENDER.get_code_with_control_code(Codes.TRUE_MISSING).code_id)
+        self.assertNotEqual(label["Origin"]["OriginID"], "modified")
+
+    def test_coded_value_follows_the_coding_mode(self):
+        label_templates = LabelTemplates(MetadataFactory(USER))
+        single_cc = CodingConfiguration(CodingModes.SINGLE, CodeSchemes.GENDER, "gender_coded", fold_strategy=None)
+        multiple_cc = CodingConfiguration(CodingModes.MULTIPLE, CodeSchemes.GENDER, "gender_coded", fold_strategy=None)
+
+        label = label_templates.label(CodeSchemes.GENDER, Codes.NOT_CODED)
+        self.assertEqual(label_templates.coded_value(single_cc, Codes.NOT_CODED), label)
+        self.assertEqual(label_templates.coded_value(multiple_cc, Codes.NOT_CODED), [label])
+
+        code = CodeSchemes.GENDER.codes[0]
+        self.assertEqual(label_templates.coded_value_with_code(single_cc, code)["CodeID"], code.code_id)
+        self.assertEqual([label["CodeID"] for label in label_templates.coded_value_with_code(multiple_cc, code)],
+                         [code.code_id])
+
+    def test_strict_mode_builds_every_label(self):
+        metadata_factory = MetadataFactory(USER)
+        metadata_factory.strict = True
+        label_templates = LabelTemplates(metadata_factory)
+
+        # The labels are built on different lines, so their origins differ.
+        first = label_templates.label(CodeSchemes.GENDER, Codes.NOT_CODED)
+        second = label_templates.label(CodeSchemes.GENDER, Codes.NOT_CODED)
+        self.assertNotEqual(first["Origin"]["OriginID"], second["Origin"]["OriginID"])
+
+
+class TestImputeMissingAndNoiseCodes(unittest.TestCase):
+    def setUp(self):
+        use_kakuma_configuration(self)
+
+    def test_matches_labels_built_per_message(self):
+        expected = generate_data(USER, 200)
+        impute_missing_and_noise_codes_per_message(USER, expected)
+
+        actual = generate_data(USER, 200)
+        ApplyManualCodes._impute_missing_and_noise_codes(USER, actual)
+
+        self.assertEqual([{k: comparable(v) for k, v in td.items()} for td in actual],
+                         [{k: comparable(v) for k, v in td.items()} for td in expected])
@@ -0,0 +1,45 @@
+import unittest
+
+from core_data_modules.traced_data import Metadata, TracedData
+
+from benchmarks.combine_raw_datasets import generate_datasets, combine_with_update_iterable
+from src import LoadData
+
+USER = "test_user"
+
+
+def make_overlapping_datasets():
+    # Two survey datasets which both answer 'age_raw' for some contacts, so the order they are combined in matters.
+    metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+    messages = [
+        TracedData({"avf_phone_id": f"avf-phone-uuid-{i % 4}", "text": f"message {i}"}, metadata) for i in range(12)
+    ]
+    surveys_datasets = [
+        [TracedData({"avf_phone_id": f"avf-phone-uuid-{i}", "age_raw": f"{20 + i}", "gender_raw": "f"}, metadata)
+         for i in range(3)],
+        [TracedData({"avf_phone_id": f"avf-phone-uuid-{i}", "age_raw": f"{30 + i}"}, metadata)
+         for i in range(1, 3)]
+    ]
+    return [messages], surveys_datasets
+
+
+class TestCombineRawDatasets(unittest.TestCase):
+    def assert_matches_update_iterable(self, make_datasets):
+        expected = combine_with_update_iterable(USER, *make_datasets())
+
+        messages_datasets, surveys_datasets = make_datasets()
+        survey_items = [[dict(survey.items()) for survey in dataset] for dataset in surveys_datasets]
+        actual = LoadData.combine_raw_datasets(USER, messages_datasets, surveys_datasets)
+
+        self.assertEqual([dict(td.items()) for td in actual], [dict(td.items()) for td in expected])
+        # The survey runs themselves must not be modified by joining them.
+        self.assertEqual([[dict(survey.items()) for survey in dataset] for dataset in surveys_datasets], survey_items)
+
+    def test_combine_raw_datasets_matches_update_iterable(self):
+        self.assert_matches_update_iterable(lambda: generate_datasets(USER, 200))
+
+    def test_later_survey_datasets_take_precedence(self):
+        self.assert_matches_update_iterable(make_overlapping_datasets)
+
+        actual = LoadData.combine_raw_datasets(USER, *make_overlapping_datasets())
+        self.assertEqual([td.get("age_raw") for td in actual[:4]], ["20", "31", "32", None])
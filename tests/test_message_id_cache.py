@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.traced_data.io import TracedDataCodaV2IO
+
+from src.lib import MessageIdCache
+
+USER = "test_user"
+
+
+def make_data():
+    metadata = Metadata(USER, "test", "2020-06-01T10:00:00+00:00")
+    return [
+        TracedData({"rqa_raw": "hello", "survey_raw": "20"}, metadata),
+        TracedData({"rqa_raw": "hello"}, metadata),
+        TracedData({"rqa_raw": "20", "survey_raw": "hello"}, metadata),
+        TracedData({"survey_raw": "Hello "}, metadata),
+        TracedData({"rqa_raw": ""}, metadata)
+    ]
+
+
+def coda_message_id(text):
+    data = [TracedData({"text": text}, Metadata(USER, "test", "2020-06-01T10:00:00+00:00"))]
+    TracedDataCodaV2IO.compute_message_ids(USER, data, "text", "id")
+    return data[0]["id"]
+
+
+class TestMessageIdCache(unittest.TestCase):
+    def test_compute_message_ids_matches_traced_data_coda_v2_io(self):
+        expected = make_data()
+        TracedDataCodaV2IO.compute_message_ids(USER, expected, "rqa_raw", "rqa_raw_id")
+        TracedDataCodaV2IO.compute_message_ids(USER, expected, "survey_raw", "survey_raw_id")
+
+        actual = make_data()
+        cache = MessageIdCache()
+        cache.compute_message_ids(USER, actual, "rqa_raw", "rqa_raw_id")
+        cache.compute_message_ids(USER, actual, "survey_raw", "survey_raw_id")
+
+        self.assertEqual([dict(td.items()) for td in actual], [dict(td.items()) for td in expected])
+        # "hello" and "20" are each hashed once, whichever raw field they are in.
+        self.assertEqual((cache.hits, cache.misses), (3, 4))
+
+    def test_save_keeps_only_the_texts_used_in_this_run(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, "message_ids.pickle")
+
+            cache = MessageIdCache(cache_path)
+            cache.message_id("old text")
+            cache.save()
+
+            cache = MessageIdCache(cache_path)
+            self.assertEqual(cache.message_id("old text"), coda_message_id("old text"))
+            self.assertEqual(cache.hits, 1)
+            cache.save()
+
+            cache = MessageIdCache(cache_path)
+            cache.message_id("new text")
+            cache.save()
+
+            cache = MessageIdCache(cache_path)
+            cache.message_id("old text")
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_caches_from_other_versions_are_ignored(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, "message_ids.pickle")
+
+            cache = MessageIdCache(cache_path)
+            cache.message_id("text")
+            cache.VERSION = MessageIdCache.VERSION + 1
+            cache.save()
+
+            cache = MessageIdCache(cache_path)
+            cache.message_id("text")
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
@@ -0,0 +1,90 @@
+import unittest
+
+from core_data_modules.traced_data import Metadata, TracedData
+
+from src.lib import MetadataFactory, TracedDataBatch
+
+USER = "test_user"
+
+
+def make_td():
+    return TracedData({"a": 1, "b": 2, "c": 3}, Metadata(USER, "test", "2020-06-01T10:00:00+00:00"))
+
+
+def apply_updates(td, updates):
+    for method, argument in updates:
+        getattr(td, method)(argument, Metadata(USER, "test", "2020-06-01T11:00:00+00:00"))
+
+
+UPDATES = [
+    ("append_data", {"a": 10, "d": 4}),
+    ("hide_keys", {"b"}),
+    ("append_data", {"b": 20, "e": 5}),
+    ("hide_keys", {"c", "e"}),
+    ("append_data", {"a": 100})
+]
+
+
+class TestTracedDataBatch(unittest.TestCase):
+    def test_reads_and_commit_match_updating_the_traced_data(self):
+        expected = make_td()
+        td = make_td()
+        batch = TracedDataBatch(td, MetadataFactory(USER))
+
+        def check_reads():
+            self.assertEqual(set(batch.keys()), set(expected.keys()))
+            self.assertEqual(dict(batch.items()), dict(expected.items()))
+            for key in ["a", "b", "c", "d", "e", "f"]:
+                self.assertEqual(key in batch, key in expected)
+                self.assertEqual(batch.get(key), expected.get(key))
+
+        for method, argument in UPDATES:
+            getattr(batch, method)(argument)
+            apply_updates(expected, [(method, argument)])
+            check_reads()
+
+        # Nothing is written to the TracedData until the batch is committed.
+        self.assertEqual(dict(td.items()), dict(make_td().items()))
+
+        batch.commit()
+        self.assertEqual(dict(td.items()), dict(expected.items()))
+        check_reads()
+
+    def test_commit_writes_one_layer_per_key(self):
+        td = make_td()
+        batch = TracedDataBatch(td, MetadataFactory(USER))
+        apply_updates(batch, UPDATES)
+        batch.commit()
+
+        sequential = make_td()
+        apply_updates(sequential, UPDATES)
+
+        self.assertEqual(len(td.get_history("a")), 2)
+        self.assertEqual(len(sequential.get_history("a")), 3)
+
+    def test_hiding_a_key_only_appended_in_the_batch(self):
+        td = make_td()
+        with TracedDataBatch(td, MetadataFactory(USER)) as batch:
+            batch.append_data({"f": 6})
+            batch.hide_keys({"f"})
+
+        self.assertEqual(dict(td.items()), dict(make_td().items()))
+
+    def test_context_manager_discards_on_error(self):
+        td = make_td()
+        with self.assertRaises(ValueError):
+            with TracedDataBatch(td, MetadataFactory(USER)) as batch:
+                batch.append_data({"a": 10})
+                raise ValueError()
+
+        self.assertEqual(dict(td.items()), dict(make_td().items()))
+        self.assertEqual(batch["a"], 1)
+
+    def test_for_each_and_commit_all(self):
+        data = [make_td(), make_td()]
+        batches = TracedDataBatch.for_each(data, MetadataFactory(USER))
+        for i, batch in enumerate(batches):
+            batch.append_data({"i": i})
+        TracedDataBatch.commit_all(batches)
+
+        self.assertEqual([td["i"] for td in data], [0, 1])
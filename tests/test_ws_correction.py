@@ -0,0 +1,167 @@
+import unittest
+
+from core_data_modules.cleaners import Codes
+
+from benchmarks.ws_correction_routing import generate_groups
+from configurations.code_schemes import CodeSchemes
+from src.lib import PipelineConfiguration, MetadataFactory, TimestampStore
+from src.ws_correction import WSCorrection, _WSRoutingTable
+from tests.test_coding_consistency import use_kakuma_configuration
+
+USER = "test_user"
+
+
+def correct_group_with_plan_scans(group, unknown_target_code_counts):
+    """
+    The WS correction this pipeline ran for each uid before the routing table was compiled once per run, which scanned
+    the coding plans and looked up the 'WS - Correct Dataset' codes for every group.
+
+    Returns the data each corrected message should end up with, as a dict, rather than the corrected TracedData.
+    """
+    ws_code_to_raw_field_map = dict()
+    for plan in PipelineConfiguration.RQA_CODING_PLANS + PipelineConfiguration.SURVEY_CODING_PLANS:
+        if plan.ws_code is not None:
+            ws_code_to_raw_field_map[plan.ws_code.code_id] = plan.raw_field
+
+    def move_target(td, plan):
+        ws_code = CodeSchemes.WS_CORRECT_DATASET_SCHEME.get_code_with_code_id(
+            td[f"{plan.raw_field}_WS_correct_dataset"]["CodeID"])
+        if not (ws_code.code_type == "Normal" or ws_code.control_code == Codes.NOT_CODED):
+            return False, None
+        if ws_code.code_id not in ws_code_to_raw_field_map:
+            key = (ws_code.code_id, ws_code.display_text)
+            unknown_target_code_counts[key] = unknown_target_code_counts.get(key, 0) + 1
+            return True, None
+        return True, ws_code_to_raw_field_map[ws_code.code_id]
+
+    td = group[0]
+    survey_moves = dict()  # of source_field -> target_field
+    for plan in PipelineConfiguration.SURVEY_CODING_PLANS:
+        if plan.raw_field not in td or plan.coda_filename is None:
+            continue
+        moving, target_field = move_target(td, plan)
+        if moving:
+            survey_moves[plan.raw_field] = target_field
+
+    rqa_moves = dict()  # of (index in group, source_field) -> target_field
+    for i, message_td in enumerate(group):
+        for plan in PipelineConfiguration.RQA_CODING_PLANS:
+            if plan.raw_field not in message_td or plan.coda_filename is None:
+                continue
+            moving, target_field = move_target(message_td, plan)
+            if moving:
+                rqa_moves[(i, plan.raw_field)] = target_field
+
+    survey_updates = dict()  # of raw_field -> list of (message, timestamp, source_field)
+    for plan in PipelineConfiguration.SURVEY_CODING_PLANS:
+        if plan.coda_filename is None:
+            continue
+        if plan.raw_field in survey_moves:
+            survey_updates[plan.raw_field] = []
+        elif plan.raw_field in td:
+            survey_updates[plan.raw_field] = [(td[plan.raw_field], td[plan.time_field], plan.raw_field)]
+
+    rqa_updates = []  # of (target_field, (message, timestamp, source_field), source td)
+    for i, message_td in enumerate(group):
+        for plan in PipelineConfiguration.RQA_CODING_PLANS:
+            if plan.coda_filename is not None and plan.raw_field in message_td and (i, plan.raw_field) not in rqa_moves:
+                rqa_updates.append((plan.raw_field,
+                                    (message_td[plan.raw_field], message_td[plan.time_field], plan.raw_field),
+                                    message_td))
+
+    raw_survey_fields = {plan.raw_field for plan in PipelineConfiguration.SURVEY_CODING_PLANS}
+    moves = [(td, source_field, target_field) for source_field, target_field in survey_moves.items()] + \
+            [(group[i], source_field, target_field) for (i, source_field), target_field in rqa_moves.items()]
+    for source_td, source_field, target_field in moves:
+        if target_field is None:
+            continue
+        for plan in PipelineConfiguration.SURVEY_CODING_PLANS + PipelineConfiguration.RQA_CODING_PLANS:
+            if plan.raw_field == source_field:
+                update = (source_td[plan.raw_field], source_td[plan.time_field], plan.raw_field)
+                if target_field in raw_survey_fields:
+                    survey_updates[target_field] = survey_updates.get(target_field, []) + [update]
+                else:
+                    # As before, moved data is copied onto the last message in the group.
+                    rqa_updates.append((target_field, update, group[-1]))
+
+    flattened_survey_updates = dict()
+    for plan in PipelineConfiguration.SURVEY_CODING_PLANS:
+        if plan.raw_field in survey_updates:
+            plan_updates = survey_updates[plan.raw_field]
+            if len(plan_updates) > 0:
+                flattened_survey_updates[plan.raw_field] = "; ".join([u[0] for u in plan_updates])
+                flattened_survey_updates[plan.time_field] = sorted([u[1] for u in plan_updates])[0]
+                flattened_survey_updates[f"{plan.raw_field}_source"] = "; ".join([u[2] for u in plan_updates])
+            else:
+                flattened_survey_updates[plan.raw_field] = None
+                flattened_survey_updates[plan.time_field] = None
+                flattened_survey_updates[f"{plan.raw_field}_source"] = None
+
+    raw_field_to_rqa_plan = {plan.raw_field: plan for plan in PipelineConfiguration.RQA_CODING_PLANS}
+    hidden_rqa_keys = {plan.raw_field for plan in PipelineConfiguration.RQA_CODING_PLANS} | \
+                      {plan.time_field for plan in PipelineConfiguration.RQA_CODING_PLANS}
+    corrected = []
+    for target_field, (message, timestamp, source_field), source_td in rqa_updates:
+        d = dict(source_td.items())
+        for k, v in flattened_survey_updates.items():
+            if v is None:
+                d.pop(k, None)
+            else:
+                d[k] = v
+        for k in hidden_rqa_keys:
+            d.pop(k, None)
+        d[target_field] = message
+        d[raw_field_to_rqa_plan[target_field].time_field] = timestamp
+        d[f"{target_field}_source"] = source_field
+        corrected.append(d)
+
+    return corrected
+
+
+class TestWSCorrection(unittest.TestCase):
+    def setUp(self):
+        use_kakuma_configuration(self)
+        self.routing = _WSRoutingTable.compile(
+            CodeSchemes.WS_CORRECT_DATASET_SCHEME,
+            PipelineConfiguration.RQA_CODING_PLANS, PipelineConfiguration.SURVEY_CODING_PLANS
+        )
+
+    def test_correct_group_matches_plan_scans(self):
+        groups = generate_groups(USER, 300, seed=1)
+
+        expected = []
+        expected_unknown_target_code_counts = dict()
+        for group in groups:
+            expected.extend(correct_group_with_plan_scans(group, expected_unknown_target_code_counts))
+
+        actual = []
+        unknown_target_code_counts = dict()
+        timestamps = TimestampStore()
+        metadata_factory = MetadataFactory(USER)
+        for group in groups:
+            actual.extend(WSCorrection.correct_group(
+                group, self.routing, timestamps, metadata_factory, unknown_target_code_counts))
+
+        self.assertEqual([dict(td.items()) for td in actual], expected)
+        self.assertEqual(unknown_target_code_counts, expected_unknown_target_code_counts)
+        # Check the groups moved some messages, so that the routing was exercised.
+        self.assertTrue(any(k.endswith("_source") and v != k[:-len("_source")]
+                            for d in expected for k, v in d.items()))
+
+    def test_parallel_shards_match_serial_correction(self):
+        groups = generate_groups(USER, 100, seed=2)
+        uid_groups = [(group[0]["uid"], group) for group in groups]
+
+        timestamps = TimestampStore()
+        metadata_factory = MetadataFactory(USER)
+        expected = []
+        for group in groups:
+            unknown_target_code_counts = dict()
+            corrected_group = WSCorrection.correct_group(
+                group, self.routing, timestamps, metadata_factory, unknown_target_code_counts)
+            expected.append(([dict(td.items()) for td in corrected_group], unknown_target_code_counts))
+
+        actual = WSCorrection._correct_groups_in_parallel(uid_groups, self.routing, metadata_factory, 3)
+
+        self.assertEqual([([dict(td.items()) for td in corrected_group], counts) for corrected_group, counts in actual],
+                         expected)